@@ -0,0 +1,142 @@
+"""准入控制 - 有界队列 + 基于实时率估算的 429 退避"""
+import math
+import os
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """队列已满，retry_after 为建议的重试等待秒数"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """已准入请求的占位，处理结束后释放"""
+
+    def __init__(self, controller: "AdmissionController", audio_seconds: float):
+        self.controller = controller
+        self.audio_seconds = audio_seconds
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    """限制排队中（含正在处理）的请求数与音频总时长
+
+    实时率（处理耗时 / 音频时长）用指数滑动平均估计，用于计算 Retry-After 和预计等待时间。
+    """
+
+    def __init__(self, max_depth: int = 16, max_audio_seconds: float = 3600.0,
+                 initial_rtf: float = 0.1, ewma_alpha: float = 0.2):
+        self.max_depth = max_depth
+        self.max_audio_seconds = max_audio_seconds
+        self.rtf = initial_rtf
+        self.ewma_alpha = ewma_alpha
+        self.depth = 0
+        self.queued_audio_seconds = 0.0
+        self.admitted = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        return cls(
+            max_depth=int(os.environ.get('MAX_QUEUE_DEPTH', 16)),
+            max_audio_seconds=float(os.environ.get('MAX_QUEUED_AUDIO_S', 3600)),
+            initial_rtf=float(os.environ.get('INITIAL_RTF', 0.1)),
+        )
+
+    def _retry_after(self, seconds: float) -> int:
+        return max(1, math.ceil(seconds))
+
+    def check(self):
+        """仅按队列深度快速检查（读取上传内容前调用）"""
+        with self._lock:
+            if self.max_depth and self.depth >= self.max_depth:
+                self.rejected += 1
+                raise QueueFull("服务繁忙，队列已满", self._retry_after(self._slot_wait()))
+
+    def admit(self, audio_seconds: float) -> Ticket:
+        """准入一个请求，超出限制时抛出 QueueFull"""
+        with self._lock:
+            if self.max_depth and self.depth >= self.max_depth:
+                self.rejected += 1
+                raise QueueFull("服务繁忙，队列已满", self._retry_after(self._slot_wait()))
+            overflow = self.queued_audio_seconds + audio_seconds - self.max_audio_seconds
+            # 队列为空时即使单个请求超长也放行，避免永远无法处理
+            if self.max_audio_seconds and self.depth > 0 and overflow > 0:
+                self.rejected += 1
+                raise QueueFull("服务繁忙，排队音频时长已达上限", self._retry_after(overflow * self.rtf))
+            self.depth += 1
+            self.queued_audio_seconds += audio_seconds
+            self.admitted += 1
+            return Ticket(self, audio_seconds)
+
+    def _release(self, ticket: Ticket):
+        with self._lock:
+            self.depth = max(0, self.depth - 1)
+            self.queued_audio_seconds = max(0.0, self.queued_audio_seconds - ticket.audio_seconds)
+
+    def _slot_wait(self) -> float:
+        """估计空出一个队列位置所需时间：平均每个请求的处理耗时"""
+        if self.depth == 0:
+            return 0.0
+        return self.queued_audio_seconds / self.depth * self.rtf
+
+    def observe(self, audio_seconds: float, elapsed: float):
+        """记录一次实际处理的实时率"""
+        if audio_seconds <= 0:
+            return
+        with self._lock:
+            self.rtf += self.ewma_alpha * (elapsed / audio_seconds - self.rtf)
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "depth": self.depth,
+                "max_depth": self.max_depth,
+                "queued_audio_seconds": round(self.queued_audio_seconds, 1),
+                "max_queued_audio_seconds": self.max_audio_seconds,
+                "rtf": round(self.rtf, 4),
+                "estimated_wait_s": round(self.queued_audio_seconds * self.rtf, 1),
+                "saturated": bool(self.max_depth and self.depth >= self.max_depth)
+                or bool(self.max_audio_seconds and self.queued_audio_seconds >= self.max_audio_seconds),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+            }
+
+
+def probe_duration(path: str) -> float:
+    """读取音频头信息估算时长（秒），无法识别时返回 0"""
+    if path.lower().endswith('.pcm'):
+        # 原始 16kHz 16-bit 单声道 PCM，按字节数计算
+        return os.path.getsize(path) / 2 / 16000
+    try:
+        import soundfile as sf
+        info = sf.info(path)
+        return info.frames / info.samplerate
+    except Exception:
+        pass
+    try:
+        import torchaudio
+        info = torchaudio.info(path)
+        if info.num_frames and info.sample_rate:
+            return info.num_frames / info.sample_rate
+    except Exception as e:
+        logger.warning(f"无法读取音频时长: {e}")
+    return 0.0
@@ -1,16 +1,20 @@
 """Flask 主服务 - UI + API + WebSocket"""
 import os
-import json
 import tempfile
+import uuid
 import logging
 from pathlib import Path
-from flask import Flask, request, jsonify, Response, send_from_directory
+from flask import Flask, request, jsonify, Response, send_from_directory, g
 from flask_socketio import SocketIO, emit
 from flask_cors import CORS
 from flasgger import Swagger
 from werkzeug.utils import secure_filename
 
-from gpu_manager import gpu_manager
+from admission import QueueFull, probe_duration
+from gpu_manager import CLIENT_DISCONNECT, gpu_manager, TranscriptionCancelled
+from inference_core import inference_core, sse
+from quality import MODES as QUALITY_MODES
+from traffic import traffic_recorder, RECORDED_PATHS
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -36,13 +40,73 @@ swagger = Swagger(app, config=swagger_config, template={
 })
 
 UPLOAD_FOLDER = tempfile.gettempdir()
-ALLOWED_EXTENSIONS = {'wav', 'mp3', 'flac', 'm4a', 'ogg', 'webm'}
+ALLOWED_EXTENSIONS = {'wav', 'mp3', 'flac', 'm4a', 'ogg', 'webm', 'pcm'}
+# 默认请求截止时间（秒），0 表示不限制
+REQUEST_DEADLINE_S = float(os.environ.get('REQUEST_DEADLINE_S', 0))
 
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def upload_path(filename: str) -> str:
+    """上传文件的临时路径；请求并发执行，同名文件不能互相覆盖"""
+    return os.path.join(UPLOAD_FOLDER, f"{uuid.uuid4().hex}_{filename}")
+
+
+def form_bool(name):
+    """读取可选布尔表单字段，未提供时返回 None"""
+    value = request.form.get(name)
+    if value is None or value == '':
+        return None
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def form_quality():
+    """读取可选的 quality 表单字段，返回 (值, 错误响应)"""
+    value = request.form.get('quality') or None
+    if value is not None and value not in QUALITY_MODES:
+        return None, (jsonify({"error": f"quality 须为 {' / '.join(QUALITY_MODES)} 之一"}), 400)
+    return value, None
+
+
+def queue_full(e: QueueFull):
+    response = jsonify({"error": str(e), "retry_after": e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
+
+def save_and_admit(file, filepath):
+    """准入检查后保存上传文件，返回 (票据, 错误响应)"""
+    try:
+        gpu_manager.admission.check()
+        file.save(filepath)
+        duration = probe_duration(filepath)
+        traffic_recorder.annotate(filepath, duration)
+        return gpu_manager.admission.admit(duration), None
+    except QueueFull as e:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        return None, queue_full(e)
+
+
+@app.before_request
+def start_traffic_record():
+    """录制转录请求的到达时间、参数和音频时长（设置 TRAFFIC_LOG_DIR 后启用）"""
+    if request.method == 'POST' and request.path in RECORDED_PATHS:
+        g.traffic = traffic_recorder.start(f"POST {request.path}")
+
+
+@app.after_request
+def finish_traffic_record(response):
+    entry = g.pop('traffic', None)
+    if entry is not None:
+        traffic_recorder.annotate(params=request.form.to_dict())
+        # SSE 等流式响应在发送完毕后才算结束
+        response.call_on_close(lambda: traffic_recorder.finish(entry, response.status_code))
+    return response
+
+
 # ==================== UI ====================
 @app.route('/')
 def index():
@@ -71,7 +135,19 @@ def gpu_status():
       200:
         description: GPU 状态信息
     """
-    return jsonify(gpu_manager.get_status())
+    return jsonify({**gpu_manager.get_status(), "inference": inference_core.status()})
+
+
+@app.route('/queue/status', methods=['GET'])
+def queue_status():
+    """队列状态（供负载均衡判断节点是否饱和）
+    ---
+    tags: [System]
+    responses:
+      200:
+        description: 排队深度、排队音频时长、实时率估计与预计等待时间
+    """
+    return jsonify(gpu_manager.admission.status())
 
 
 @app.route('/gpu/load', methods=['POST'])
@@ -138,9 +214,30 @@ def transcribe():
         type: integer
         default: 128
         description: 最大生成 token 数
+      - name: timeout
+        in: formData
+        type: number
+        description: 截止时间（秒），超时后停止处理
+      - name: packing
+        in: formData
+        type: boolean
+        description: 长音频只拼接语音区间送入模型，跳过停顿（默认取 SEGMENT_PACKING）
+      - name: long_context
+        in: formData
+        type: boolean
+        description: 长音频把多个连续窗口合并到一个多音频提示词中生成（默认取 LONG_CONTEXT）
+      - name: quality
+        in: formData
+        type: string
+        enum: [auto, full, reduced, economy]
+        description: 质量档位，auto 时队列积压自动降档（默认取 QUALITY_DEFAULT）
     responses:
       200:
-        description: 转录结果
+        description: 转录结果，quality 为实际使用的档位
+      429:
+        description: 队列已满，Retry-After 头给出建议等待秒数
+      504:
+        description: 超过截止时间
     """
     if 'file' not in request.files:
         return jsonify({"error": "未上传文件"}), 400
@@ -150,23 +247,28 @@ def transcribe():
         return jsonify({"error": "无效的文件格式"}), 400
     
     max_new_tokens = int(request.form.get('max_new_tokens', 512))
+    quality, error = form_quality()
+    if error:
+        return error
     
     # 保存临时文件
     filename = secure_filename(file.filename)
-    filepath = os.path.join(UPLOAD_FOLDER, filename)
-    file.save(filepath)
+    filepath = upload_path(filename)
+    ticket, error = save_and_admit(file, filepath)
+    if error:
+        return error
     
+    task = inference_core.submit(filepath, max_new_tokens, float(request.form.get('timeout') or REQUEST_DEADLINE_S),
+                                 form_bool('packing'), form_bool('long_context'), ticket=ticket, cleanup_path=filepath,
+                                 quality=quality)
     try:
-        result = gpu_manager.transcribe(filepath, max_new_tokens)
-        return jsonify({"text": result, "status": "success"})
+        return jsonify({"text": task.result(), "status": "success", "quality": task.quality})
+    except TranscriptionCancelled as e:
+        return jsonify({"error": str(e)}), 504
     except RuntimeError as e:
         return jsonify({"error": str(e)}), 503
     except Exception as e:
-        logger.error(f"转录失败: {e}")
         return jsonify({"error": f"转录失败: {str(e)}"}), 500
-    finally:
-        if os.path.exists(filepath):
-            os.remove(filepath)
 
 
 # 全局进度状态
@@ -181,8 +283,6 @@ def get_progress():
 @app.route('/api/transcribe/long', methods=['POST'])
 def transcribe_long():
     """长音频转录（带进度）"""
-    global transcribe_progress
-    
     if 'file' not in request.files:
         return jsonify({"error": "未上传文件"}), 400
     
@@ -191,34 +291,27 @@ def transcribe_long():
         return jsonify({"error": "无效的文件格式"}), 400
     
     max_new_tokens = int(request.form.get('max_new_tokens', 512))
+    quality, error = form_quality()
+    if error:
+        return error
     filename = secure_filename(file.filename)
-    filepath = os.path.join(UPLOAD_FOLDER, filename)
-    file.save(filepath)
-    
-    transcribe_progress["current"] = 0
-    transcribe_progress["total"] = 0
-    transcribe_progress["text"] = ""
-    
-    def on_progress(current, total, duration, text):
-        transcribe_progress["current"] = current
-        transcribe_progress["total"] = total
-        if text:
-            transcribe_progress["text"] += text
+    filepath = upload_path(filename)
+    ticket, error = save_and_admit(file, filepath)
+    if error:
+        return error
     
+    transcribe_progress.update(current=0, total=0, text="")
+    task = inference_core.submit(filepath, max_new_tokens, ticket=ticket, cleanup_path=filepath, quality=quality)
+    for event in task.events():
+        if event["type"] == "progress":
+            transcribe_progress.update(current=event["current"], total=event["total"])
+        elif event["type"] == "partial":
+            transcribe_progress["text"] += event["text"]
+    transcribe_progress.update(current=0, total=0, text="")
     try:
-        result = gpu_manager.transcribe(filepath, max_new_tokens, on_progress)
-        transcribe_progress["current"] = 0
-        transcribe_progress["total"] = 0
-        transcribe_progress["text"] = ""
-        return jsonify({"text": result, "status": "success"})
+        return jsonify({"text": task.result(), "status": "success", "quality": task.quality})
     except Exception as e:
-        transcribe_progress["current"] = 0
-        transcribe_progress["total"] = 0
-        transcribe_progress["text"] = ""
         return jsonify({"error": str(e)}), 500
-    finally:
-        if os.path.exists(filepath):
-            os.remove(filepath)
 
 
 @app.route('/api/transcribe/stream', methods=['POST'])
@@ -233,9 +326,28 @@ def transcribe_stream():
         in: formData
         type: file
         required: true
+      - name: timeout
+        in: formData
+        type: number
+        description: 截止时间（秒），超时后停止处理
+      - name: packing
+        in: formData
+        type: boolean
+        description: 长音频只拼接语音区间送入模型，跳过停顿（默认取 SEGMENT_PACKING）
+      - name: long_context
+        in: formData
+        type: boolean
+        description: 长音频把多个连续窗口合并到一个多音频提示词中生成（默认取 LONG_CONTEXT）
+      - name: quality
+        in: formData
+        type: string
+        enum: [auto, full, reduced, economy]
+        description: 质量档位，auto 时队列积压自动降档（默认取 QUALITY_DEFAULT）
     responses:
       200:
-        description: SSE 流式响应
+        description: SSE 流式响应（start 事件携带 job_id，可用于取消；quality 事件给出实际使用的档位）
+      429:
+        description: 队列已满，Retry-After 头给出建议等待秒数
     """
     if 'file' not in request.files:
         return jsonify({"error": "未上传文件"}), 400
@@ -245,83 +357,132 @@ def transcribe_stream():
         return jsonify({"error": "无效的文件格式"}), 400
     
     max_new_tokens = int(request.form.get('max_new_tokens', 128))
+    quality, error = form_quality()
+    if error:
+        return error
     filename = secure_filename(file.filename)
-    filepath = os.path.join(UPLOAD_FOLDER, filename)
-    file.save(filepath)
+    filepath = upload_path(filename)
+    ticket, error = save_and_admit(file, filepath)
+    if error:
+        return error
+    task = inference_core.submit(filepath, max_new_tokens, float(request.form.get('timeout') or REQUEST_DEADLINE_S),
+                                 form_bool('packing'), form_bool('long_context'), ticket=ticket, cleanup_path=filepath,
+                                 quality=quality)
     
     def generate():
-        progress_data = []
-        
-        def on_progress(current, total, seg_dur, text):
-            progress_data.append((current, total, seg_dur, text))
-        
         try:
-            yield f"data: {json.dumps({'type': 'start'})}\n\n"
-            
-            # 使用线程执行转录，主线程发送进度
-            import threading
-            result_holder = [None]
-            error_holder = [None]
-            
-            def do_transcribe():
-                try:
-                    result_holder[0] = gpu_manager.transcribe(filepath, max_new_tokens, on_progress)
-                except Exception as e:
-                    error_holder[0] = str(e)
-            
-            thread = threading.Thread(target=do_transcribe)
-            thread.start()
-            
-            sent_count = 0
-            while thread.is_alive() or sent_count < len(progress_data):
-                while sent_count < len(progress_data):
-                    cur, tot, dur, txt = progress_data[sent_count]
-                    yield f"data: {json.dumps({'type': 'progress', 'current': cur, 'total': tot, 'duration': round(dur, 1)})}\n\n"
-                    if txt:
-                        yield f"data: {json.dumps({'type': 'partial', 'text': txt})}\n\n"
-                    sent_count += 1
-                if thread.is_alive():
-                    import time
-                    time.sleep(0.1)
-            
-            thread.join()
-            
-            if error_holder[0]:
-                yield f"data: {json.dumps({'type': 'error', 'message': error_holder[0]})}\n\n"
-            else:
-                yield f"data: {json.dumps({'type': 'done', 'text': result_holder[0] or ''})}\n\n"
-        except Exception as e:
-            yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+            # 没有新事件时每秒一次心跳：客户端断开时写入失败，生成器被关闭并触发取消
+            for event in task.events(heartbeat=1.0):
+                yield sse(event)
         finally:
-            if os.path.exists(filepath):
-                os.remove(filepath)
+            task.cancel(CLIENT_DISCONNECT)
     
     return Response(generate(), mimetype='text/event-stream')
 
 
+@app.route('/api/transcribe/<job_id>/cancel', methods=['POST'])
+def cancel_transcribe(job_id):
+    """取消转录任务
+    ---
+    tags: [ASR]
+    parameters:
+      - name: job_id
+        in: path
+        type: string
+        required: true
+        description: SSE start 事件返回的任务 ID
+    responses:
+      200:
+        description: 已发送取消
+      404:
+        description: 任务不存在或已结束
+    """
+    if not inference_core.cancel(job_id):
+        return jsonify({"error": "任务不存在或已结束"}), 404
+    return jsonify({"status": "cancelling", "job_id": job_id})
+
+
 # ==================== WebSocket ====================
+# 每个连接正在执行的任务，断开时取消
+socket_jobs = {}
+
+
 @socketio.on('connect')
 def handle_connect():
     emit('status', gpu_manager.get_status())
 
 
+@socketio.on('disconnect')
+def handle_disconnect():
+    for job_id in socket_jobs.pop(request.sid, []):
+        inference_core.cancel(job_id, CLIENT_DISCONNECT)
+
+
+@socketio.on('cancel')
+def handle_cancel(data):
+    job_id = (data or {}).get('job_id')
+    if inference_core.cancel(job_id):
+        emit('cancelling', {'job_id': job_id})
+    else:
+        emit('error', {'error': '任务不存在或已结束'})
+
+
 @socketio.on('transcribe')
 def handle_transcribe(data):
     """WebSocket 转录"""
+    job_id = None
+    entry = traffic_recorder.start('SOCKET transcribe')
+    status = 500
     try:
         filepath = data.get('file_path')
         max_new_tokens = data.get('max_new_tokens', 128)
         
         if not filepath or not os.path.exists(filepath):
             emit('error', {'error': '文件不存在'})
+            status = 404
+            return
+        quality = data.get('quality')
+        if quality is not None and quality not in QUALITY_MODES:
+            emit('error', {'error': f"quality 须为 {' / '.join(QUALITY_MODES)} 之一"})
+            status = 400
+            return
+        duration = probe_duration(filepath)
+        traffic_recorder.annotate(filepath, duration,
+                                  {'max_new_tokens': max_new_tokens, 'timeout': data.get('timeout'), 'quality': quality})
+        try:
+            ticket = gpu_manager.admission.admit(duration)
+        except QueueFull as e:
+            emit('error', {'error': str(e), 'retry_after': e.retry_after})
+            status = 429
             return
         
-        emit('start', {'status': 'processing'})
-        result = gpu_manager.transcribe(filepath, max_new_tokens)
-        emit('result', {'text': result})
-        emit('done', {'status': 'completed'})
+        task = inference_core.submit(filepath, max_new_tokens, float(data.get('timeout') or REQUEST_DEADLINE_S),
+                                     ticket=ticket, quality=quality)
+        job_id = task.job_id
+        socket_jobs.setdefault(request.sid, []).append(job_id)
+        for event in task.events():
+            kind = event["type"]
+            if kind == 'start':
+                emit('start', {'status': 'processing', 'job_id': job_id})
+            elif kind == 'progress':
+                emit('progress', {k: event[k] for k in ('current', 'total', 'duration')})
+            elif kind in ('partial', 'token'):
+                emit(kind, {k: v for k, v in event.items() if k != 'type'})
+            elif kind == 'done':
+                emit('result', {'text': event['text'], 'quality': event['quality']})
+                emit('done', {'status': 'completed'})
+                status = 200
+            elif kind == 'cancelled':
+                emit('cancelled', {'job_id': job_id, 'reason': event['reason']})
+                status = 499
+            elif kind == 'error':
+                emit('error', {'error': event['message']})
     except Exception as e:
         emit('error', {'error': str(e)})
+    finally:
+        traffic_recorder.finish(entry, status)
+        if job_id in socket_jobs.get(request.sid, []):
+            socket_jobs[request.sid].remove(job_id)
 
 
 @socketio.on('gpu_status')
@@ -349,6 +510,8 @@ def main():
     # 启动时立即加载模型
     logger.info("启动时加载模型...")
     gpu_manager.load(checkpoint)
+    if not gpu_manager.is_remote:
+        gpu_manager.resume_jobs()
     
     logger.info(f"服务启动: http://0.0.0.0:{port}")
     socketio.run(app, host='0.0.0.0', port=port, debug=False, allow_unsafe_werkzeug=True)
@@ -0,0 +1,133 @@
+"""自适应批大小 - 按音频 token 数估算显存，OOM 时对半拆分重试并动态调整批大小上限"""
+import os
+import logging
+import threading
+
+import torch
+
+from inference import MERGE_FACTOR, get_audio_token_length
+
+logger = logging.getLogger(__name__)
+
+SR = 16000
+# 聊天模板中除音频 token 外的提示词长度（粗略上界）
+PROMPT_TOKENS = 32
+
+
+def is_oom(e: Exception) -> bool:
+    """是否为显存（或内存）不足错误"""
+    return isinstance(e, torch.cuda.OutOfMemoryError) or "out of memory" in str(e).lower()
+
+
+class AdaptiveBatcher:
+    """批大小规划
+
+    每个样本的序列长度 = 各窗口音频 token 数（与 get_audio_token_length 一致）+ 提示词 + max_new_tokens，
+    显存估算 = 批大小 × 最长序列 × 每 token 字节数（主要是 KV cache）× 校准系数 + 每样本固定开销。
+    OOM 时把上限减半并重试剩余样本；连续成功 grow_after 批后上限加一，直到 max_batch。
+    """
+
+    def __init__(self, max_batch: int = 8, memory_limit_mb: float = 0, simulated_limit_mb: float = 0,
+                 grow_after: int = 8):
+        self.max_batch = max(1, max_batch)
+        self.ceiling = self.max_batch
+        self.memory_limit = memory_limit_mb * 1024 * 1024
+        # 注入的显存上限：估算超出时模拟 OOM，用于在 CPU 上验证拆分重试
+        self.simulated_limit = simulated_limit_mb * 1024 * 1024
+        self.grow_after = grow_after
+        self.bytes_per_token = 0
+        self.bytes_per_sequence = 0
+        self.scale = 1.0
+        self._streak = 0
+        self._lock = threading.Lock()
+        self.stats = {"batches": 0, "samples": 0, "oom_retries": 0, "largest_batch": 0}
+
+    @classmethod
+    def from_env(cls) -> "AdaptiveBatcher":
+        return cls(
+            max_batch=int(os.environ.get('MAX_BATCH_SIZE', 8)),
+            memory_limit_mb=float(os.environ.get('BATCH_MEMORY_MB', 0)),
+            simulated_limit_mb=float(os.environ.get('SIMULATED_MEMORY_MB', 0)),
+        )
+
+    def configure(self, config, dtype: torch.dtype):
+        """按模型结构计算每 token 的显存字节数和每样本的 logits 开销"""
+        text = getattr(config, 'text_config', None) or getattr(config, 'lm_config', None) or config
+        heads = text.num_attention_heads
+        kv_heads = getattr(text, 'num_key_value_heads', None) or heads
+        head_dim = getattr(text, 'head_dim', None) or text.hidden_size // heads
+        dtype_bytes = torch.finfo(dtype).bits // 8
+        # K/V 各一份，加上 prefill 阶段每个 token 的临时隐状态
+        self.bytes_per_token = (2 * text.num_hidden_layers * kv_heads * head_dim + 4 * text.hidden_size) * dtype_bytes
+        # 每步输出的 float32 logits
+        self.bytes_per_sequence = text.vocab_size * 4
+
+    @staticmethod
+    def sequence_tokens(window_samples: list, max_new_tokens: int) -> int:
+        """一个样本（若干音频窗口）的序列长度上界"""
+        audio = sum(get_audio_token_length(min(n, 30 * SR) / SR, MERGE_FACTOR) for n in window_samples)
+        return audio + PROMPT_TOKENS + max_new_tokens
+
+    def estimate(self, lengths: list) -> float:
+        """估算一批样本的显存占用（字节）"""
+        if not lengths:
+            return 0.0
+        return len(lengths) * (max(lengths) * self.bytes_per_token * self.scale + self.bytes_per_sequence)
+
+    def _budget(self) -> float:
+        if self.memory_limit:
+            return self.memory_limit
+        if torch.cuda.is_available():
+            free, _ = torch.cuda.mem_get_info()
+            return free * 0.9
+        return float('inf')
+
+    def next_batch_size(self, lengths: list) -> int:
+        """从待处理样本开头取多少个组成下一批"""
+        budget = self._budget()
+        size = 1
+        while size < min(self.ceiling, len(lengths)) and self.estimate(lengths[:size + 1]) <= budget:
+            size += 1
+        return size
+
+    def check(self, lengths: list):
+        """注入显存上限时，估算超出即抛出 OOM"""
+        if self.simulated_limit and self.estimate(lengths) > self.simulated_limit:
+            raise torch.cuda.OutOfMemoryError(
+                f"out of memory (simulated): need {self.estimate(lengths) / 2**20:.0f} MB, "
+                f"limit {self.simulated_limit / 2**20:.0f} MB")
+
+    def on_success(self, lengths: list, peak_bytes: float = None):
+        with self._lock:
+            size = len(lengths)
+            self.stats["batches"] += 1
+            self.stats["samples"] += size
+            self.stats["largest_batch"] = max(self.stats["largest_batch"], size)
+            if peak_bytes and self.bytes_per_token:
+                # 用实测峰值校准 KV cache 估算（指数滑动平均）
+                kv = size * max(lengths) * self.bytes_per_token
+                observed = max(peak_bytes - size * self.bytes_per_sequence, 0) / kv
+                self.scale += 0.2 * (observed - self.scale)
+            if size >= self.ceiling:
+                self._streak += 1
+                if self._streak >= self.grow_after and self.ceiling < self.max_batch:
+                    self.ceiling += 1
+                    self._streak = 0
+                    logger.info(f"批大小上限提高到 {self.ceiling}")
+
+    def on_oom(self, size: int):
+        with self._lock:
+            self.stats["oom_retries"] += 1
+            self.ceiling = max(1, size // 2)
+            self._streak = 0
+            logger.warning(f"批大小 {size} 显存不足，上限降为 {self.ceiling} 后重试")
+
+    def status(self) -> dict:
+        return {
+            "max_batch": self.max_batch,
+            "ceiling": self.ceiling,
+            "scale": round(self.scale, 3),
+            "memory_limit_mb": round(self.memory_limit / 2**20) if self.memory_limit else None,
+            "simulated_limit_mb": round(self.simulated_limit / 2**20) if self.simulated_limit else None,
+            **self.stats,
+        }
@@ -0,0 +1,286 @@
+"""性能基准脚本
+
+用法:
+    python bench.py packing --audio meeting1.wav meeting2.wav [--run]
+    python bench.py long_context --audio hour1.wav hour2.wav [--reference hour1.txt hour2.txt]
+    python bench.py batching --audio hour1.wav --max_batch 1 4 8 [--simulated_memory_mb 2000]
+    python bench.py stream --audio short.wav --url http://localhost:7860 --requests 200 --concurrency 8
+"""
+import argparse
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+import torchaudio
+
+from inference import MERGE_FACTOR, get_audio_token_length
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SR = 16000
+
+
+def load_wav(path: str) -> torch.Tensor:
+    wav, sr = torchaudio.load(path)
+    wav = wav[:1, :]
+    if sr != SR:
+        wav = torchaudio.transforms.Resample(sr, SR)(wav)
+    return wav[0]
+
+
+def audio_tokens(num_samples: int) -> int:
+    return get_audio_token_length(num_samples / SR, MERGE_FACTOR)
+
+
+def timed_transcribe(path: str, max_new_tokens: int, **kwargs) -> tuple:
+    from gpu_manager import gpu_manager
+    started = time.perf_counter()
+    text = gpu_manager.transcribe(path, max_new_tokens, **kwargs)
+    return text, time.perf_counter() - started
+
+
+def bench_packing(args):
+    """对比 smart_segment 分段与语音紧凑打包的音频 token 数和耗时"""
+    from vad_segmenter import detect_speech_segments, smart_segment, pack_speech_segments
+
+    from gpu_manager import gpu_manager
+
+    if args.run:
+        gpu_manager.load(args.checkpoint)
+        gpu_manager.packing_gap = args.gap
+
+    totals = {"baseline_tokens": 0, "packed_tokens": 0, "baseline_time": 0.0, "packed_time": 0.0}
+    for path in args.audio:
+        wav = load_wav(path)
+        speech = detect_speech_segments(wav, SR)
+        # 与服务端一致：分段上限取调优结果或 SEGMENT_MAX_S / SEGMENT_MIN_S
+        baseline = smart_segment(wav, sr=SR, max_duration=gpu_manager.segment_max_s,
+                                 min_duration=gpu_manager.segment_min_s)
+        packed = pack_speech_segments(speech, SR, max_duration=gpu_manager.segment_max_s, gap_duration=args.gap)
+
+        baseline_tokens = sum(audio_tokens(end - start) for start, end in baseline)
+        packed_tokens = sum(audio_tokens(w["length"]) for w in packed)
+        totals["baseline_tokens"] += baseline_tokens
+        totals["packed_tokens"] += packed_tokens
+
+        print(f"\n== {path}")
+        print(f"时长 {wav.shape[0] / SR:.1f}s, 语音 {sum(e - s for s, e in speech) / SR:.1f}s")
+        print(f"  当前分段: {len(baseline)} 段, 送入 {sum(e - s for s, e in baseline) / SR:.1f}s, "
+              f"音频 token {baseline_tokens}")
+        print(f"  紧凑打包: {len(packed)} 段, 送入 {sum(w['length'] for w in packed) / SR:.1f}s, "
+              f"音频 token {packed_tokens} (节省 {1 - packed_tokens / max(baseline_tokens, 1):.1%})")
+
+        if args.run:
+            _, baseline_time = timed_transcribe(path, args.max_new_tokens, packing=False)
+            _, packed_time = timed_transcribe(path, args.max_new_tokens, packing=True)
+            totals["baseline_time"] += baseline_time
+            totals["packed_time"] += packed_time
+            print(f"  耗时: 当前分段 {baseline_time:.2f}s, 紧凑打包 {packed_time:.2f}s "
+                  f"(节省 {1 - packed_time / max(baseline_time, 1e-9):.1%})")
+
+    print("\n== 合计")
+    print(f"音频 token: {totals['baseline_tokens']} -> {totals['packed_tokens']} "
+          f"(节省 {1 - totals['packed_tokens'] / max(totals['baseline_tokens'], 1):.1%})")
+    if args.run:
+        print(f"耗时: {totals['baseline_time']:.2f}s -> {totals['packed_time']:.2f}s "
+              f"(节省 {1 - totals['packed_time'] / max(totals['baseline_time'], 1e-9):.1%})")
+
+
+def char_error_rate(hypothesis: str, reference: str) -> float:
+    """字符错误率（编辑距离 / 参考长度），忽略空白"""
+    hyp = "".join(hypothesis.split())
+    ref = "".join(reference.split())
+    if not ref:
+        return float(bool(hyp))
+    prev = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        cur = [i] + [0] * len(hyp)
+        for j, h in enumerate(hyp, 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (r != h))
+        prev = cur
+    return prev[-1] / len(ref)
+
+
+def bench_long_context(args):
+    """对比逐段生成与多音频长上下文生成的吞吐和转录质量"""
+    from gpu_manager import gpu_manager
+
+    gpu_manager.load(args.checkpoint)
+    if args.context_tokens:
+        gpu_manager.long_context_tokens = args.context_tokens
+    references = args.reference or [None] * len(args.audio)
+
+    total_audio = 0.0
+    totals = {"per_segment": 0.0, "long_context": 0.0}
+    for path, ref_path in zip(args.audio, references):
+        duration = load_wav(path).shape[0] / SR
+        total_audio += duration
+        seg_text, seg_time = timed_transcribe(path, args.max_new_tokens, long_context=False)
+        long_text, long_time = timed_transcribe(path, args.max_new_tokens, long_context=True)
+        totals["per_segment"] += seg_time
+        totals["long_context"] += long_time
+
+        print(f"\n== {path} ({duration / 60:.1f} min)")
+        for name, elapsed in (("逐段生成", seg_time), ("长上下文", long_time)):
+            print(f"  {name}: {elapsed:.1f}s, RTF {elapsed / duration:.4f}, 吞吐 {duration / elapsed:.1f}x 实时")
+        if ref_path:
+            with open(ref_path, encoding="utf-8") as f:
+                reference = f.read()
+            print(f"  CER: 逐段 {char_error_rate(seg_text, reference):.2%}, "
+                  f"长上下文 {char_error_rate(long_text, reference):.2%}")
+        else:
+            # 无参考文本时以逐段结果为基准，衡量两种模式的差异
+            print(f"  长上下文相对逐段结果的差异率: {char_error_rate(long_text, seg_text):.2%}")
+
+    print("\n== 合计")
+    for name, key in (("逐段生成", "per_segment"), ("长上下文", "long_context")):
+        print(f"  {name}: {totals[key]:.1f}s, 吞吐 {total_audio / max(totals[key], 1e-9):.1f}x 实时")
+    print(f"  加速比: {totals['per_segment'] / max(totals['long_context'], 1e-9):.2f}x")
+
+
+def bench_batching(args):
+    """对比不同批大小上限的耗时；--simulated_memory_mb 注入显存上限，在 CPU 上也能验证 OOM 拆分重试"""
+    from gpu_manager import gpu_manager
+    from batching import AdaptiveBatcher
+
+    gpu_manager.load(args.checkpoint)
+    total_audio = sum(load_wav(path).shape[0] / SR for path in args.audio)
+    baseline = None
+    for max_batch in args.max_batch:
+        batcher = AdaptiveBatcher(max_batch=max_batch, simulated_limit_mb=args.simulated_memory_mb)
+        batcher.configure(gpu_manager.model.config, gpu_manager.model.dtype)
+        gpu_manager.batcher = batcher
+        elapsed = sum(timed_transcribe(path, args.max_new_tokens)[1] for path in args.audio)
+        baseline = baseline or elapsed
+        status = batcher.status()
+        print(f"批大小上限 {max_batch}: {elapsed:.1f}s, 吞吐 {total_audio / elapsed:.1f}x 实时, "
+              f"加速比 {baseline / elapsed:.2f}x, OOM 重试 {status['oom_retries']} 次, "
+              f"最终上限 {status['ceiling']}, 最大批 {status['largest_batch']}")
+
+
+def _multipart_request(url: str, filename: str, data: bytes, max_new_tokens: int) -> float:
+    """POST /api/transcribe，返回端到端耗时"""
+    from replay import post_multipart
+
+    started = time.perf_counter()
+    status, body = post_multipart(f"{url}/api/transcribe", {"max_new_tokens": max_new_tokens}, filename, data)
+    if status != 200:
+        raise RuntimeError(f"multipart 转录失败: {status} {body[:200]}")
+    return time.perf_counter() - started
+
+
+def _stream_request(url: str, pcm: bytes, max_new_tokens: int, frame_bytes: int, realtime: bool) -> tuple:
+    """WebSocket /api/stream 按窗口流控发送 PCM，返回（端到端耗时，发完音频到收到 final 的耗时）"""
+    from websockets.sync.client import connect
+
+    ws_url = url.replace("http", "ws", 1) + f"/api/stream?max_new_tokens={max_new_tokens}"
+    started = time.perf_counter()
+    with connect(ws_url, max_size=None) as ws:
+        window = json.loads(ws.recv())["window"]
+        sent = acked = 0
+        while sent < len(pcm):
+            while sent - acked >= window:
+                event = json.loads(ws.recv())
+                if event["type"] == "ack":
+                    acked = event["bytes"]
+            if realtime:
+                # 模拟实时音源（如通话），按音频时长匀速发送
+                time.sleep(max(0.0, started + sent / (2 * SR) - time.perf_counter()))
+            frame = pcm[sent:sent + frame_bytes]
+            ws.send(frame)
+            sent += len(frame)
+        ws.send(json.dumps({"type": "end"}))
+        ended = time.perf_counter()
+        while True:
+            event = json.loads(ws.recv())
+            if event["type"] in ("final", "cancelled", "error"):
+                break
+    if event["type"] != "final":
+        raise RuntimeError(f"流式转录失败: {event}")
+    finished = time.perf_counter()
+    return finished - started, finished - ended
+
+
+def _latency_summary(latencies: list, wall: float) -> str:
+    ordered = sorted(latencies)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return (f"p50 {pick(0.5):.0f}ms, p95 {pick(0.95):.0f}ms, p99 {pick(0.99):.0f}ms, "
+            f"平均 {sum(ordered) / len(ordered) * 1000:.0f}ms, 吞吐 {len(ordered) / wall:.1f} req/s")
+
+
+def bench_stream(args):
+    """对比 multipart 上传与原始 PCM 流的单请求开销（需先启动 main.py）
+
+    用短音频和较小的 max_new_tokens 时，模型耗时占比小，两者的差值即为解析、落盘和解码等额外开销。
+    --realtime 按音频时长匀速发送，此时 multipart 只能在音频结束后整体上传，
+    应比较 multipart 的端到端耗时与流式的"音频结束后"耗时。
+    """
+    with open(args.audio, "rb") as f:
+        data = f.read()
+    pcm = (load_wav(args.audio).clamp(-1, 1) * 32767).to(torch.int16).numpy().tobytes()
+    ext = args.audio.rsplit(".", 1)[-1]
+    runs = {
+        "multipart": lambda i: _multipart_request(args.url, f"bench-{i}.{ext}", data, args.max_new_tokens),
+        "stream": lambda i: _stream_request(args.url, pcm, args.max_new_tokens, args.frame_ms * SR * 2 // 1000,
+                                            args.realtime),
+    }
+    print(f"音频 {len(pcm) / 2 / SR:.1f}s，{args.requests} 个请求，并发 {args.concurrency}")
+    for name, run in runs.items():
+        run(0)  # 预热
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            latencies = list(pool.map(run, range(args.requests)))
+        wall = time.perf_counter() - started
+        if name == "stream":
+            print(f"  {'stream':<9}: {_latency_summary([total for total, _ in latencies], wall)}")
+            print(f"  音频结束后: {_latency_summary([tail for _, tail in latencies], wall)}")
+        else:
+            print(f"  {name:<9}: {_latency_summary(latencies, wall)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="GLM-ASR 性能基准")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("packing", help="语音紧凑打包 vs 当前分段")
+    p.add_argument("--audio", nargs="+", required=True, help="会议类长音频（停顿较多）")
+    p.add_argument("--gap", type=float, default=0.2, help="打包时语音区间之间的静音（秒）")
+    p.add_argument("--run", action="store_true", help="加载模型并实际转录，对比耗时")
+    p.add_argument("--checkpoint", default="zai-org/GLM-ASR-Nano-2512")
+    p.add_argument("--max_new_tokens", type=int, default=512)
+    p.set_defaults(func=bench_packing)
+
+    p = sub.add_parser("long_context", help="多音频长上下文 vs 逐段生成")
+    p.add_argument("--audio", nargs="+", required=True, help="小时级长音频")
+    p.add_argument("--reference", nargs="+", help="与 --audio 一一对应的参考文本文件，用于计算 CER")
+    p.add_argument("--context_tokens", type=int, default=None, help="上下文预算（默认取 LONG_CONTEXT_TOKENS）")
+    p.add_argument("--checkpoint", default="zai-org/GLM-ASR-Nano-2512")
+    p.add_argument("--max_new_tokens", type=int, default=512)
+    p.set_defaults(func=bench_long_context)
+
+    p = sub.add_parser("batching", help="分段组批生成的批大小对比")
+    p.add_argument("--audio", nargs="+", required=True, help="长音频")
+    p.add_argument("--max_batch", type=int, nargs="+", default=[1, 4, 8])
+    p.add_argument("--simulated_memory_mb", type=float, default=0, help="注入的显存上限（MB），0 表示不模拟")
+    p.add_argument("--checkpoint", default="zai-org/GLM-ASR-Nano-2512")
+    p.add_argument("--max_new_tokens", type=int, default=512)
+    p.set_defaults(func=bench_batching)
+
+    p = sub.add_parser("stream", help="原始 PCM 流 vs multipart 上传的单请求开销")
+    p.add_argument("--audio", required=True, help="短音频（几秒）")
+    p.add_argument("--url", default="http://localhost:7860")
+    p.add_argument("--requests", type=int, default=100)
+    p.add_argument("--concurrency", type=int, default=4)
+    p.add_argument("--frame_ms", type=int, default=100, help="流式发送的帧长（毫秒）")
+    p.add_argument("--realtime", action="store_true", help="流式按实时速度发送（模拟通话）")
+    p.add_argument("--max_new_tokens", type=int, default=64)
+    p.set_defaults(func=bench_stream)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
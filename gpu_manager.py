@@ -1,17 +1,147 @@
 """GPU 资源管理器 - 模型常驻显存，手动卸载"""
+import copy
+import os
 import threading
 import logging
+import time
+import uuid
+from contextlib import contextmanager
+import numpy as np
 import torch
 from pathlib import Path
-from transformers import AutoConfig, AutoModelForSeq2SeqLM, AutoProcessor
+from transformers import (
+    AutoConfig, AutoModelForSeq2SeqLM, AutoProcessor, StoppingCriteria, StoppingCriteriaList,
+)
+from transformers.generation.streamers import BaseStreamer
+
+from admission import AdmissionController
+from batching import AdaptiveBatcher, is_oom
+from inference import MERGE_FACTOR
+from job_store import job_store
+from tuning import load_profile, resolve_param
+from mel_frontend import LogMelFrontend
+from quality import QualityPolicy
+from segment_cache import SegmentCache, fingerprint
+from shared_weights import SharedWeights, process_memory
+from speculative import SpeculationStats, prepare_draft
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+# 浏览器端已规整的原始 PCM：16kHz 单声道 16-bit 小端，无文件头
+PCM_EXTENSION = '.pcm'
+PCM_SAMPLE_RATE = 16000
+
+
+def load_audio(audio) -> torch.Tensor:
+    """读取音频并转为 16kHz 单声道 (1, samples) 张量；传入张量时视为已规整的 16kHz 波形"""
+    if isinstance(audio, torch.Tensor):
+        return audio.reshape(1, -1)
+    if str(audio).lower().endswith(PCM_EXTENSION):
+        # 快速路径：跳过解码和重采样
+        pcm = np.fromfile(str(audio), dtype='<i2')
+        return torch.from_numpy(pcm.astype(np.float32) / 32768.0).reshape(1, -1)
+    import torchaudio
+    wav, sr = torchaudio.load(str(audio))
+    wav = wav[:1, :]
+    if sr != 16000:
+        wav = torchaudio.transforms.Resample(sr, 16000)(wav)
+    return wav
+
+
+# 取消原因，metrics["cancelled_by_reason"] 按此归类
+CLIENT_DISCONNECT = "client_disconnect"
+CANCEL_REQUEST = "cancel_request"
+DEADLINE = "deadline"
+
+
+class TranscriptionCancelled(Exception):
+    """转录被取消（客户端断开、主动取消或超过截止时间）"""
+
+    def __init__(self, reason: str = "cancelled"):
+        super().__init__(f"转录已取消: {reason}")
+        self.reason = reason
+
+
+class CancellationToken:
+    """协作式取消令牌：段间和生成循环内检查，可选截止时间"""
+
+    def __init__(self, deadline_s: float = None):
+        self._event = threading.Event()
+        self.reason = None
+        self.deadline = time.monotonic() + deadline_s if deadline_s else None
+
+    def cancel(self, reason: str = "cancelled"):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._event.is_set() and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel(DEADLINE)
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise TranscriptionCancelled(self.reason)
+
+
+class CancelCriteria(StoppingCriteria):
+    """生成循环内的取消检查：令牌被取消后在下一个 token 处停止"""
+
+    def __init__(self, token: CancellationToken):
+        self.token = token
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.token.cancelled, dtype=torch.bool, device=input_ids.device)
+
+
+class TokenStreamer(BaseStreamer):
+    """逐 token 输出（支持批量）：生成过程中把每个样本新解码出的文本片段交给回调 on_text(row, text)"""
+
+    def __init__(self, tokenizer, on_text):
+        self.tokenizer = tokenizer
+        self.on_text = on_text
+        self._prompt_skipped = False
+        self._tokens = None
+        self._printed = None
+
+    def put(self, value):
+        # 第一次调用传入的是提示词
+        if not self._prompt_skipped:
+            self._prompt_skipped = True
+            return
+        # 常规生成每步传入 (batch,)；投机解码每次验证传入多个已接受 token (1, n)
+        rows = value.tolist() if value.dim() == 2 else [[token] for token in value.tolist()]
+        if self._tokens is None:
+            self._tokens = [[] for _ in rows]
+            self._printed = [0] * len(rows)
+        for row, tokens in enumerate(rows):
+            self._tokens[row].extend(tokens)
+            self._flush(row)
+
+    def _flush(self, row: int, final: bool = False):
+        text = self.tokenizer.decode(self._tokens[row], skip_special_tokens=True)
+        # 多字节字符未解码完整时先不输出
+        if not final and text.endswith("\ufffd"):
+            return
+        if len(text) > self._printed[row]:
+            delta = text[self._printed[row]:]
+            self._printed[row] = len(text)
+            self.on_text(row, delta)
+
+    def end(self):
+        for row in range(len(self._tokens or [])):
+            self._flush(row, final=True)
+
+
 class GPUManager:
     _instance = None
     _lock = threading.Lock()
+    # 是否为跨进程代理（见 inference_server.RemoteGPUManager）
+    is_remote = False
 
     def __new__(cls):
         if cls._instance is None:
@@ -27,12 +157,67 @@ class GPUManager:
         self.model = None
         self.processor = None
         self.config = None
+        self.frontend = None
+        self._prompt_template = None
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.checkpoint_dir = None
         self.lock = threading.Lock()
+        self.metrics = {
+            "ttft_count": 0, "ttft_ms_last": None, "ttft_ms_avg": None,
+            # 转录持有模型锁的时长（只含模型相关工作）和锁外 VAD 分段耗时
+            "lock_hold_count": 0, "lock_hold_ms_last": None, "lock_hold_ms_avg": None, "lock_hold_ms_max": None,
+            "vad_count": 0, "vad_ms_last": None, "vad_ms_avg": None,
+            "cancelled_requests": 0, "cancelled_segments": 0, "cancelled_audio_seconds": 0.0,
+            "cancelled_by_reason": {},
+        }
+        self.jobs = {}
+        self.admission = AdmissionController.from_env()
+        # 负载自适应质量档位；economy 档可改用轻量模型（LITE_CHECKPOINT：检查点路径，或 int8 表示量化主模型）
+        self.quality = QualityPolicy.from_env(self.admission)
+        self.lite_checkpoint = os.environ.get('LITE_CHECKPOINT', '')
+        self.lite_model = None
+        # 语音紧凑打包（去掉语音之间的静音再送入编码器）
+        self.packing = os.environ.get('SEGMENT_PACKING', '0') == '1'
+        self.packing_gap = float(os.environ.get('SEGMENT_PACKING_GAP_S', 0.2))
+        # 长上下文模式：多个连续窗口放进同一个多音频提示词，一次 prefill + generate
+        self.long_context = os.environ.get('LONG_CONTEXT', '0') == '1'
+        self.long_context_tokens = int(os.environ.get('LONG_CONTEXT_TOKENS', 4096))
+        # 长音频的分段按显存估算组批生成
+        self.batcher = AdaptiveBatcher.from_env()
+        # 投机解码：设置 DRAFT_CHECKPOINT 后由小草稿模型提出候选 token，主模型验证（逐段生成，不组批）
+        self.draft_checkpoint = os.environ.get('DRAFT_CHECKPOINT', '')
+        self.draft_model = None
+        self.speculation = SpeculationStats()
+        # 分段级转录缓存：重复出现的分段直接返回上次的文本
+        self.segment_cache = SegmentCache.from_env()
+        # 多进程 CPU 部署：各 worker 映射同一份共享内存中的权重
+        self.shared_weights = SharedWeights.from_env()
+        self._apply_tuning()
+
+    def _apply_tuning(self):
+        """应用 tuning.py 生成的调优配置（硬件一致时），每项记录取值来源"""
+        self.tuning_profile = load_profile()
+        self.tuning = {
+            "num_threads": resolve_param(self.tuning_profile, "num_threads", torch.get_num_threads(), int),
+            "segment_max_s": resolve_param(self.tuning_profile, "segment_max_s", 25.0),
+            "segment_min_s": resolve_param(self.tuning_profile, "segment_min_s", 2.0),
+            "max_batch": resolve_param(self.tuning_profile, "max_batch", self.batcher.max_batch, int),
+        }
+        if self.tuning["num_threads"]["source"] != "default":
+            torch.set_num_threads(self.tuning["num_threads"]["value"])
+        # 分段时长：短于该值的音频整段送入模型，更长的按 VAD 切分
+        self.segment_max_s = self.tuning["segment_max_s"]["value"]
+        self.segment_min_s = self.tuning["segment_min_s"]["value"]
+        self.batcher.max_batch = self.batcher.ceiling = self.tuning["max_batch"]["value"]
+        if self.tuning_profile:
+            logger.info(f"已加载调优配置 {self.tuning_profile['path']}: {self.tuning_profile['params']}")
 
     def load(self, checkpoint_dir: str = "zai-org/GLM-ASR-Nano-2512"):
         """加载模型到 GPU（启动时调用）"""
+        from vad_segmenter import vad_pool
+
+        # VAD 实例在锁外分段时使用，启动时一并加载
+        vad_pool.preload()
         with self.lock:
             if self.model is not None:
                 logger.info("模型已加载")
@@ -42,17 +227,46 @@ class GPUManager:
             self.checkpoint_dir = checkpoint_dir
             
             self.processor = AutoProcessor.from_pretrained(checkpoint_dir)
+            self.frontend = LogMelFrontend.from_feature_extractor(self.processor.feature_extractor)
+            self._prompt_template = None
             self.config = AutoConfig.from_pretrained(checkpoint_dir, trust_remote_code=True)
-            self.model = AutoModelForSeq2SeqLM.from_pretrained(
-                checkpoint_dir,
-                dtype="auto",
-                device_map="auto",
-            )
+            self.model = self._load_model(checkpoint_dir)
             self.model.eval()
+            self.batcher.configure(self.model.config, self.model.dtype)
+            if self.draft_checkpoint:
+                self._load_draft(self.draft_checkpoint)
+            if self.lite_checkpoint:
+                self._load_lite(self.lite_checkpoint)
             
             logger.info(f"模型加载完成，设备: {self.device}")
             return True
 
+    def _load_model(self, checkpoint_dir: str):
+        if self.shared_weights.enabled and self.device == "cpu":
+            return self.shared_weights.load(checkpoint_dir)
+        return AutoModelForSeq2SeqLM.from_pretrained(checkpoint_dir, dtype="auto", device_map="auto")
+
+    def _load_draft(self, checkpoint_dir: str):
+        """加载投机解码的草稿模型"""
+        logger.info(f"正在加载草稿模型: {checkpoint_dir}")
+        draft = self._load_model(checkpoint_dir)
+        draft.eval()
+        prepare_draft(self.model, draft, self.processor.audio_token_id, self.speculation)
+        self.draft_model = draft
+
+    def _load_lite(self, checkpoint: str):
+        """加载 economy 档使用的轻量模型"""
+        if checkpoint != 'int8':
+            logger.info(f"正在加载轻量模型: {checkpoint}")
+            self.lite_model = self._load_model(checkpoint).eval()
+            return
+        if self.device != "cpu":
+            logger.warning("int8 动态量化只支持 CPU，economy 档继续使用主模型")
+            return
+        logger.info("正在对主模型做 int8 动态量化（economy 档使用）")
+        lite = copy.deepcopy(self.model).float()
+        self.lite_model = torch.ao.quantization.quantize_dynamic(lite, {torch.nn.Linear}, dtype=torch.qint8).eval()
+
     def unload(self):
         """手动卸载模型"""
         with self.lock:
@@ -61,6 +275,10 @@ class GPUManager:
             
             del self.model
             self.model = None
+            self.draft_model = None
+            self.lite_model = None
+            # 下次可能加载不同的检查点
+            self.segment_cache.clear()
             torch.cuda.empty_cache()
             logger.info("模型已卸载，显存已释放")
             return {"status": "unloaded"}
@@ -72,6 +290,8 @@ class GPUManager:
 
     def get_status(self) -> dict:
         """获取 GPU 状态"""
+        from vad_segmenter import vad_pool
+
         status = {
             "model_loaded": self.model is not None,
             "device": self.device,
@@ -80,78 +300,589 @@ class GPUManager:
         if torch.cuda.is_available():
             status["gpu_memory_used_mb"] = torch.cuda.memory_allocated() / 1024 / 1024
             status["gpu_memory_total_mb"] = torch.cuda.get_device_properties(0).total_memory / 1024 / 1024
+        status["metrics"] = {**self.metrics, "cancelled_by_reason": dict(self.metrics["cancelled_by_reason"])}
+        status["active_jobs"] = len(self.jobs)
+        status["queue"] = self.admission.status()
+        status["quality"] = {**self.quality.status(), "lite_model": self.lite_checkpoint or None,
+                             "lite_loaded": self.lite_model is not None}
+        status["batching"] = self.batcher.status()
+        status["segment_cache"] = self.segment_cache.status()
+        status["memory"] = process_memory()
+        status["vad"] = vad_pool.status()
+        if self.shared_weights.enabled:
+            status["shared_weights"] = self.shared_weights.status()
+        if self.draft_checkpoint:
+            status["speculative"] = {"draft": self.draft_checkpoint, "loaded": self.draft_model is not None,
+                                     **self.speculation.status()}
+        current = {"num_threads": torch.get_num_threads(), "segment_max_s": self.segment_max_s,
+                   "segment_min_s": self.segment_min_s, "max_batch": self.batcher.max_batch}
+        status["tuning"] = {
+            "profile": self.tuning_profile["path"] if self.tuning_profile else None,
+            "objective": self.tuning_profile.get("objective") if self.tuning_profile else None,
+            "params": {name: {"value": current[name], "source": choice["source"]}
+                       for name, choice in self.tuning.items()},
+        }
         return status
 
-    def transcribe(self, audio_path: str, max_new_tokens: int = 512, progress_callback=None) -> str:
+    def create_job(self, deadline_s: float = None, job_id: str = None) -> tuple:
+        """登记一个可取消的转录任务，返回 (job_id, token)；恢复断点任务时沿用原 job_id"""
+        job_id = job_id or uuid.uuid4().hex
+        token = CancellationToken(deadline_s)
+        self.jobs[job_id] = token
+        return job_id, token
+
+    def cancel_job(self, job_id: str, reason: str = CANCEL_REQUEST) -> bool:
+        """取消指定任务，任务不存在时返回 False"""
+        token = self.jobs.get(job_id)
+        if token is None:
+            return False
+        token.cancel(reason)
+        return True
+
+    def finish_job(self, job_id: str):
+        self.jobs.pop(job_id, None)
+
+    def _cancelled(self, reason: str, skipped_segments: list) -> TranscriptionCancelled:
+        """统计被取消而未执行的工作量，返回待抛出的异常"""
+        audio_seconds = sum(end - start for start, end in skipped_segments) / 16000
+        m = self.metrics
+        m["cancelled_requests"] += 1
+        m["cancelled_segments"] += len(skipped_segments)
+        m["cancelled_audio_seconds"] = round(m["cancelled_audio_seconds"] + audio_seconds, 1)
+        m["cancelled_by_reason"][reason] = m["cancelled_by_reason"].get(reason, 0) + 1
+        logger.info(f"转录已取消 ({reason})，跳过 {len(skipped_segments)} 段 / {audio_seconds:.1f}s 音频")
+        return TranscriptionCancelled(reason)
+
+    def _record_ttft(self, ttft_ms: float):
+        """记录首 token 延迟（请求进入到第一个文本片段输出）"""
+        self._record_ms("ttft", ttft_ms)
+
+    def _record_ms(self, name: str, ms: float):
+        """更新 metrics 中 {name}_count / _ms_last / _ms_avg（有 _ms_max 时一并更新）"""
+        m = self.metrics
+        m[f"{name}_count"] += 1
+        m[f"{name}_ms_last"] = round(ms, 1)
+        prev = m[f"{name}_ms_avg"] or 0.0
+        m[f"{name}_ms_avg"] = round(prev + (ms - prev) / m[f"{name}_count"], 1)
+        if f"{name}_ms_max" in m:
+            m[f"{name}_ms_max"] = max(m[f"{name}_ms_max"] or 0.0, round(ms, 1))
+
+    @contextmanager
+    def _model_lock(self):
+        """转录用的模型锁，记录持有时长"""
+        with self.lock:
+            acquired = time.perf_counter()
+            try:
+                yield
+            finally:
+                self._record_ms("lock_hold", (time.perf_counter() - acquired) * 1000)
+
+    def _get_prompt_template(self) -> str:
+        """渲染一次转录提示词模板（含单个音频占位符），后续按音频长度展开"""
+        if self._prompt_template is None:
+            conversation = [{
+                "role": "user",
+                "content": [
+                    {"type": "audio", "audio": None},
+                    {"type": "text", "text": self.processor.default_transcription_prompt},
+                ],
+            }]
+            self._prompt_template = self.processor.apply_chat_template(
+                conversation, tokenize=False, add_generation_prompt=True
+            )
+        return self._prompt_template
+
+    def _build_inputs(self, samples: list, model=None) -> dict:
+        """构造模型输入：提示词按样本展开音频 token，log-mel 特征整批在模型设备上计算
+
+        Args:
+            samples: 每个样本为一组 1-D 波形窗口（16kHz，每个窗口不超过 30 秒）
+            model: 执行生成的模型（默认主模型），决定设备和特征 dtype
+        """
+        model = model or self.model
+        chunks, windows_per_sample = [], []
+        for windows in samples:
+            chunks.extend(windows)
+            windows_per_sample.append(len(windows))
+
+        features, mask = self.frontend(chunks, device=model.device)
+        window_tokens = self._window_tokens(mask.sum(-1)).tolist()
+
+        template = self._get_prompt_template()
+        audio_token = self.processor.audio_token
+        texts, offset = [], 0
+        for n in windows_per_sample:
+            num_tokens = sum(window_tokens[offset:offset + n])
+            offset += n
+            texts.append(template.replace(audio_token, audio_token * num_tokens, 1))
+
+        tokenizer = self.processor.tokenizer
+        add_special_tokens = not (tokenizer.bos_token and template.startswith(tokenizer.bos_token))
+        text_inputs = tokenizer(
+            texts, return_tensors="pt", padding=True, padding_side="left",
+            add_special_tokens=add_special_tokens,
+        )
+        return {
+            "input_ids": text_inputs.input_ids.to(model.device),
+            "attention_mask": text_inputs.attention_mask.to(model.device),
+            "input_features": features.to(model.dtype),
+            "input_features_mask": mask,
+        }
+
+    @staticmethod
+    def _window_tokens(frames: torch.Tensor) -> torch.Tensor:
+        """每个特征窗口对应的音频 token 数（与模型 get_audio_features 的计算一致）"""
+        lengths = frames
+        for padding, kernel_size, stride in [(1, 3, 1), (1, 3, 2)]:
+            lengths = (lengths + 2 * padding - (kernel_size - 1) - 1) // stride + 1
+        return (lengths - MERGE_FACTOR) // MERGE_FACTOR + 1
+
+    def _group_long_context(self, chunks: list, max_new_tokens: int) -> list:
+        """把连续窗口按上下文预算分组：音频 token 与生成预算之和不超过 long_context_tokens"""
+        frames = torch.tensor([self.frontend.num_frames(c.shape[0]) for c in chunks])
+        tokens = self._window_tokens(frames).tolist()
+        groups, current, used = [], [], 0
+        for i, n in enumerate(tokens):
+            cost = n + max_new_tokens
+            if current and used + cost > self.long_context_tokens:
+                groups.append(current)
+                current, used = [], 0
+            current.append(i)
+            used += cost
+        if current:
+            groups.append(current)
+        return groups
+
+    def _split_windows(self, wav: torch.Tensor) -> list:
+        """按特征提取器的 30 秒窗口切分 1-D 波形"""
+        return list(torch.split(wav, self.frontend.n_samples))
+
+    def _generate(self, inputs: dict, max_new_tokens: int, streamer=None, cancel_token=None, model=None) -> list:
+        """执行生成并解码为文本列表；model 为 None 时使用主模型（草稿模型只辅助主模型）"""
+        stopping_criteria = StoppingCriteriaList([CancelCriteria(cancel_token)]) if cancel_token else None
+        assisted = {}
+        if model is None and self.draft_model is not None and inputs["input_ids"].shape[0] == 1:
+            assisted = {"assistant_model": self.draft_model}
+            streamer = self.speculation.streamer(streamer)
+        with torch.inference_mode():
+            outputs = (model or self.model).generate(
+                **inputs, do_sample=False, max_new_tokens=max_new_tokens, streamer=streamer,
+                stopping_criteria=stopping_criteria, **assisted,
+            )
+        if cancel_token:
+            cancel_token.raise_if_cancelled()
+        decoded = self.processor.batch_decode(outputs[:, inputs["input_ids"].shape[1]:], skip_special_tokens=True)
+        return [text.strip() for text in decoded]
+
+    def _text_callback(self, token_callback, segment_indices: list, request_state: dict):
+        """第 k 行的文本片段交给 token_callback(segment_indices[k], text)，整个请求的首个片段到达时记录 TTFT"""
+        def on_text(row, text):
+            if not request_state["first_token_sent"]:
+                request_state["first_token_sent"] = True
+                self._record_ttft((time.perf_counter() - request_state["started"]) * 1000)
+            token_callback(segment_indices[row], text)
+
+        return on_text
+
+    def _make_streamer(self, token_callback, segment_indices: list, request_state: dict):
+        """为当前批创建 token 流式输出器（第 k 行对应 segment_indices[k]）"""
+        if token_callback is None:
+            return None
+        return TokenStreamer(self.processor.tokenizer, self._text_callback(token_callback, segment_indices, request_state))
+
+    def _cache_key(self, windows: list, max_new_tokens: int, model=None):
+        # 只缓存主模型的结果，轻量模型的文本不与之混用
+        return fingerprint(windows, max_new_tokens) if self.segment_cache.enabled and model is None else None
+
+    def _cached_text(self, key, windows: list):
+        """查询分段缓存，未启用或未命中时返回 None"""
+        if key is None:
+            return None
+        return self.segment_cache.get(key, sum(w.shape[0] for w in windows) / 16000)
+
+    def _generate_batch(self, samples: list, lengths: list, max_new_tokens: int, streamer=None,
+                        cancel_token=None, model=None) -> list:
+        """一批样本（每个样本为若干窗口）组批生成，记录显存峰值用于校准估算"""
+        self.batcher.check(lengths)
+        cuda = torch.cuda.is_available()
+        if cuda:
+            torch.cuda.reset_peak_memory_stats()
+            base = torch.cuda.memory_allocated()
+        texts = self._generate(self._build_inputs(samples, model), max_new_tokens, streamer, cancel_token, model)
+        self.batcher.on_success(lengths, torch.cuda.max_memory_allocated() - base if cuda else None)
+        return texts
+
+    def transcribe(self, audio_path: str, max_new_tokens: int = 512, progress_callback=None,
+                   token_callback=None, cancel_token: CancellationToken = None, packing: bool = None,
+                   long_context: bool = None, job_id: str = None, quality: str = None,
+                   quality_callback=None) -> str:
         """转录音频 - VAD 智能分段，支持任意长度音频
         
         Args:
-            audio_path: 音频文件路径
+            audio_path: 音频文件路径，或已规整的 16kHz 单声道波形张量
             max_new_tokens: 每段最大生成 token 数
             progress_callback: 进度回调函数 (current, total, segment_duration, text)
+            token_callback: token 流式回调函数 (segment_index, text_delta)，生成过程中逐片段调用
+            cancel_token: 取消令牌，取消后抛出 TranscriptionCancelled
+            packing: 长音频是否只拼接语音区间（None 时取 SEGMENT_PACKING）
+            long_context: 长音频是否把多个窗口合并到一个多音频提示词（None 时取 LONG_CONTEXT）
+            job_id: 任务 ID；长音频会按该 ID 持久化分段计划和逐段结果，重启后可继续
+            quality: 质量档位 auto / full / reduced / economy（None 时取 QUALITY_DEFAULT，见 quality.py）
+            quality_callback: 确定档位后调用 (tier)，用于在响应中报告实际使用的档位
         """
         if self.model is None:
             raise RuntimeError("模型未加载，请先加载模型")
         
-        import torchaudio
-        import tempfile
-        import os
-        from vad_segmenter import smart_segment
+        request_state = {"started": time.perf_counter(), "first_token_sent": False}
+        # 解码和 VAD 分段在模型锁外进行，排队中的请求可与正在生成的请求并行准备
+        wav = load_audio(audio_path)
+        duration = wav.shape[1] / 16000
+        logger.info(f"音频时长: {duration:.1f}s")
+        packing = self.packing if packing is None else packing
+        long_context = self.long_context if long_context is None else long_context
+        tier = self.quality.select(quality)
+        max_new_tokens, packing, long_context = self.quality.apply(tier, max_new_tokens, packing, long_context)
+        model = self._tier_model(tier)
+        if quality_callback:
+            quality_callback(tier)
+        checkpoint = None
+        if job_id and duration > self.segment_max_s and job_store.enabled:
+            checkpoint = job_store.open(job_id, wav, {
+                "max_new_tokens": max_new_tokens, "packing": packing, "long_context": long_context,
+                "quality": tier, "duration": round(duration, 1),
+            })
+        try:
+            segmentation = None
+            queued_cancel = cancel_token and cancel_token.cancelled
+            if duration > self.segment_max_s and not (checkpoint and checkpoint.plan) and not queued_cancel:
+                segmentation = self._plan_segments(wav, packing)
+
+            with self._model_lock():
+                started = time.perf_counter()
+                if cancel_token and cancel_token.cancelled:
+                    # 排队期间已取消（客户端断开或超时），不再占用 GPU
+                    if checkpoint:
+                        checkpoint.cancel(cancel_token.reason)
+                    raise self._cancelled(cancel_token.reason, [])
+
+                try:
+                    text = self._transcribe_wav(wav, duration, max_new_tokens, progress_callback, token_callback,
+                                                cancel_token, request_state, packing, long_context, checkpoint,
+                                                segmentation, model)
+                except TranscriptionCancelled as e:
+                    if checkpoint:
+                        checkpoint.cancel(e.reason)
+                    raise
+                if checkpoint:
+                    checkpoint.finish(text)
+                self.admission.observe(duration, time.perf_counter() - started)
+                return text
+        finally:
+            if checkpoint:
+                job_store.close(checkpoint)
+
+    def _tier_model(self, tier: str):
+        """档位对应的模型：economy 且加载了轻量模型时返回轻量模型，否则 None（主模型）"""
+        if tier != 'full':
+            logger.info(f"质量档位: {tier}")
+        return self.lite_model if tier == 'economy' else None
+
+    def resume_jobs(self):
+        """后台继续上次进程未完成的长任务，只重新转录未完成的分段"""
+        job_store.expire()
+        pending = job_store.pending()
+        if not pending:
+            return
+        logger.info(f"发现 {len(pending)} 个未完成的任务，开始恢复")
+
+        def run():
+            for checkpoint in pending:
+                job_id, token = self.create_job(job_id=checkpoint.job_id)
+                try:
+                    self.transcribe(checkpoint.audio_path, checkpoint.meta.get("max_new_tokens", 512),
+                                    cancel_token=token, packing=checkpoint.meta.get("packing"),
+                                    long_context=checkpoint.meta.get("long_context"), job_id=job_id,
+                                    quality=checkpoint.meta.get("quality"))
+                except TranscriptionCancelled:
+                    pass
+                except Exception as e:
+                    logger.error(f"恢复任务 {job_id} 失败: {e}")
+                finally:
+                    self.finish_job(job_id)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _plan_segments(self, wav, packing: bool) -> tuple:
+        """VAD 分段，返回 (segments, windows)；packing 时 windows 为打包窗口，否则为 None
+
+        不需要持有模型锁：VAD 实例来自 vad_pool，可与生成并行。
+        """
+        from vad_segmenter import smart_segment, packed_segment
+
+        started = time.perf_counter()
+        if packing:
+            windows = packed_segment(wav[0], sr=16000, max_duration=self.segment_max_s, gap_duration=self.packing_gap)
+            plan = [(w["spans"][0][0], w["spans"][-1][1]) for w in windows], windows
+        else:
+            plan = smart_segment(wav[0], sr=16000, max_duration=self.segment_max_s, min_duration=self.segment_min_s), None
+        self._record_ms("vad", (time.perf_counter() - started) * 1000)
+        return plan
+
+    @staticmethod
+    def _segment_audio(wav, segments: list, windows: list = None) -> list:
+        """按分段计划取出每段波形"""
+        from vad_segmenter import build_packed_audio
+
+        if windows:
+            return [build_packed_audio(wav[0], w) for w in windows]
+        return [wav[0, start:end] for start, end in segments]
+
+    def transcribe_batch(self, audio_paths: list, max_new_tokens: int = 512,
+                         cancel_token: CancellationToken = None, packing: bool = None, quality: str = None) -> list:
+        """多个文件一起转录：所有文件的分段进入同一个队列组批生成
+
+        Returns:
+            与 audio_paths 一一对应的 {"path", "status", "text", "duration", "elapsed", "rtf", "quality"}；
+            elapsed 为从开始到该文件最后一段完成的时间，单个文件读取失败时 status 为 error，不影响其他文件
+        """
+        if self.model is None:
+            raise RuntimeError("模型未加载，请先加载模型")
         
-        with self.lock:
-            wav, sr = torchaudio.load(str(audio_path))
-            wav = wav[:1, :]
-            if sr != 16000:
-                wav = torchaudio.transforms.Resample(sr, 16000)(wav)
-            
+        packing = self.packing if packing is None else packing
+        tier = self.quality.select(quality)
+        max_new_tokens, packing, _ = self.quality.apply(tier, max_new_tokens, packing, False)
+        model = self._tier_model(tier)
+        request_state = {"started": time.perf_counter(), "first_token_sent": False}
+        results = [{"path": str(path), "status": "pending", "quality": tier} for path in audio_paths]
+        # 解码和 VAD 分段在模型锁外进行
+        samples, owners, total_audio = [], [], 0.0
+        for k, path in enumerate(audio_paths):
+            if cancel_token and cancel_token.cancelled:
+                break
+            try:
+                wav = load_audio(path)
+            except Exception as e:
+                results[k].update(status="error", error=str(e))
+                continue
             duration = wav.shape[1] / 16000
-            logger.info(f"音频时长: {duration:.1f}s")
+            total_audio += duration
+            results[k]["duration"] = round(duration, 2)
+            chunks = [wav[0]] if duration <= self.segment_max_s else self._segment_audio(wav, *self._plan_segments(wav, packing))
+            for chunk in chunks:
+                samples.append(self._split_windows(chunk))
+                owners.append(k)
+        
+        with self._model_lock():
+            started = time.perf_counter()
+            if cancel_token and cancel_token.cancelled:
+                raise self._cancelled(cancel_token.reason, [])
             
-            if duration <= 25:
-                if progress_callback:
-                    progress_callback(1, 1, duration, None)
-                inputs = self.processor.apply_transcription_request(str(audio_path))
-                inputs = inputs.to(self.model.device, dtype=self.model.dtype)
-                with torch.inference_mode():
-                    outputs = self.model.generate(**inputs, do_sample=False, max_new_tokens=max_new_tokens)
-                decoded = self.processor.batch_decode(outputs[:, inputs.input_ids.shape[1]:], skip_special_tokens=True)
-                text = decoded[0].strip() if decoded else ""
+            texts = {}
+            remaining = {k: owners.count(k) for k in set(owners)}
+
+            def finish_file(k):
+                elapsed = time.perf_counter() - started
+                parts = [texts[i] for i, owner in enumerate(owners) if owner == k and texts.get(i)]
+                results[k].update(status="success", text=''.join(parts), elapsed=round(elapsed, 3),
+                                  rtf=round(elapsed / results[k]["duration"], 4) if results[k]["duration"] else None)
+
+            def on_result(i, text):
+                texts[i] = text
+                remaining[owners[i]] -= 1
+                if remaining[owners[i]] == 0:
+                    finish_file(owners[i])
+
+            for k, result in enumerate(results):
+                # 没有检测到语音的文件
+                if result["status"] == "pending" and k not in remaining:
+                    finish_file(k)
+            try:
+                self._generate_samples(samples, [max_new_tokens] * len(samples), list(range(len(samples))),
+                                       request_state, cancel_token=cancel_token, on_result=on_result, model=model)
+            except TranscriptionCancelled as e:
+                skipped = [(0, sum(c.shape[0] for c in samples[i])) for i in range(len(samples)) if i not in texts]
+                raise self._cancelled(e.reason, skipped)
+            self.admission.observe(total_audio, time.perf_counter() - started)
+        logger.info(f"批量转录 {len(audio_paths)} 个文件, 共 {total_audio:.1f}s 音频, "
+                    f"耗时 {time.perf_counter() - started:.1f}s")
+        return results
+
+    def _transcribe_wav(self, wav, duration, max_new_tokens, progress_callback, token_callback,
+                        cancel_token, request_state, packing=False, long_context=False, checkpoint=None,
+                        segmentation=None, model=None) -> str:
+        """在持有 GPU 锁的情况下转录 16kHz 单声道波形；传入 checkpoint 时跳过已完成的分组并逐组落盘
+
+        segmentation 为锁外已完成的 _plan_segments 结果，未传入时在锁内分段；model 为 None 时使用主模型。
+        """
+        if duration <= self.segment_max_s:
+            if progress_callback:
+                progress_callback(1, 1, duration, None)
+            windows = self._split_windows(wav[0])
+            key = self._cache_key(windows, max_new_tokens, model)
+            text = self._cached_text(key, windows)
+            if text is not None:
+                if text and token_callback:
+                    self._text_callback(token_callback, [1], request_state)(0, text)
+            else:
+                streamer = self._make_streamer(token_callback, [1], request_state)
+                try:
+                    text = self._generate(self._build_inputs([windows], model), max_new_tokens, streamer,
+                                          cancel_token, model)[0]
+                except TranscriptionCancelled as e:
+                    raise self._cancelled(e.reason, [(0, wav.shape[1])])
+                if key is not None:
+                    self.segment_cache.put(key, text)
+            if progress_callback:
+                progress_callback(1, 1, duration, text)
+            return text
+        
+        plan = checkpoint.plan if checkpoint else None
+        if plan:
+            # 沿用重启前的分段计划，保证已完成分组的编号不变
+            segments = [tuple(seg) for seg in plan["segments"]]
+            windows = plan["windows"]
+        else:
+            segments, windows = segmentation or self._plan_segments(wav, packing)
+        if not segments:
+            return ""
+        
+        chunks = self._segment_audio(wav, segments, windows)
+        if plan:
+            groups = plan["groups"]
+        elif long_context:
+            groups = self._group_long_context(chunks, max_new_tokens)
+            logger.info(f"长上下文模式: {len(chunks)} 个窗口合并为 {len(groups)} 次生成")
+        else:
+            groups = [[i] for i in range(len(chunks))]
+        if checkpoint and not plan:
+            checkpoint.save_plan({"segments": segments, "windows": windows, "groups": groups})
+        
+        total = len(groups)
+        group_seconds = [sum(chunks[j].shape[0] for j in group) / 16000 for group in groups]
+        texts = {}
+        pending = []
+        for i, group in enumerate(groups):
+            if checkpoint and i in checkpoint.results:
+                # 重启前已完成的分组
+                texts[i] = checkpoint.results[i]
                 if progress_callback:
-                    progress_callback(1, 1, duration, text)
-                return text
-            
-            segments = smart_segment(wav[0], sr=16000, max_duration=25.0, min_duration=2.0)
-            if not segments:
-                return ""
+                    progress_callback(i + 1, total, group_seconds[i], texts[i] or None)
+            else:
+                pending.append(i)
+        
+        def on_start(i):
+            if progress_callback:
+                progress_callback(i + 1, total, group_seconds[i], None)
+
+        def on_result(i, text):
+            texts[i] = text
+            if checkpoint:
+                checkpoint.record(i, text)
+            if text and progress_callback:
+                progress_callback(i + 1, total, group_seconds[i], text)
+
+        samples = [[chunks[j] for j in group] for group in groups]
+        try:
+            self._generate_samples(samples, [max_new_tokens * len(group) for group in groups], pending,
+                                   request_state, token_callback, cancel_token, on_start, on_result, model)
+        except TranscriptionCancelled as e:
+            remaining = [i for i in pending if i not in texts]
+            raise self._cancelled(e.reason, segments[groups[remaining[0]][0]:] if remaining else [])
+        
+        return ''.join(texts[i] for i in range(total) if texts.get(i))
+
+    def _generate_samples(self, samples: list, max_tokens: list, pending: list, request_state: dict,
+                          token_callback=None, cancel_token=None, on_start=None, on_result=None, model=None):
+        """按显存估算把 pending 中的样本组批生成，显存不足时减半批大小重试
+
+        samples[i] 为一个样本的窗口列表，max_tokens[i] 为其生成上限；
+        on_start(i) 在样本首次进入批次时调用，on_result(i, text) 在样本完成时调用，已完成的样本不会因后续 OOM 重做。
+        命中分段缓存的样本不送入模型；同一次调用中内容重复的样本只生成一次。
+        """
+        def reuse(i, text):
+            # 不经过模型直接给出结果（缓存命中或与本次调用中已生成的样本重复）
+            if on_start:
+                on_start(i)
+            if text and token_callback:
+                self._text_callback(token_callback, [i + 1], request_state)(0, text)
+            if on_result:
+                on_result(i, text)
+
+        keys, first_of, duplicates, uncached = {}, [], {}, []
+        for i in pending:
+            keys[i] = key = self._cache_key(samples[i], max_tokens[i], model)
+            first = next((j for j in first_of if key.matches(keys[j])), None) if key is not None else None
+            if first is not None:
+                duplicates.setdefault(first, []).append(i)
+                self.segment_cache.hit(sum(w.shape[0] for w in samples[i]) / 16000)
+                continue
+            text = self._cached_text(key, samples[i])
+            if text is not None:
+                reuse(i, text)
+                continue
+            if key is not None:
+                first_of.append(i)
+            uncached.append(i)
+
+        def finish(i, text):
+            if keys[i] is not None:
+                self.segment_cache.put(keys[i], text)
+            if on_result:
+                on_result(i, text)
+            for j in duplicates.get(i, []):
+                reuse(j, text)
+
+        # OOM 重试时批内样本从头重新流式输出：按样本记录已发出的长度，只转发超出部分，客户端不会收到重复文本
+        sent, streamed = {}, {}
+
+        def on_token(index, text):
+            streamed[index] = streamed.get(index, '') + text
+            if len(streamed[index]) > sent.get(index, 0):
+                token_callback(index, streamed[index][sent.get(index, 0):])
+                sent[index] = len(streamed[index])
+
+        # 每个样本的序列长度，用于估算显存和决定批大小
+        pending = uncached
+        lengths = {i: self.batcher.sequence_tokens([c.shape[0] for c in samples[i]], max_tokens[i]) for i in pending}
+        started = set()
+        while pending:
+            if cancel_token:
+                cancel_token.raise_if_cancelled()
+            # 投机解码只支持单样本生成
+            size = 1 if self.draft_model is not None and model is None else self.batcher.next_batch_size([lengths[i] for i in pending])
+            batch = pending[:size]
+            for i in batch:
+                if i not in started:
+                    started.add(i)
+                    if on_start:
+                        on_start(i)
             
-            total = len(segments)
-            results = []
-            for i, (start, end) in enumerate(segments):
-                seg_dur = (end - start) / 16000
-                if progress_callback:
-                    progress_callback(i + 1, total, seg_dur, None)
-                
-                chunk = wav[:, start:end]
-                with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as f:
-                    tmp_path = f.name
-                    torchaudio.save(tmp_path, chunk, 16000)
-                
-                try:
-                    inputs = self.processor.apply_transcription_request(tmp_path)
-                    inputs = inputs.to(self.model.device, dtype=self.model.dtype)
-                    with torch.inference_mode():
-                        outputs = self.model.generate(**inputs, do_sample=False, max_new_tokens=max_new_tokens)
-                    decoded = self.processor.batch_decode(outputs[:, inputs.input_ids.shape[1]:], skip_special_tokens=True)
-                    text = decoded[0].strip() if decoded else ""
-                    if text:
-                        results.append(text)
-                        if progress_callback:
-                            progress_callback(i + 1, total, seg_dur, text)
-                finally:
-                    os.unlink(tmp_path)
+            for i in batch:
+                streamed.pop(i + 1, None)
+            # 每个窗口单独提取特征，多个窗口时在同一提示词中连续排列
+            streamer = self._make_streamer(token_callback and on_token, [i + 1 for i in batch], request_state)
+            try:
+                batch_texts = self._generate_batch([samples[i] for i in batch], [lengths[i] for i in batch],
+                                                   max(max_tokens[i] for i in batch), streamer, cancel_token, model)
+            except TranscriptionCancelled:
+                raise
+            except Exception as e:
+                # 显存不足：减半批大小重试；单个样本仍不足时放弃
+                if not is_oom(e) or len(batch) == 1:
+                    raise
+                self.batcher.on_oom(len(batch))
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+                continue
             
-            return ''.join(results)
+            pending = pending[len(batch):]
+            for i, text in zip(batch, batch_texts):
+                finish(i, text)
 
 
-# 全局单例
-gpu_manager = GPUManager()
+# 全局单例：设置 INFERENCE_SERVER_SOCKET 时改用独立推理进程的代理
+if os.environ.get('INFERENCE_SERVER_SOCKET'):
+    from inference_server import RemoteGPUManager
+    gpu_manager = RemoteGPUManager(os.environ['INFERENCE_SERVER_SOCKET'])
+else:
+    gpu_manager = GPUManager()
@@ -1,14 +1,26 @@
+"""最小转录 CLI
+
+    python inference.py --audio x.wav
+
+常驻模式：先启动 `python inference.py --daemon`，模型一直留在显存中，之后的 CLI 调用
+通过本地 UNIX socket 交给常驻进程，不再导入 torch / transformers、也不再加载模型；
+没有常驻进程（或其检查点、设备与本次参数不一致）时自动退回进程内加载。
+
+投机解码：`--draft_checkpoint` 指定与主模型同词表的小草稿模型，输出与普通贪心解码一致，
+结束时打印接受率；加 `--compare` 再跑一遍普通贪心解码，打印实测加速比并核对输出。
+"""
 import argparse
+import json
+import os
+import socket
+import socketserver
+import sys
+import time
 from pathlib import Path
 
-import torch
-import torchaudio
-from transformers import (
-    AutoConfig,
-    AutoModelForCausalLM,
-    AutoTokenizer,
-    WhisperFeatureExtractor,
-)
+# torch / transformers 在用到时才导入，使用常驻进程时客户端无需承担导入开销
+DEFAULT_DAEMON_SOCKET = os.environ.get('INFERENCE_DAEMON_SOCKET', '/tmp/glm-asr-cli.sock')
+DEFAULT_DRAFT_CHECKPOINT = os.environ.get('DRAFT_CHECKPOINT') or None
 
 WHISPER_FEAT_CFG = {
     "chunk_length": 30,
@@ -26,6 +38,10 @@ WHISPER_FEAT_CFG = {
 }
 
 
+# GLM-ASR-Nano 的音频 token 合并倍数（config.merge_factor），服务端估算序列长度时共用
+MERGE_FACTOR = 4
+
+
 def get_audio_token_length(seconds, merge_factor=2):
     def get_T_after_cnn(L_in, dilation=1):
         for padding, kernel_size, stride in eval("[(1,3,1)] + [(1,3,2)] "):
@@ -44,10 +60,14 @@ def get_audio_token_length(seconds, merge_factor=2):
 def build_prompt(
     audio_path: Path,
     tokenizer,
-    feature_extractor: WhisperFeatureExtractor,
+    feature_extractor,
     merge_factor: int,
     chunk_seconds: int = 30,
+    device=None,
 ) -> dict:
+    import torch
+    import torchaudio
+
     audio_path = Path(audio_path)
     wav, sr = torchaudio.load(str(audio_path))
     wav = wav[:1, :]
@@ -58,20 +78,14 @@ def build_prompt(
     tokens += tokenizer.encode("<|user|>")
     tokens += tokenizer.encode("\n")
 
-    audios = []
+    chunks = []
     audio_offsets = []
     audio_length = []
     chunk_size = chunk_seconds * feature_extractor.sampling_rate
     for start in range(0, wav.shape[1], chunk_size):
-        chunk = wav[:, start : start + chunk_size]
-        mel = feature_extractor(
-            chunk.numpy(),
-            sampling_rate=feature_extractor.sampling_rate,
-            return_tensors="pt",
-            padding="max_length",
-        )["input_features"]
-        audios.append(mel)
-        seconds = chunk.shape[1] / feature_extractor.sampling_rate
+        chunk = wav[0, start : start + chunk_size]
+        chunks.append(chunk)
+        seconds = chunk.shape[0] / feature_extractor.sampling_rate
         num_tokens = get_audio_token_length(seconds, merge_factor)
         tokens += tokenizer.encode("<|begin_of_audio|>")
         audio_offsets.append(len(tokens))
@@ -79,9 +93,12 @@ def build_prompt(
         tokens += tokenizer.encode("<|end_of_audio|>")
         audio_length.append(num_tokens)
 
-    if not audios:
+    if not chunks:
         raise ValueError("音频内容为空或加载失败。")
 
+    # 所有块一次性在目标设备上提取特征
+    audios, _ = feature_extractor(chunks, device=device)
+
     tokens += tokenizer.encode("<|user|>")
     tokens += tokenizer.encode("\nPlease transcribe this audio into text")
 
@@ -90,7 +107,7 @@ def build_prompt(
 
     batch = {
         "input_ids": torch.tensor([tokens], dtype=torch.long),
-        "audios": torch.cat(audios, dim=0),
+        "audios": audios,
         "audio_offsets": [audio_offsets],
         "audio_length": [audio_length],
         "attention_mask": torch.ones(1, len(tokens), dtype=torch.long),
@@ -99,6 +116,8 @@ def build_prompt(
 
 
 def prepare_inputs(batch: dict, device) -> tuple:
+    import torch
+
     tokens = batch["input_ids"].to(device)
     attention_mask = batch["attention_mask"].to(device)
     audios = batch["audios"].to(device)
@@ -112,16 +131,22 @@ def prepare_inputs(batch: dict, device) -> tuple:
     return model_inputs, tokens.size(1)
 
 
-def transcribe(
-    checkpoint_dir: Path,
-    audio_path: Path,
-    tokenizer_path: str,
-    max_new_tokens: int,
-    device: str,
-):
+def default_device() -> str:
+    import torch
+
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def load_model(checkpoint_dir: Path, tokenizer_path: str, device: str) -> tuple:
+    """加载分词器、特征提取器和模型，返回 (tokenizer, feature_extractor, config, model)"""
+    import torch
+    from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer
+
+    from mel_frontend import LogMelFrontend
+
     tokenizer_source = tokenizer_path if tokenizer_path else checkpoint_dir
     tokenizer = AutoTokenizer.from_pretrained(tokenizer_source)
-    feature_extractor = WhisperFeatureExtractor(**WHISPER_FEAT_CFG)
+    feature_extractor = LogMelFrontend(**WHISPER_FEAT_CFG)
 
     config = AutoConfig.from_pretrained(checkpoint_dir, trust_remote_code=True)
     model = AutoModelForCausalLM.from_pretrained(
@@ -131,34 +156,202 @@ def transcribe(
         trust_remote_code=True,
     ).to(device)
     model.eval()
+    return tokenizer, feature_extractor, config, model
+
+
+def load_draft(draft_checkpoint: str, model, device: str):
+    """加载投机解码的草稿模型，返回 (draft_model, SpeculationStats)"""
+    import torch
+    from transformers import AutoModelForCausalLM
+
+    from speculative import SpeculationStats, prepare_draft
+
+    draft = AutoModelForCausalLM.from_pretrained(
+        draft_checkpoint,
+        torch_dtype=torch.bfloat16,
+        trust_remote_code=True,
+    ).to(device)
+    draft.eval()
+    stats = SpeculationStats()
+    # 草稿模型提出音频占位符会使占位符数与音频特征对不上；build_prompt 用 0 填充占位
+    prepare_draft(model, draft, getattr(model.config, "audio_token_id", 0), stats)
+    return draft, stats
 
+
+def run(loaded: tuple, audio_path: Path, max_new_tokens: int, device: str, draft: tuple = None) -> str:
+    """用已加载的模型转录一个文件；draft 为 load_draft 的返回值时使用投机解码"""
+    import torch
+
+    tokenizer, feature_extractor, config, model = loaded
     batch = build_prompt(
         audio_path,
         tokenizer,
         feature_extractor,
         merge_factor=config.merge_factor,
+        device=device,
     )
 
     model_inputs, prompt_len = prepare_inputs(batch, device)
 
+    assisted = {}
+    if draft is not None:
+        draft_model, stats = draft
+        assisted = {"assistant_model": draft_model, "streamer": stats.streamer()}
+
     with torch.inference_mode():
         generated = model.generate(
             **model_inputs,
             max_new_tokens=max_new_tokens,
             do_sample=False,
+            **assisted,
         )
     transcript_ids = generated[0, prompt_len:].cpu().tolist()
-    transcript = tokenizer.decode(transcript_ids, skip_special_tokens=True).strip()
+    return tokenizer.decode(transcript_ids, skip_special_tokens=True).strip()
+
+
+def print_transcript(transcript: str):
     print("----------")
     print(transcript or "[Empty transcription]")
 
 
+def print_speculation(stats, elapsed: float):
+    report = stats.status()
+    rate = report["acceptance_rate"] or 0.0
+    print(f"投机解码: 接受率 {rate:.1%}（{report['accepted']}/{report['drafted']} 个候选），"
+          f"每次主模型前向 {report['tokens_per_pass']} 个 token，耗时 {elapsed:.2f}s", file=sys.stderr)
+
+
+def transcribe(
+    checkpoint_dir: Path,
+    audio_path: Path,
+    tokenizer_path: str,
+    max_new_tokens: int,
+    device: str,
+    draft_checkpoint: str = None,
+    compare: bool = False,
+):
+    loaded = load_model(checkpoint_dir, tokenizer_path, device)
+    if not draft_checkpoint:
+        print_transcript(run(loaded, audio_path, max_new_tokens, device))
+        return
+
+    draft = load_draft(draft_checkpoint, loaded[3], device)
+    if compare:
+        # 先跑普通贪心解码（同时预热主模型），再跑投机解码
+        started = time.perf_counter()
+        baseline = run(loaded, audio_path, max_new_tokens, device)
+        baseline_elapsed = time.perf_counter() - started
+    started = time.perf_counter()
+    transcript = run(loaded, audio_path, max_new_tokens, device, draft)
+    elapsed = time.perf_counter() - started
+    print_transcript(transcript)
+    print_speculation(draft[1], elapsed)
+    if compare:
+        print(f"普通贪心解码耗时 {baseline_elapsed:.2f}s，加速 {baseline_elapsed / elapsed:.2f}x，"
+              f"输出{'一致' if baseline == transcript else '不一致'}", file=sys.stderr)
+
+
+# ==================== 常驻模式 ====================
+def _model_key(checkpoint_dir, tokenizer_path, device, draft_checkpoint=None) -> dict:
+    """常驻进程与 CLI 参数是否一致的判据"""
+    return {
+        "checkpoint_dir": str(Path(checkpoint_dir).resolve()),
+        "tokenizer_path": str(Path(tokenizer_path).resolve()) if tokenizer_path else None,
+        "device": device,
+        "draft_checkpoint": str(Path(draft_checkpoint).resolve()) if draft_checkpoint else None,
+    }
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    """每个连接一次请求：{"audio", "max_new_tokens", "model"} -> {"text", "elapsed"} 或 {"error"}"""
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        request = json.loads(line)
+        server = self.server
+        model = request.get("model") or {}
+        if any(model.get(k, v) != v for k, v in server.key.items()):
+            reply = {"error": "mismatch", "message": f"常驻进程使用 {server.key}"}
+        else:
+            started = time.perf_counter()
+            try:
+                text = run(server.loaded, Path(request["audio"]), request.get("max_new_tokens", 128),
+                           server.key["device"], server.draft)
+                reply = {"text": text, "elapsed": round(time.perf_counter() - started, 3)}
+            except Exception as e:
+                reply = {"error": "failed", "message": str(e)}
+        self.wfile.write((json.dumps(reply, ensure_ascii=False) + "\n").encode("utf-8"))
+
+
+def serve_daemon(socket_path: str, checkpoint_dir: Path, tokenizer_path: str, device: str,
+                 draft_checkpoint: str = None):
+    """加载模型后在 UNIX socket 上逐个处理请求（单线程，GPU 上天然串行）"""
+    if os.path.exists(socket_path):
+        if _daemon_alive(socket_path):
+            raise SystemExit(f"常驻进程已在运行: {socket_path}")
+        os.unlink(socket_path)
+
+    started = time.perf_counter()
+    loaded = load_model(checkpoint_dir, tokenizer_path, device)
+    server = socketserver.UnixStreamServer(socket_path, DaemonRequestHandler)
+    server.loaded = loaded
+    server.draft = load_draft(draft_checkpoint, loaded[3], device) if draft_checkpoint else None
+    server.key = _model_key(checkpoint_dir, tokenizer_path, device, draft_checkpoint)
+    print(f"模型已加载（{time.perf_counter() - started:.1f}s），监听 {socket_path}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def _daemon_alive(socket_path: str) -> bool:
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(1.0)
+            sock.connect(socket_path)
+        return True
+    except OSError:
+        return False
+
+
+def daemon_transcribe(socket_path: str, audio_path: Path, max_new_tokens: int, model: dict):
+    """交给常驻进程转录；没有常驻进程或参数不一致时返回 None"""
+    if not os.path.exists(socket_path):
+        return None
+    request = {"audio": str(Path(audio_path).resolve()), "max_new_tokens": max_new_tokens, "model": model}
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(1.0)
+            sock.connect(socket_path)
+            # 连上后等待推理完成，不设超时
+            sock.settimeout(None)
+            sock.sendall((json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8"))
+            line = sock.makefile("rb").readline()
+    except OSError:
+        return None
+    if not line:
+        return None
+    reply = json.loads(line)
+    if reply.get("error") == "mismatch":
+        print(f"忽略常驻进程（{reply['message']}），改为进程内加载", file=sys.stderr)
+        return None
+    if "error" in reply:
+        raise RuntimeError(reply["message"])
+    return reply["text"]
+
+
 def main():
     parser = argparse.ArgumentParser(description="Minimal ASR transcription demo.")
     parser.add_argument(
         "--checkpoint_dir", type=str, default=str(Path(__file__).parent)
     )
-    parser.add_argument("--audio", type=str, required=True, help="Path to audio file.")
+    parser.add_argument("--audio", type=str, help="Path to audio file.")
     parser.add_argument(
         "--tokenizer_path",
         type=str,
@@ -167,16 +360,64 @@ def main():
     )
     parser.add_argument("--max_new_tokens", type=int, default=128)
     parser.add_argument(
-        "--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu"
+        "--device", type=str, default=None, help="Defaults to cuda when available."
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep the model loaded and serve CLI calls over a UNIX socket.",
+    )
+    parser.add_argument(
+        "--socket",
+        type=str,
+        default=DEFAULT_DAEMON_SOCKET,
+        help="Daemon socket path (env INFERENCE_DAEMON_SOCKET).",
+    )
+    parser.add_argument(
+        "--no_daemon",
+        action="store_true",
+        help="Always load the model in-process, even if a daemon is running.",
+    )
+    parser.add_argument(
+        "--draft_checkpoint",
+        type=str,
+        default=DEFAULT_DRAFT_CHECKPOINT,
+        help="Small draft model for speculative decoding (env DRAFT_CHECKPOINT); output is unchanged.",
+    )
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="With --draft_checkpoint: also run plain greedy decoding and report the speedup.",
     )
     args = parser.parse_args()
+    if not args.daemon and not args.audio:
+        parser.error("--audio is required unless --daemon is given")
+
+    if args.daemon:
+        serve_daemon(
+            args.socket, Path(args.checkpoint_dir), args.tokenizer_path, args.device or default_device(),
+            args.draft_checkpoint,
+        )
+        return
+
+    if not args.no_daemon and not args.compare:
+        # 常驻进程的设备在其启动时已确定；未显式指定 --device 时不参与比较
+        model = _model_key(args.checkpoint_dir, args.tokenizer_path, args.device, args.draft_checkpoint)
+        if args.device is None:
+            del model["device"]
+        transcript = daemon_transcribe(args.socket, Path(args.audio), args.max_new_tokens, model)
+        if transcript is not None:
+            print_transcript(transcript)
+            return
 
     transcribe(
         checkpoint_dir=Path(args.checkpoint_dir),
         audio_path=Path(args.audio),
         tokenizer_path=args.tokenizer_path,
         max_new_tokens=args.max_new_tokens,
-        device=args.device,
+        device=args.device or default_device(),
+        draft_checkpoint=args.draft_checkpoint,
+        compare=args.compare,
     )
 
 
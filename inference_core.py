@@ -0,0 +1,248 @@
+"""共享推理核心 - Flask、FastAPI、socket.io 和 MCP 前端共用的任务执行、进度分发与取消
+
+每个转录请求是一个 InferenceTask，在有界线程池（INFERENCE_WORKERS，默认 4）中执行
+gpu_manager.transcribe / transcribe_batch；进度、分段、token 事件写入任务自己的事件队列，
+消费方被唤醒而不是轮询：
+    同步前端（Flask、socket.io）:  for event in task.events(): ...
+    异步前端（FastAPI、MCP）:      async for event in task.aevents(): ...
+    只要结果:                      task.result() / await task.aresult()
+
+事件格式与 SSE 协议一致：start / quality / progress / partial / token / heartbeat / done / cancelled / error。
+取消统一走 task.cancel(reason) 或 inference_core.cancel(job_id)；任务结束时自动释放准入票据、
+注销 job、删除临时文件。
+"""
+import asyncio
+import collections
+import json
+import os
+import threading
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from gpu_manager import CANCEL_REQUEST, CLIENT_DISCONNECT, gpu_manager, TranscriptionCancelled
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_EVENTS = ('done', 'cancelled', 'error')
+
+
+def sse(event: dict) -> str:
+    """把事件编码为一条 SSE 消息"""
+    return f"data: {json.dumps(event)}\n\n"
+
+
+class InferenceTask:
+    """一次转录任务：执行状态、事件队列和结果
+
+    事件只能由一个消费者读取（events 与 aevents 二选一）。
+    """
+
+    def __init__(self, fn, job_id: str, token, ticket=None, cleanup_path: str = None, on_finish=None):
+        self.job_id = job_id
+        self.token = token
+        self._fn = fn
+        self._ticket = ticket
+        self._cleanup_path = cleanup_path
+        self._on_finish = on_finish
+        self._result = Future()
+        self._events = collections.deque()
+        self._cond = threading.Condition()
+        self._waiters = []
+        # 执行线程和排队期间的取消谁先置位，谁负责收尾
+        self._started = False
+        # 实际使用的质量档位，开始转录后确定
+        self.quality = None
+        self.emit({"type": "start", "job_id": job_id})
+
+    @property
+    def done(self) -> bool:
+        return self._result.done()
+
+    # ---------- 事件 ----------
+    def emit(self, event: dict):
+        with self._cond:
+            self._events.append(event)
+            self._cond.notify_all()
+            waiters = list(self._waiters)
+        for loop, ready in waiters:
+            try:
+                loop.call_soon_threadsafe(ready.set)
+            except RuntimeError:
+                # 消费方的事件循环已关闭
+                pass
+
+    def on_progress(self, current, total, duration, text):
+        self.emit({"type": "progress", "current": current, "total": total, "duration": round(duration, 1)})
+        if text:
+            self.emit({"type": "partial", "text": text})
+
+    def on_token(self, index, text):
+        self.emit({"type": "token", "index": index, "text": text})
+
+    def on_quality(self, tier):
+        self.quality = tier
+        self.emit({"type": "quality", "tier": tier})
+
+    def events(self, heartbeat: float = 1.0):
+        """阻塞迭代事件直到结束事件；heartbeat 秒内没有新事件时产生一次 heartbeat"""
+        while True:
+            with self._cond:
+                if not self._events:
+                    self._cond.wait(heartbeat)
+                event = self._events.popleft() if self._events else {"type": "heartbeat"}
+            yield event
+            if event["type"] in TERMINAL_EVENTS:
+                return
+
+    async def aevents(self, heartbeat: float = 1.0):
+        """异步迭代事件，语义同 events"""
+        ready = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), ready)
+        with self._cond:
+            self._waiters.append(waiter)
+        try:
+            while True:
+                with self._cond:
+                    event = self._events.popleft() if self._events else None
+                    if event is None:
+                        ready.clear()
+                if event is None:
+                    try:
+                        await asyncio.wait_for(ready.wait(), heartbeat)
+                        continue
+                    except asyncio.TimeoutError:
+                        event = {"type": "heartbeat"}
+                yield event
+                if event["type"] in TERMINAL_EVENTS:
+                    return
+        finally:
+            with self._cond:
+                self._waiters.remove(waiter)
+
+    # ---------- 结果 ----------
+    def result(self, timeout: float = None):
+        """阻塞等待结果；取消时抛出 TranscriptionCancelled，失败时抛出原异常"""
+        return self._result.result(timeout)
+
+    async def aresult(self):
+        """异步等待结果；等待方被取消（如客户端断开）时一并取消任务"""
+        try:
+            return await asyncio.shield(asyncio.wrap_future(self._result))
+        except asyncio.CancelledError:
+            self.cancel(CLIENT_DISCONNECT)
+            raise
+
+    # ---------- 执行与取消 ----------
+    def cancel(self, reason: str = CANCEL_REQUEST):
+        """取消任务：执行中的在下一个 token 处停止，仍在线程池排队的立即结束"""
+        if self.done:
+            return
+        self.token.cancel(reason)
+        with self._cond:
+            queued = not self._started
+            self._started = True
+        if queued:
+            self._finish(error=TranscriptionCancelled(reason))
+
+    def run(self):
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+        try:
+            value = self._fn(self)
+        except Exception as e:
+            self._finish(error=e)
+        else:
+            self._finish(value=value)
+
+    def _finish(self, value=None, error: Exception = None):
+        if self._ticket is not None:
+            self._ticket.release()
+        gpu_manager.finish_job(self.job_id)
+        if self._cleanup_path and os.path.exists(self._cleanup_path):
+            os.remove(self._cleanup_path)
+        if self._on_finish:
+            self._on_finish(self)
+
+        if isinstance(error, TranscriptionCancelled):
+            self.emit({"type": "cancelled", "reason": error.reason})
+        elif error is not None:
+            logger.error(f"转录失败 ({self.job_id}): {error}")
+            self.emit({"type": "error", "message": str(error)})
+        elif isinstance(value, str):
+            self.emit({"type": "done", "text": value, "quality": self.quality})
+        else:
+            self.emit({"type": "done", "results": value})
+
+        if error is not None:
+            self._result.set_exception(error)
+        else:
+            self._result.set_result(value)
+
+
+class InferenceCore:
+    """有界线程池 + 任务登记表"""
+
+    def __init__(self, workers: int = 4):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='inference')
+        self.tasks = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "InferenceCore":
+        return cls(workers=int(os.environ.get('INFERENCE_WORKERS', 4)))
+
+    def _submit(self, fn, deadline_s: float = None, ticket=None, cleanup_path: str = None) -> InferenceTask:
+        job_id, token = gpu_manager.create_job(deadline_s)
+        task = InferenceTask(fn, job_id, token, ticket, cleanup_path, on_finish=self._forget)
+        with self._lock:
+            self.tasks[job_id] = task
+        self.executor.submit(task.run)
+        return task
+
+    def _forget(self, task: InferenceTask):
+        with self._lock:
+            self.tasks.pop(task.job_id, None)
+
+    def submit(self, audio, max_new_tokens: int = 512, deadline_s: float = None, packing: bool = None,
+               long_context: bool = None, ticket=None, cleanup_path: str = None, quality: str = None) -> InferenceTask:
+        """提交单个音频（文件路径或波形）的转录
+
+        Args:
+            ticket: 准入票据，任务结束时释放
+            cleanup_path: 任务结束时删除的临时文件
+            quality: 质量档位，实际使用的档位见 task.quality 和 quality 事件
+        """
+        return self._submit(
+            lambda task: gpu_manager.transcribe(audio, max_new_tokens, task.on_progress, task.on_token,
+                                                task.token, packing, long_context, task.job_id,
+                                                quality, task.on_quality),
+            deadline_s, ticket, cleanup_path,
+        )
+
+    def submit_batch(self, audio_paths: list, max_new_tokens: int = 512, deadline_s: float = None,
+                     packing: bool = None, quality: str = None, ticket=None) -> InferenceTask:
+        """提交多文件组批转录，结果格式同 gpu_manager.transcribe_batch；ticket 为整批的准入票据"""
+        return self._submit(
+            lambda task: gpu_manager.transcribe_batch(audio_paths, max_new_tokens, task.token, packing, quality),
+            deadline_s, ticket,
+        )
+
+    def cancel(self, job_id: str, reason: str = CANCEL_REQUEST) -> bool:
+        """取消任务；不是本核心提交的任务（续传、PCM 流、断点恢复）交给 gpu_manager"""
+        task = self.tasks.get(job_id)
+        if task is None:
+            return gpu_manager.cancel_job(job_id, reason)
+        task.cancel(reason)
+        return True
+
+    def status(self) -> dict:
+        with self._lock:
+            tasks = list(self.tasks.values())
+        running = sum(1 for task in tasks if task._started)
+        return {"workers": self.workers, "running": running, "queued": len(tasks) - running}
+
+
+inference_core = InferenceCore.from_env()
@@ -0,0 +1,449 @@
+"""独立推理进程 - 模型只加载一次，多个 HTTP worker 通过共享内存 + UNIX socket 提交 PCM
+
+启动推理进程:
+    python inference_server.py
+
+HTTP worker 设置 INFERENCE_SERVER_SOCKET 后，`from gpu_manager import gpu_manager` 得到的是
+RemoteGPUManager 代理，接口与 GPUManager 一致:
+    INFERENCE_SERVER_SOCKET=/tmp/glm-asr-inference.sock \\
+        gunicorn -k uvicorn.workers.UvicornWorker -w 8 -b 0.0.0.0:7860 main:app
+
+协议：每个连接一次请求，JSON 行。音频由 worker 解码为 16kHz float32 PCM 写入共享内存，
+推理进程直接映射为张量（零拷贝），事件和结果通过 socket 逐行返回。
+准入票据（admit）占用一个连接直到释放，HTTP worker 异常退出时连接关闭，票据随之释放，不会一直占着队列。
+"""
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+import uuid
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import torch
+
+from gpu_manager import CANCEL_REQUEST, CLIENT_DISCONNECT, CancellationToken, TranscriptionCancelled, load_audio
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = '/tmp/glm-asr-inference.sock'
+
+
+def _send(stream, message: dict):
+    stream.write((json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8"))
+    stream.flush()
+
+
+def _attach(name: str) -> SharedMemory:
+    """映射客户端创建的共享内存；生命周期由客户端负责，不登记到本进程的 resource_tracker"""
+    shm = SharedMemory(name=name)
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+
+# ==================== 推理进程 ====================
+class InferenceRequestHandler(socketserver.StreamRequestHandler):
+    """处理一个连接上的一次请求"""
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        request = json.loads(line)
+        op = request.get("op")
+        try:
+            if op == "transcribe":
+                self._transcribe(request)
+            elif op == "transcribe_batch":
+                self._transcribe_batch(request)
+            elif op == "admit":
+                self._admit(request)
+            else:
+                _send(self.wfile, {"event": "result", "result": self._call(op, request)})
+        except Exception as e:
+            logger.error(f"推理请求失败 ({op}): {e}")
+            _send(self.wfile, {"event": "error", "message": str(e), "runtime": isinstance(e, RuntimeError)})
+
+    def _call(self, op: str, request: dict):
+        manager = self.server.manager
+        if op == "status":
+            return manager.get_status()
+        if op == "load":
+            return manager.load(request.get("checkpoint") or manager.checkpoint_dir or self.server.checkpoint)
+        if op == "unload":
+            return manager.unload()
+        if op == "reload":
+            return manager.reload()
+        if op == "cancel_job":
+            return manager.cancel_job(request["job_id"], request.get("reason", CANCEL_REQUEST))
+        if op == "check":
+            return self._admission(manager.admission.check)
+        if op == "queue_status":
+            return manager.admission.status()
+        raise ValueError(f"未知操作: {op}")
+
+    @staticmethod
+    def _admission(fn, *args):
+        from admission import QueueFull
+        try:
+            return fn(*args)
+        except QueueFull as e:
+            return {"queue_full": str(e), "retry_after": e.retry_after}
+
+    def _admit(self, request: dict):
+        """准入票据绑定在这条连接上：收到 release 或连接断开（包括 HTTP worker 进程退出）时释放"""
+        ticket = self._admission(self.server.manager.admission.admit, request["audio_seconds"])
+        if isinstance(ticket, dict):
+            _send(self.wfile, {"event": "result", "result": ticket})
+            return
+        try:
+            _send(self.wfile, {"event": "result", "result": {"ticket": True}})
+            self.rfile.readline()
+        except OSError:
+            pass
+        finally:
+            ticket.release()
+
+    def _watch(self, token: CancellationToken):
+        """同一连接上继续读取：收到 cancel 或连接断开时取消"""
+        def watch():
+            for line in self.rfile:
+                message = json.loads(line)
+                if message.get("op") == "cancel":
+                    token.cancel(message.get("reason") or CANCEL_REQUEST)
+                    return
+            token.cancel(CLIENT_DISCONNECT)
+
+        threading.Thread(target=watch, daemon=True).start()
+
+    def _transcribe(self, request: dict):
+        manager = self.server.manager
+        lock = threading.Lock()
+
+        def emit(message):
+            with lock:
+                _send(self.wfile, message)
+
+        def run(pcm, token):
+            text = manager.transcribe(
+                torch.from_numpy(pcm), request.get("max_new_tokens", 512),
+                lambda current, total, duration, text: emit(
+                    {"event": "progress", "current": current, "total": total, "duration": duration, "text": text}),
+                (lambda index, text: emit({"event": "token", "index": index, "text": text}))
+                if request.get("stream_tokens") else None,
+                token, request.get("packing"), request.get("long_context"), request["job_id"],
+                request.get("quality"), lambda tier: emit({"event": "quality", "tier": tier}),
+            )
+            return {"text": text}
+
+        self._run_job(request, run, emit)
+
+    def _transcribe_batch(self, request: dict):
+        """多个文件的 PCM 依次拼在同一块共享内存里，按 samples 切开后在本进程内跨文件组批"""
+        manager = self.server.manager
+
+        def run(pcm, token):
+            bounds = np.cumsum([0] + request["samples"])
+            wavs = [torch.from_numpy(pcm[start:end]) for start, end in zip(bounds[:-1], bounds[1:])]
+            return {"results": manager.transcribe_batch(wavs, request.get("max_new_tokens", 512), token,
+                                                        request.get("packing"), request.get("quality"))}
+
+        self._run_job(request, run, lambda message: _send(self.wfile, message))
+
+    def _run_job(self, request: dict, run, emit):
+        """登记任务、映射共享内存并监听取消，run(pcm, token) 的返回值随 done 事件发回"""
+        manager = self.server.manager
+        job_id = request["job_id"]
+        token = CancellationToken(request.get("deadline_s"))
+        manager.jobs[job_id] = token
+        shm = _attach(request["shm"])
+        self._watch(token)
+        pcm = np.ndarray((request["total_samples"],), dtype=np.float32, buffer=shm.buf)
+        try:
+            emit({"event": "done", **run(pcm, token)})
+        except TranscriptionCancelled as e:
+            emit({"event": "cancelled", "reason": e.reason})
+        finally:
+            # 释放对共享内存的引用后才能关闭映射
+            pcm = None
+            manager.finish_job(job_id)
+            try:
+                shm.close()
+            except BufferError:
+                # 异常栈仍引用着波形视图，映射随垃圾回收释放
+                logger.warning("共享内存仍被引用，延迟关闭")
+
+
+class InferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, manager, checkpoint: str):
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, InferenceRequestHandler)
+        os.chmod(path, 0o660)
+        self.manager = manager
+        self.checkpoint = checkpoint
+
+
+# ==================== HTTP worker 侧代理 ====================
+class RemoteTicket:
+    """推理进程中的准入票据，占用一条连接直到释放；本进程退出时连接关闭，票据随之释放"""
+
+    def __init__(self, sock, stream):
+        self.sock = sock
+        self.stream = stream
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            try:
+                _send(self.stream, {"op": "release"})
+            except OSError:
+                pass
+            self.stream.close()
+            self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class RemoteAdmission:
+    """准入控制代理：队列状态在推理进程中全局维护"""
+
+    def __init__(self, manager: "RemoteGPUManager"):
+        self.manager = manager
+
+    @staticmethod
+    def _raise_if_full(result):
+        from admission import QueueFull
+        if isinstance(result, dict) and "queue_full" in result:
+            raise QueueFull(result["queue_full"], result["retry_after"])
+
+    def check(self):
+        self._raise_if_full(self.manager._call("check"))
+
+    def admit(self, audio_seconds: float) -> RemoteTicket:
+        sock = self.manager._connect()
+        stream = sock.makefile("rwb")
+        try:
+            _send(stream, {"op": "admit", "audio_seconds": audio_seconds})
+            reply = json.loads(stream.readline())
+            if reply["event"] == "error":
+                raise (RuntimeError if reply.get("runtime") else Exception)(reply["message"])
+            self._raise_if_full(reply["result"])
+        except BaseException:
+            stream.close()
+            sock.close()
+            raise
+        return RemoteTicket(sock, stream)
+
+    def status(self) -> dict:
+        return self.manager._call("queue_status")
+
+
+class RemoteGPUManager:
+    """GPUManager 的跨进程代理，供多 worker HTTP 前端使用"""
+
+    is_remote = True
+    # model 属性缓存推理进程状态的秒数
+    STATUS_TTL_S = 2.0
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET):
+        self.socket_path = socket_path
+        self.admission = RemoteAdmission(self)
+        self.jobs = {}
+        self._segment_max_s = None
+        self._model_loaded = None
+        self._status_at = float("-inf")
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.socket_path)
+        return sock
+
+    def _call(self, op: str, **kwargs):
+        with self._connect() as sock, sock.makefile("rwb") as stream:
+            _send(stream, {"op": op, **kwargs})
+            reply = json.loads(stream.readline())
+        if reply["event"] == "error":
+            raise (RuntimeError if reply.get("runtime") else Exception)(reply["message"])
+        return reply["result"]
+
+    @property
+    def model(self):
+        """远程模式下仅表示模型是否已加载；状态缓存 STATUS_TTL_S 秒，不必每次访问都往返推理进程"""
+        if time.monotonic() - self._status_at > self.STATUS_TTL_S:
+            self.get_status()
+        return True if self._model_loaded else None
+
+    def get_status(self) -> dict:
+        status = {**self._call("status"), "remote": self.socket_path}
+        self._model_loaded, self._status_at = status.get("model_loaded"), time.monotonic()
+        return status
+
+    @property
+    def segment_max_s(self) -> float:
+        """推理进程使用的分段上限（调优结果或 SEGMENT_MAX_S），本进程增量分段时与之一致"""
+        if self._segment_max_s is None:
+            self._segment_max_s = self.get_status()["tuning"]["params"]["segment_max_s"]["value"]
+        return self._segment_max_s
+
+    def load(self, checkpoint_dir: str = None):
+        self._status_at = float("-inf")
+        return self._call("load", checkpoint=checkpoint_dir)
+
+    def unload(self):
+        self._status_at = float("-inf")
+        return self._call("unload")
+
+    def reload(self):
+        self._status_at = float("-inf")
+        return self._call("reload")
+
+    def create_job(self, deadline_s: float = None) -> tuple:
+        job_id = uuid.uuid4().hex
+        token = CancellationToken(deadline_s)
+        self.jobs[job_id] = token
+        return job_id, token
+
+    def cancel_job(self, job_id: str, reason: str = CANCEL_REQUEST) -> bool:
+        token = self.jobs.get(job_id)
+        if token is not None:
+            token.cancel(reason)
+            return True
+        # 任务可能由其他 worker 提交，交给推理进程处理
+        return bool(self._call("cancel_job", job_id=job_id, reason=reason))
+
+    def finish_job(self, job_id: str):
+        self.jobs.pop(job_id, None)
+
+    def transcribe(self, audio_path, max_new_tokens: int = 512, progress_callback=None,
+                   token_callback=None, cancel_token: CancellationToken = None, packing: bool = None,
+                   long_context: bool = None, job_id: str = None, quality: str = None,
+                   quality_callback=None) -> str:
+        """在本进程解码音频，经共享内存交给推理进程转录；参数同 GPUManager.transcribe"""
+        pcm = load_audio(audio_path)[0].contiguous().numpy().astype(np.float32, copy=False)
+        request = {"op": "transcribe", "max_new_tokens": max_new_tokens, "packing": packing,
+                   "long_context": long_context, "quality": quality, "stream_tokens": token_callback is not None}
+        done = self._submit(request, pcm, cancel_token, job_id, progress_callback, token_callback, quality_callback)
+        return done["text"]
+
+    def transcribe_batch(self, audio_paths: list, max_new_tokens: int = 512,
+                         cancel_token: CancellationToken = None, packing: bool = None, quality: str = None) -> list:
+        """在本进程解码所有文件，作为一个请求提交，推理进程内跨文件组批；返回格式同 GPUManager.transcribe_batch"""
+        results, pcms = [], []
+        for path in audio_paths:
+            result = {"path": str(path)}
+            try:
+                pcms.append(load_audio(path)[0].contiguous().numpy().astype(np.float32, copy=False))
+            except Exception as e:
+                result.update(status="error", error=str(e))
+            results.append(result)
+        if not pcms:
+            return results
+
+        request = {"op": "transcribe_batch", "samples": [int(pcm.shape[0]) for pcm in pcms],
+                   "max_new_tokens": max_new_tokens, "packing": packing, "quality": quality}
+        done = self._submit(request, np.concatenate(pcms), cancel_token)
+        decoded = [result for result in results if "status" not in result]
+        for result, remote in zip(decoded, done["results"]):
+            result.update({**remote, "path": result["path"]})
+        return results
+
+    def _submit(self, request: dict, pcm: np.ndarray, cancel_token: CancellationToken = None, job_id: str = None,
+                progress_callback=None, token_callback=None, quality_callback=None) -> dict:
+        """PCM 写入共享内存后提交给推理进程，转发事件直到结束，返回 done 事件"""
+        job_id = job_id or next((k for k, v in self.jobs.items() if v is cancel_token), None) or uuid.uuid4().hex
+        deadline_s = None
+        if cancel_token and cancel_token.deadline is not None:
+            deadline_s = max(cancel_token.deadline - time.monotonic(), 1e-3)
+
+        shm = SharedMemory(create=True, size=max(pcm.nbytes, 1))
+        try:
+            np.ndarray(pcm.shape, dtype=np.float32, buffer=shm.buf)[:] = pcm
+            with self._connect() as sock, sock.makefile("rwb") as stream:
+                _send(stream, {**request, "job_id": job_id, "shm": shm.name, "total_samples": int(pcm.shape[0]),
+                               "deadline_s": deadline_s})
+                done = threading.Event()
+                if cancel_token:
+                    threading.Thread(target=self._watch_cancel, args=(sock, cancel_token, done), daemon=True).start()
+                try:
+                    return self._relay(stream, progress_callback, token_callback, quality_callback)
+                finally:
+                    done.set()
+        finally:
+            shm.close()
+            shm.unlink()
+
+    @staticmethod
+    def _watch_cancel(sock, cancel_token: CancellationToken, done: threading.Event):
+        """本地令牌被取消（客户端断开、主动取消、超时）时通知推理进程"""
+        while not done.wait(0.1):
+            if cancel_token.cancelled:
+                message = {"op": "cancel", "reason": cancel_token.reason}
+                try:
+                    sock.sendall((json.dumps(message) + "\n").encode("utf-8"))
+                except OSError:
+                    pass
+                return
+
+    @staticmethod
+    def _relay(stream, progress_callback, token_callback, quality_callback=None) -> str:
+        """转发推理进程返回的事件，返回 done 事件"""
+        while True:
+            line = stream.readline()
+            if not line:
+                raise RuntimeError("推理进程连接已断开")
+            message = json.loads(line)
+            event = message["event"]
+            if event == "progress":
+                if progress_callback:
+                    progress_callback(message["current"], message["total"], message["duration"], message["text"])
+            elif event == "token":
+                if token_callback:
+                    token_callback(message["index"], message["text"])
+            elif event == "quality":
+                if quality_callback:
+                    quality_callback(message["tier"])
+            elif event == "done":
+                return message
+            elif event == "cancelled":
+                raise TranscriptionCancelled(message["reason"])
+            else:
+                raise (RuntimeError if message.get("runtime") else Exception)(message["message"])
+
+
+def main():
+    from gpu_manager import GPUManager
+
+    path = os.environ.get('INFERENCE_SERVER_SOCKET', DEFAULT_SOCKET)
+    checkpoint = os.environ.get('MODEL_CHECKPOINT', 'zai-org/GLM-ASR-Nano-2512')
+    manager = GPUManager()
+    manager.load(checkpoint)
+    manager.resume_jobs()
+
+    server = InferenceServer(path, manager, checkpoint)
+    logger.info(f"推理进程已启动: {path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""长任务断点 - 持久化分段计划和逐段结果，进程重启后从第一个未完成的分段继续
+
+每个任务一个目录：
+    meta.json      参数与状态（running / done / cancelled）
+    audio.pcm      16kHz 单声道 16-bit 波形，重启后无需原始上传文件
+    plan.json      分段计划（smart_segment 分段或打包窗口，以及长上下文分组）
+    results.jsonl  每完成一组追加一行 {"index": i, "text": ...}
+
+默认关闭，设置 JOB_STORE_DIR 后启用（每个长任务会写入完整 PCM，并在每组完成后 fsync）。
+已结束的任务保留 JOB_TTL_S 秒，启动时和之后每小时清理一次。
+"""
+import json
+import os
+import shutil
+import threading
+import time
+import logging
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# 已结束任务的保留时间（秒），期间客户端仍可按 job_id 取回结果
+JOB_TTL_S = float(os.environ.get('JOB_TTL_S', 86400))
+# 两次清理之间的最短间隔（秒）
+EXPIRE_INTERVAL_S = 3600
+
+
+def _write_json(path: str, data: dict):
+    """先写临时文件再原子替换，避免进程中断留下半个文件"""
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _read_json(path: str):
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+class JobCheckpoint:
+    """单个任务的断点"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.job_id = os.path.basename(path)
+        self.meta = _read_json(os.path.join(path, 'meta.json')) or {}
+        self.plan = _read_json(os.path.join(path, 'plan.json'))
+        self.results = {}
+        results_path = os.path.join(path, 'results.jsonl')
+        if os.path.exists(results_path):
+            with open(results_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 写入中断的最后一行，该组重新转录
+                        break
+                    self.results[record["index"]] = record["text"]
+        self._lock = threading.Lock()
+        self._listeners = []
+        # 本进程写入结束（完成、取消或出错）后置位
+        self.closed = False
+
+    # ---------- 变更通知 ----------
+    def add_listener(self, fn):
+        """每记录一组结果或状态变化时调用 fn()（在写入线程中调用）"""
+        with self._lock:
+            self._listeners.append(fn)
+
+    def remove_listener(self, fn):
+        with self._lock:
+            if fn in self._listeners:
+                self._listeners.remove(fn)
+
+    def _notify(self):
+        with self._lock:
+            listeners = list(self._listeners)
+        for fn in listeners:
+            fn()
+
+    def mtime(self) -> tuple:
+        """meta.json 和 results.jsonl 的修改时间，用于判断其他进程是否有新写入"""
+        stamps = []
+        for name in ('meta.json', 'results.jsonl'):
+            try:
+                stamps.append(os.stat(os.path.join(self.path, name)).st_mtime_ns)
+            except OSError:
+                stamps.append(0)
+        return tuple(stamps)
+
+    @property
+    def audio_path(self) -> str:
+        return os.path.join(self.path, 'audio.pcm')
+
+    @property
+    def status(self) -> str:
+        return self.meta.get("status", "running")
+
+    def save_plan(self, plan: dict):
+        self.plan = plan
+        _write_json(os.path.join(self.path, 'plan.json'), plan)
+
+    def record(self, index: int, text: str):
+        """记录一组的转录结果（追加并落盘）"""
+        with self._lock:
+            self.results[index] = text
+            with open(os.path.join(self.path, 'results.jsonl'), 'a', encoding='utf-8') as f:
+                f.write(json.dumps({"index": index, "text": text}, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        self._notify()
+
+    def _set_status(self, status: str, **extra):
+        self.meta.update(status=status, finished=time.time(), **extra)
+        _write_json(os.path.join(self.path, 'meta.json'), self.meta)
+        # 结束后不再需要波形
+        if os.path.exists(self.audio_path):
+            os.remove(self.audio_path)
+        self._notify()
+
+    def finish(self, text: str):
+        self._set_status("done", text=text)
+
+    def cancel(self, reason: str):
+        self._set_status("cancelled", reason=reason)
+
+    def texts(self) -> list:
+        """已完成各组的文字，按组序排列"""
+        with self._lock:
+            return [self.results[i] for i in sorted(self.results)]
+
+    def progress(self) -> dict:
+        total = len(self.plan["groups"]) if self.plan else 0
+        texts = self.texts()
+        text = ''.join(texts)
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "completed": len(texts),
+            "total": total,
+            "duration": self.meta.get("duration"),
+            "text": self.meta.get("text", text),
+            **({"reason": self.meta["reason"]} if "reason" in self.meta else {}),
+        }
+
+
+class JobStore:
+    """本地任务断点目录"""
+
+    def __init__(self, root: str):
+        self.root = root
+        if root:
+            os.makedirs(root, exist_ok=True)
+        # 本进程正在写入的断点，查询和订阅直接使用内存中的对象
+        self.active = {}
+        self._expired_at = 0.0
+
+    @classmethod
+    def from_env(cls) -> "JobStore":
+        # 未设置 JOB_STORE_DIR 时关闭断点
+        return cls(os.environ.get('JOB_STORE_DIR', ''))
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.root)
+
+    def _dir(self, job_id: str) -> str:
+        return os.path.join(self.root, os.path.basename(job_id))
+
+    def get(self, job_id: str) -> JobCheckpoint:
+        if job_id in self.active:
+            return self.active[job_id]
+        if not self.enabled or not os.path.exists(os.path.join(self._dir(job_id), 'meta.json')):
+            return None
+        return JobCheckpoint(self._dir(job_id))
+
+    def open(self, job_id: str, wav: torch.Tensor, params: dict) -> JobCheckpoint:
+        """取得任务断点：已存在时继续使用（重启后恢复），否则保存波形和参数新建"""
+        if time.time() - self._expired_at > EXPIRE_INTERVAL_S:
+            self.expire()
+        existing = self.get(job_id)
+        if existing is not None and existing.status == "running":
+            logger.info(f"从断点恢复任务 {job_id}: 已完成 {len(existing.results)} 组")
+            self.active[job_id] = existing
+            return existing
+        path = self._dir(job_id)
+        os.makedirs(path, exist_ok=True)
+        pcm = (wav.reshape(-1).clamp(-1, 1) * 32767).to(torch.int16).numpy()
+        pcm.tofile(os.path.join(path, 'audio.pcm'))
+        _write_json(os.path.join(path, 'meta.json'), {
+            "job_id": job_id, "status": "running", "created": time.time(), **params,
+        })
+        checkpoint = self.active[job_id] = JobCheckpoint(path)
+        return checkpoint
+
+    def close(self, checkpoint: JobCheckpoint):
+        """本进程不再写入该断点；出错中断时状态仍为 running，重启后继续"""
+        self.active.pop(checkpoint.job_id, None)
+        checkpoint.closed = True
+        checkpoint._notify()
+
+    def pending(self) -> list:
+        """进程重启前未完成的任务"""
+        if not self.enabled:
+            return []
+        jobs = []
+        for job_id in os.listdir(self.root):
+            checkpoint = self.get(job_id)
+            if checkpoint and checkpoint.status == "running" and os.path.exists(checkpoint.audio_path):
+                jobs.append(checkpoint)
+        return sorted(jobs, key=lambda c: c.meta.get("created", 0))
+
+    def expire(self):
+        """删除超过保留时间的已结束任务"""
+        if not self.enabled:
+            return
+        now = self._expired_at = time.time()
+        for job_id in os.listdir(self.root):
+            checkpoint = self.get(job_id)
+            if checkpoint and checkpoint.status != "running" and now - checkpoint.meta.get("finished", now) > JOB_TTL_S:
+                shutil.rmtree(checkpoint.path, ignore_errors=True)
+
+
+job_store = JobStore.from_env()
@@ -1,41 +1,85 @@
 """FastAPI 主服务 - 异步支持 + SSE 进度推送"""
 import os
 import json
+import shutil
 import asyncio
 import tempfile
+import uuid
 import logging
 from pathlib import Path
+from typing import Literal
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 
-from gpu_manager import gpu_manager
+from admission import QueueFull, probe_duration
+from gpu_manager import CANCEL_REQUEST, CLIENT_DISCONNECT, gpu_manager, TranscriptionCancelled
+from inference_core import inference_core, sse
+from resumable_upload import upload_store, OffsetMismatch, PcmStreamDecoder
+from job_store import job_store
+from pcm_stream import PcmStreamSession, STREAM_WINDOW_BYTES
+from traffic import traffic_recorder, RECORDED_PATHS
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 UPLOAD_FOLDER = tempfile.gettempdir()
-ALLOWED_EXTENSIONS = {'wav', 'mp3', 'flac', 'm4a', 'ogg', 'webm'}
-
-# 全局进度
-progress_state = {"current": 0, "total": 0, "text": "", "done": False}
-
+ALLOWED_EXTENSIONS = {'wav', 'mp3', 'flac', 'm4a', 'ogg', 'webm', 'pcm'}
+# 默认请求截止时间（秒），0 表示不限制
+REQUEST_DEADLINE_S = float(os.environ.get('REQUEST_DEADLINE_S', 0))
 
 def allowed_file(filename: str) -> bool:
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def upload_path(filename: str) -> str:
+    """上传文件的临时路径；请求并发执行，同名文件不能互相覆盖"""
+    return os.path.join(UPLOAD_FOLDER, f"{uuid.uuid4().hex}_{filename}")
+
+
+def queue_full(e: QueueFull) -> HTTPException:
+    return HTTPException(429, str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+def _save_upload(file: UploadFile, filepath: str) -> float:
+    with open(filepath, 'wb') as f:
+        shutil.copyfileobj(file.file, f)
+    return probe_duration(filepath)
+
+
+async def save_and_admit(file: UploadFile, filepath: str):
+    """准入检查后保存上传文件，返回队列票据；超限时抛出 429
+
+    写盘和读取音频头在线程中执行，大文件上传不阻塞事件循环上的其他请求和 SSE 心跳。
+    """
+    try:
+        await asyncio.to_thread(gpu_manager.admission.check)
+    except QueueFull as e:
+        raise queue_full(e)
+    duration = await asyncio.to_thread(_save_upload, file, filepath)
+    traffic_recorder.annotate(filepath, duration)
+    try:
+        return await asyncio.to_thread(gpu_manager.admission.admit, duration)
+    except QueueFull as e:
+        os.remove(filepath)
+        raise queue_full(e)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # 启动时加载模型
     logger.info("启动时加载模型...")
     checkpoint = os.environ.get('MODEL_CHECKPOINT', 'zai-org/GLM-ASR-Nano-2512')
     gpu_manager.load(checkpoint)
+    if not gpu_manager.is_remote:
+        # 继续上次进程中断的长任务
+        gpu_manager.resume_jobs()
     yield
-    # 关闭时清理
-    gpu_manager.unload()
+    # 关闭时清理（独立推理进程模式下模型由推理进程管理，worker 退出不卸载）
+    if not gpu_manager.is_remote:
+        gpu_manager.unload()
 
 
 app = FastAPI(
@@ -66,6 +110,33 @@ app = FastAPI(
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
 
 
+@app.middleware("http")
+async def record_traffic(request: Request, call_next):
+    """录制转录请求的到达时间、参数和音频时长（设置 TRAFFIC_LOG_DIR 后启用）"""
+    if request.method != "POST" or request.url.path not in RECORDED_PATHS:
+        return await call_next(request)
+    entry = traffic_recorder.start(f"POST {request.url.path}")
+    if entry is None:
+        return await call_next(request)
+    try:
+        response = await call_next(request)
+    except Exception:
+        traffic_recorder.finish(entry, 500)
+        raise
+    body = response.body_iterator
+
+    async def record_after_body():
+        # SSE 等流式响应在最后一个字节发出后才算结束
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            traffic_recorder.finish(entry, response.status_code)
+
+    response.body_iterator = record_after_body()
+    return response
+
+
 # ==================== 静态文件 ====================
 @app.get("/", include_in_schema=False)
 async def index():
@@ -79,7 +150,17 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
     description="检查服务是否正常运行，以及模型是否已加载。",
     responses={200: {"description": "服务状态", "content": {"application/json": {"example": {"status": "ok", "model_loaded": True}}}}})
 async def health():
-    return {"status": "ok", "model_loaded": gpu_manager.model is not None}
+    model = await asyncio.to_thread(lambda: gpu_manager.model)
+    return {"status": "ok", "model_loaded": model is not None}
+
+
+@app.get("/queue/status", tags=["系统"], summary="队列状态",
+    description="当前排队深度、排队音频时长、实时率估计与预计等待时间，供负载均衡判断节点是否饱和。",
+    responses={200: {"description": "队列状态", "content": {"application/json": {"example": {
+        "depth": 3, "max_depth": 16, "queued_audio_seconds": 420.5, "max_queued_audio_seconds": 3600,
+        "rtf": 0.08, "estimated_wait_s": 33.6, "saturated": False, "admitted": 120, "rejected": 2}}}}})
+async def queue_status():
+    return await asyncio.to_thread(gpu_manager.admission.status)
 
 
 # ==================== GPU 管理 ====================
@@ -89,22 +170,22 @@ async def health():
         "model_loaded": True, "device": "cuda", "checkpoint": "zai-org/GLM-ASR-Nano-2512",
         "gpu_memory_used_mb": 4320.5, "gpu_memory_total_mb": 24576.0}}}}})
 async def gpu_status():
-    return gpu_manager.get_status()
+    return {**await asyncio.to_thread(gpu_manager.get_status), "inference": inference_core.status()}
 
 
 @app.post("/gpu/load", tags=["GPU管理"], summary="加载模型",
     description="将模型加载到 GPU 显存。启动时会自动加载，一般无需手动调用。",
     responses={200: {"description": "加载成功", "content": {"application/json": {"example": {"status": "loaded", "model_loaded": True}}}}})
 async def gpu_load():
-    gpu_manager.load('zai-org/GLM-ASR-Nano-2512')
-    return {"status": "loaded", **gpu_manager.get_status()}
+    await asyncio.to_thread(gpu_manager.load, 'zai-org/GLM-ASR-Nano-2512')
+    return {"status": "loaded", **await asyncio.to_thread(gpu_manager.get_status)}
 
 
 @app.post("/gpu/unload", tags=["GPU管理"], summary="卸载模型",
     description="从 GPU 显存中卸载模型，释放显存。需要再次使用时调用 `/gpu/load` 重新加载。",
     responses={200: {"description": "卸载成功", "content": {"application/json": {"example": {"status": "unloaded"}}}}})
 async def gpu_unload():
-    return gpu_manager.unload()
+    return await asyncio.to_thread(gpu_manager.unload)
 
 
 # ==================== 转录 API ====================
@@ -122,32 +203,39 @@ async def gpu_unload():
 **注意：** 长音频处理时间较长，可能导致请求超时，建议使用 `/api/transcribe/stream` 流式接口。
 """,
     responses={
-        200: {"description": "转录成功", "content": {"application/json": {"example": {"status": "success", "text": "这是转录出来的文字内容。"}}}},
+        200: {"description": "转录成功", "content": {"application/json": {"example": {"status": "success", "text": "这是转录出来的文字内容。", "quality": "full"}}}},
         400: {"description": "无效的文件格式", "content": {"application/json": {"example": {"detail": "无效的文件格式"}}}},
-        503: {"description": "模型未加载", "content": {"application/json": {"example": {"detail": "模型未加载，请先加载模型"}}}}
+        429: {"description": "队列已满，`Retry-After` 头给出建议等待秒数", "content": {"application/json": {"example": {"detail": "服务繁忙，队列已满"}}}},
+        503: {"description": "模型未加载", "content": {"application/json": {"example": {"detail": "模型未加载，请先加载模型"}}}},
+        504: {"description": "超过截止时间", "content": {"application/json": {"example": {"detail": "转录已取消: deadline"}}}}
     })
 async def transcribe(
-    file: UploadFile = File(..., description="音频文件（支持 wav/mp3/flac/m4a/ogg/webm）"),
-    max_new_tokens: int = Form(512, description="最大生成 token 数，影响输出长度，建议 256-1024", ge=1, le=2048)
+    file: UploadFile = File(..., description="音频文件（支持 wav/mp3/flac/m4a/ogg/webm；.pcm 为 16kHz 单声道 16-bit 原始 PCM，跳过解码）"),
+    max_new_tokens: int = Form(512, description="最大生成 token 数，影响输出长度，建议 256-1024", ge=1, le=2048),
+    timeout: float = Form(None, description="截止时间（秒），超时后停止处理，默认取 REQUEST_DEADLINE_S", gt=0),
+    packing: bool = Form(None, description="长音频只拼接语音区间送入模型，跳过停顿（默认取 SEGMENT_PACKING）"),
+    long_context: bool = Form(None, description="长音频把多个连续窗口合并到一个多音频提示词中生成（默认取 LONG_CONTEXT）"),
+    quality: Literal['auto', 'full', 'reduced', 'economy'] = Form(None, description="质量档位：auto 队列积压时自动降档，full 始终全质量（默认取 QUALITY_DEFAULT）")
 ):
     if not file.filename or not allowed_file(file.filename):
         raise HTTPException(400, "无效的文件格式")
+    traffic_recorder.annotate(params={"max_new_tokens": max_new_tokens, "timeout": timeout,
+                                      "packing": packing, "long_context": long_context, "quality": quality})
     
-    filepath = os.path.join(UPLOAD_FOLDER, file.filename)
-    content = await file.read()
-    with open(filepath, 'wb') as f:
-        f.write(content)
+    filepath = upload_path(file.filename)
+    ticket = await save_and_admit(file, filepath)
     
+    task = inference_core.submit(filepath, max_new_tokens, timeout or REQUEST_DEADLINE_S, packing, long_context,
+                                 ticket=ticket, cleanup_path=filepath, quality=quality)
     try:
-        result = gpu_manager.transcribe(filepath, max_new_tokens)
-        return {"status": "success", "text": result}
+        text = await task.aresult()
+        return {"status": "success", "text": text, "quality": task.quality}
+    except TranscriptionCancelled as e:
+        raise HTTPException(504, str(e))
     except RuntimeError as e:
         raise HTTPException(503, str(e))
     except Exception as e:
         raise HTTPException(500, f"转录失败: {str(e)}")
-    finally:
-        if os.path.exists(filepath):
-            os.remove(filepath)
 
 
 @app.post("/api/transcribe/stream", tags=["语音转录"], summary="SSE 流式转录（推荐长音频）",
@@ -160,11 +248,14 @@ async def transcribe(
 
 | type | 说明 | 数据示例 |
 |------|------|----------|
-| `start` | 开始处理 | `{}` |
+| `start` | 开始处理，返回任务 ID | `{"job_id": "3f2a..."}` |
+| `quality` | 实际使用的质量档位 | `{"tier": "reduced"}` |
 | `progress` | 处理进度 | `{"current": 3, "total": 10, "duration": 22.5}` |
+| `token` | 生成中的文本片段（逐 token 输出） | `{"index": 3, "text": "这是"}` |
 | `partial` | 分段结果 | `{"text": "这是第三段的文字..."}` |
 | `heartbeat` | 心跳保活 | `{}` |
-| `done` | 处理完成 | `{"text": "完整的转录结果..."}` |
+| `done` | 处理完成 | `{"text": "完整的转录结果...", "quality": "full"}` |
+| `cancelled` | 已取消（主动取消或超过截止时间） | `{"reason": "deadline"}` |
 | `error` | 处理出错 | `{"message": "错误信息"}` |
 
 **调用示例（curl）：**
@@ -174,6 +265,9 @@ curl -X POST http://localhost:7860/api/transcribe/stream \\
   -F "max_new_tokens=512"
 ```
 
+**取消：** 客户端断开连接后服务端会在当前 token 处停止生成；也可调用
+`POST /api/transcribe/{job_id}/cancel` 主动取消，或通过 `timeout` 参数设置截止时间。
+
 **调用示例（JavaScript）：**
 ```javascript
 const formData = new FormData();
@@ -199,70 +293,307 @@ while (true) {
 """,
     responses={
         200: {"description": "SSE 流式响应", "content": {"text/event-stream": {"example": 'data: {"type": "progress", "current": 1, "total": 5, "duration": 20.5}\n\ndata: {"type": "partial", "text": "转录文字..."}\n\ndata: {"type": "done", "text": "完整结果"}'}}},
-        400: {"description": "无效的文件格式"}
+        400: {"description": "无效的文件格式"},
+        429: {"description": "队列已满，`Retry-After` 头给出建议等待秒数"}
     })
 async def transcribe_stream(
-    file: UploadFile = File(..., description="音频文件（支持 wav/mp3/flac/m4a/ogg/webm）"),
-    max_new_tokens: int = Form(512, description="最大生成 token 数", ge=1, le=2048)
+    request: Request,
+    file: UploadFile = File(..., description="音频文件（支持 wav/mp3/flac/m4a/ogg/webm；.pcm 为 16kHz 单声道 16-bit 原始 PCM，跳过解码）"),
+    max_new_tokens: int = Form(512, description="最大生成 token 数", ge=1, le=2048),
+    timeout: float = Form(None, description="截止时间（秒），超时后停止处理，默认取 REQUEST_DEADLINE_S", gt=0),
+    packing: bool = Form(None, description="长音频只拼接语音区间送入模型，跳过停顿（默认取 SEGMENT_PACKING）"),
+    long_context: bool = Form(None, description="长音频把多个连续窗口合并到一个多音频提示词中生成（默认取 LONG_CONTEXT）"),
+    quality: Literal['auto', 'full', 'reduced', 'economy'] = Form(None, description="质量档位：auto 队列积压时自动降档，full 始终全质量（默认取 QUALITY_DEFAULT）")
 ):
     if not file.filename or not allowed_file(file.filename):
         raise HTTPException(400, "无效的文件格式")
+    traffic_recorder.annotate(params={"max_new_tokens": max_new_tokens, "timeout": timeout,
+                                      "packing": packing, "long_context": long_context, "quality": quality})
     
-    filepath = os.path.join(UPLOAD_FOLDER, file.filename)
-    content = await file.read()
-    with open(filepath, 'wb') as f:
-        f.write(content)
+    filepath = upload_path(file.filename)
+    ticket = await save_and_admit(file, filepath)
+    
+    task = inference_core.submit(filepath, max_new_tokens, timeout or REQUEST_DEADLINE_S, packing, long_context,
+                                 ticket=ticket, cleanup_path=filepath, quality=quality)
     
     async def generate():
-        loop = asyncio.get_event_loop()
-        progress_queue = asyncio.Queue()
-        
-        def on_progress(current, total, duration, text):
-            asyncio.run_coroutine_threadsafe(
-                progress_queue.put({"current": current, "total": total, "duration": duration, "text": text}),
-                loop
-            )
-        
-        async def do_transcribe():
-            try:
-                result = await loop.run_in_executor(
-                    None, lambda: gpu_manager.transcribe(filepath, max_new_tokens, on_progress)
-                )
-                await progress_queue.put({"done": True, "result": result})
-            except Exception as e:
-                await progress_queue.put({"error": str(e)})
-            finally:
-                if os.path.exists(filepath):
-                    os.remove(filepath)
-        
-        task = asyncio.create_task(do_transcribe())
-        yield f"data: {json.dumps({'type': 'start'})}\n\n"
-        
-        while True:
-            try:
-                msg = await asyncio.wait_for(progress_queue.get(), timeout=0.5)
-                if "error" in msg:
-                    yield f"data: {json.dumps({'type': 'error', 'message': msg['error']})}\n\n"
+        try:
+            async for event in task.aevents(heartbeat=0.5):
+                if event["type"] == "heartbeat" and await request.is_disconnected():
+                    break
+                yield sse(event)
+        finally:
+            # 客户端断开时生成器被关闭，通知执行线程停止
+            task.cancel(CLIENT_DISCONNECT)
+    
+    return StreamingResponse(generate(), media_type="text/event-stream")
+
+
+@app.post("/api/transcribe/{job_id}/cancel", tags=["语音转录"], summary="取消转录任务",
+    description="取消正在排队或处理中的流式转录任务（`job_id` 来自 SSE `start` 事件）。已生成的 token 会在下一步停止。",
+    responses={
+        200: {"description": "已发送取消", "content": {"application/json": {"example": {"status": "cancelling", "job_id": "3f2a..."}}}},
+        404: {"description": "任务不存在或已结束"}
+    })
+async def cancel_transcribe(job_id: str):
+    # 不是本进程提交的任务时会转给推理进程，socket 调用放到线程里
+    if not await asyncio.to_thread(inference_core.cancel, job_id):
+        raise HTTPException(404, "任务不存在或已结束")
+    return {"status": "cancelling", "job_id": job_id}
+
+
+# ==================== 任务断点 ====================
+def get_checkpoint(job_id: str):
+    checkpoint = job_store.get(job_id)
+    if checkpoint is None:
+        raise HTTPException(404, "任务不存在或未保存断点")
+    return checkpoint
+
+
+@app.get("/api/jobs/{job_id}", tags=["语音转录"], summary="查询长任务进度",
+    description="""
+设置 `JOB_STORE_DIR` 后，长音频（> 25 秒）任务的分段计划和每段结果会持久化到该目录。服务重启后未完成的任务
+从第一个未完成的分段继续，客户端可用 SSE `start` 事件中的 `job_id` 重新取回进度和结果。
+""",
+    responses={
+        200: {"description": "任务状态", "content": {"application/json": {"example": {"job_id": "3f2a...", "status": "running", "completed": 12, "total": 40, "duration": 985.3, "text": "已完成分段的文字..."}}}},
+        404: {"description": "任务不存在或未保存断点"}
+    })
+async def job_status(job_id: str):
+    return get_checkpoint(job_id).progress()
+
+
+@app.get("/api/jobs/{job_id}/events", tags=["语音转录"], summary="重新订阅长任务进度（SSE）",
+    description="按 `job_id` 重新连接任务：先返回已完成分段的 `partial` 事件，之后每完成一段推送一次，结束时发送 `done` 或 `cancelled`。")
+async def job_events(job_id: str, request: Request):
+    checkpoint = get_checkpoint(job_id)
+
+    async def generate():
+        nonlocal checkpoint
+        # 本进程中运行的任务由写入线程通知；其他进程（推理进程、其他 worker）写入的任务按文件修改时间检查
+        loop = asyncio.get_running_loop()
+        ready = asyncio.Event()
+        notify = lambda: loop.call_soon_threadsafe(ready.set)
+        checkpoint.add_listener(notify)
+        stamp = checkpoint.mtime()
+        sent = 0
+        try:
+            while True:
+                ready.clear()
+                progress = checkpoint.progress()
+                results = checkpoint.texts()
+                for text in results[sent:]:
+                    if text:
+                        yield f"data: {json.dumps({'type': 'partial', 'text': text}, ensure_ascii=False)}\n\n"
+                if len(results) > sent:
+                    sent = len(results)
+                    yield f"data: {json.dumps({'type': 'progress', 'current': sent, 'total': progress['total']})}\n\n"
+                if progress["status"] == "done":
+                    yield f"data: {json.dumps({'type': 'done', 'text': progress['text']}, ensure_ascii=False)}\n\n"
+                    break
+                if progress["status"] == "cancelled":
+                    yield f"data: {json.dumps({'type': 'cancelled', 'reason': progress.get('reason')})}\n\n"
                     break
-                elif "done" in msg:
-                    yield f"data: {json.dumps({'type': 'done', 'text': msg['result']})}\n\n"
+                if checkpoint.closed:
+                    # 本进程中转录出错，断点保留为 running，重启后继续
+                    yield f"data: {json.dumps({'type': 'error', 'message': '任务中断，服务重启后继续'}, ensure_ascii=False)}\n\n"
                     break
-                else:
-                    yield f"data: {json.dumps({'type': 'progress', 'current': msg['current'], 'total': msg['total'], 'duration': round(msg['duration'], 1)})}\n\n"
-                    if msg['text']:
-                        yield f"data: {json.dumps({'type': 'partial', 'text': msg['text']})}\n\n"
-            except asyncio.TimeoutError:
-                if task.done():
+                while not ready.is_set():
+                    if await request.is_disconnected():
+                        return
+                    try:
+                        await asyncio.wait_for(ready.wait(), 1.0)
+                    except asyncio.TimeoutError:
+                        yield f"data: {json.dumps({'type': 'heartbeat'})}\n\n"
+                        if job_id not in job_store.active and checkpoint.mtime() != stamp:
+                            fresh = job_store.get(job_id)
+                            if fresh is None:
+                                return
+                            checkpoint.remove_listener(notify)
+                            checkpoint = fresh
+                            checkpoint.add_listener(notify)
+                            stamp = checkpoint.mtime()
+                            break
+        finally:
+            checkpoint.remove_listener(notify)
+
+    return StreamingResponse(generate(), media_type="text/event-stream")
+
+
+# ==================== 断点续传上传 ====================
+def get_upload(upload_id: str):
+    session = upload_store.get(upload_id)
+    if session is None:
+        raise HTTPException(404, "上传不存在或已过期")
+    return session
+
+
+@app.post("/api/uploads", tags=["断点续传"], summary="创建断点续传上传", status_code=201,
+    description="""
+创建一个分块上传会话。之后用 `PATCH /api/uploads/{upload_id}` 按偏移追加数据，
+断线后用 `HEAD` 查询已接收的偏移并从该位置续传。
+
+`.pcm`（16kHz 单声道 16-bit）和 16kHz 16-bit WAV 边上传边转录：已到达的音频立即做 VAD 分段，
+完整的分段马上送入模型；其他格式在上传完成后开始转录。进度和结果通过
+`GET /api/uploads/{upload_id}/events` 推送。
+""",
+    responses={
+        201: {"description": "已创建", "content": {"application/json": {"example": {"upload_id": "9c1e...", "job_id": "3f2a...", "offset": 0, "length": 1048576}}}},
+        400: {"description": "无效的文件格式"},
+        429: {"description": "队列已满，`Retry-After` 头给出建议等待秒数"}
+    })
+async def create_upload(
+    filename: str = Form(..., description="原始文件名（用于判断格式）"),
+    length: int = Form(..., description="文件总字节数", gt=0),
+    max_new_tokens: int = Form(512, description="每个分段的最大生成 token 数", ge=1, le=2048),
+    timeout: float = Form(None, description="截止时间（秒），默认取 REQUEST_DEADLINE_S", gt=0)
+):
+    if not allowed_file(filename):
+        raise HTTPException(400, "无效的文件格式")
+    traffic_recorder.annotate(duration=PcmStreamDecoder.estimate_seconds(filename, length) or None,
+                              params={"max_new_tokens": max_new_tokens, "timeout": timeout,
+                                      "format": filename.rsplit('.', 1)[-1].lower()})
+    try:
+        session = await asyncio.to_thread(upload_store.create, filename, length, max_new_tokens,
+                                          timeout or REQUEST_DEADLINE_S)
+    except QueueFull as e:
+        raise queue_full(e)
+    return JSONResponse(session.status(), status_code=201,
+                        headers={"Location": f"/api/uploads/{session.upload_id}"})
+
+
+@app.head("/api/uploads/{upload_id}", tags=["断点续传"], summary="查询已接收偏移")
+async def upload_offset(upload_id: str):
+    session = get_upload(upload_id)
+    return Response(headers={"Upload-Offset": str(session.offset), "Upload-Length": str(session.length)})
+
+
+@app.patch("/api/uploads/{upload_id}", tags=["断点续传"], summary="追加分块",
+    description="请求头 `Upload-Offset` 必须等于服务端已接收的字节数，请求体为本块原始字节。",
+    responses={
+        204: {"description": "已接收，响应头 `Upload-Offset` 为新的偏移"},
+        409: {"description": "偏移不一致，响应头 `Upload-Offset` 为服务端当前偏移"}
+    })
+async def upload_chunk(upload_id: str, request: Request):
+    session = get_upload(upload_id)
+    try:
+        offset = int(request.headers["Upload-Offset"])
+    except (KeyError, ValueError):
+        raise HTTPException(400, "缺少 Upload-Offset 请求头")
+    data = await request.body()
+    try:
+        offset = await asyncio.to_thread(session.append, offset, data)
+    except OffsetMismatch as e:
+        raise HTTPException(409, str(e), headers={"Upload-Offset": str(e.offset)})
+    return Response(status_code=204, headers={"Upload-Offset": str(offset)})
+
+
+@app.get("/api/uploads/{upload_id}/events", tags=["断点续传"], summary="上传与转录进度（SSE）",
+    description="""
+SSE 事件与 `/api/transcribe/stream` 一致，`progress` 同时包含上传和转录进度：
+
+`{"type": "progress", "uploaded": 524288, "upload_total": 1048576, "received_seconds": 16.4, "segments_done": 1, "transcribed_seconds": 12.0}`
+
+断开后可重新连接，事件从头重放；断开不会取消任务，取消请用 `DELETE`。
+""")
+async def upload_events(upload_id: str, request: Request):
+    session = get_upload(upload_id)
+
+    async def generate():
+        cursor = 0
+        yield f"data: {json.dumps({'type': 'start', 'job_id': session.job_id, 'upload_id': upload_id})}\n\n"
+        while True:
+            events = await asyncio.to_thread(session.wait_events, cursor, 1.0)
+            if not events:
+                if await request.is_disconnected():
                     break
                 yield f"data: {json.dumps({'type': 'heartbeat'})}\n\n"
-        
-        await task
-    
+                continue
+            cursor += len(events)
+            for event in events:
+                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+            if events[-1]["type"] in ("done", "cancelled", "error"):
+                break
+
     return StreamingResponse(generate(), media_type="text/event-stream")
 
 
+@app.delete("/api/uploads/{upload_id}", tags=["断点续传"], summary="取消上传与转录")
+async def delete_upload(upload_id: str):
+    get_upload(upload_id)
+    upload_store.remove(upload_id)
+    return {"status": "cancelling", "upload_id": upload_id}
+
+
+# ==================== 原始 PCM 双向流 ====================
+@app.websocket("/api/stream")
+async def pcm_stream(websocket: WebSocket, max_new_tokens: int = 512, timeout: float = None):
+    """二进制帧发送 16kHz 16-bit PCM，服务端推送 ack / token / partial / final，协议见 pcm_stream.py"""
+    await websocket.accept()
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    emit = lambda event: loop.call_soon_threadsafe(events.put_nowait, event)
+    entry = traffic_recorder.start("WS /api/stream")
+    traffic_recorder.annotate(params={"max_new_tokens": max_new_tokens, "timeout": timeout})
+    try:
+        session = await asyncio.to_thread(PcmStreamSession, emit, max_new_tokens, timeout or REQUEST_DEADLINE_S)
+    except QueueFull as e:
+        traffic_recorder.finish(entry, 429)
+        await websocket.send_json({"type": "error", "message": str(e), "retry_after": e.retry_after})
+        await websocket.close(code=1013)
+        return
+    await websocket.send_json({"type": "ready", "job_id": session.job_id, "window": STREAM_WINDOW_BYTES})
+    outcome = {"status": 499}
+
+    async def send_events():
+        while True:
+            event = await events.get()
+            await websocket.send_text(json.dumps(event, ensure_ascii=False))
+            if event["type"] in ("final", "cancelled", "error"):
+                outcome["status"] = {"final": 200, "cancelled": 499, "error": 500}[event["type"]]
+                break
+
+    async def receive_audio():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("bytes") is not None:
+                await asyncio.to_thread(session.feed, message["bytes"])
+                continue
+            command = json.loads(message.get("text") or "{}").get("type")
+            if command == "end":
+                await asyncio.to_thread(session.finish)
+                return
+            if command == "cancel":
+                session.cancel(CANCEL_REQUEST)
+                return
+
+    sender = asyncio.create_task(send_events())
+    receiver = asyncio.create_task(receive_audio())
+    try:
+        # 发送方结束（final / cancelled / error）即会话结束；接收方断开时抛出异常并取消转录
+        done, _ = await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            task.result()
+        await sender
+        receiver.cancel()
+        await websocket.close()
+    except Exception:
+        session.cancel(CLIENT_DISCONNECT)
+    finally:
+        for task in (sender, receiver):
+            task.cancel()
+        traffic_recorder.annotate(duration=session.segmenter.total_samples / 16000)
+        traffic_recorder.finish(entry, outcome["status"])
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get('PORT', 7860))
     logger.info(f"服务启动: http://0.0.0.0:{port}")
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    if gpu_manager.is_remote:
+        # 模型在独立推理进程中，HTTP 层可按 CPU 核数扩展 worker
+        workers = int(os.environ.get('WEB_WORKERS', os.cpu_count() or 1))
+        uvicorn.run("main:app", host="0.0.0.0", port=port, workers=workers)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=port)
@@ -1,83 +1,266 @@
 """MCP 服务器 - GLM-ASR 工具"""
 import os
+import time
+import asyncio
 from fastmcp import FastMCP
-from gpu_manager import gpu_manager
+from admission import QueueFull, probe_duration
+from gpu_manager import gpu_manager, TranscriptionCancelled
+from inference_core import inference_core
 
 mcp = FastMCP("glm-asr")
 
+# 通过 submit_transcription 提交的任务；已结束的任务只保留最近 MCP_JOB_HISTORY 个
+jobs = {}
+JOB_HISTORY = int(os.environ.get('MCP_JOB_HISTORY', 100))
+
+
+def _prune_jobs():
+    """淘汰最早结束的任务，运行中的任务不受影响"""
+    finished = sorted((job for job in jobs.values() if "finished" in job), key=lambda job: job["finished"])
+    for job in finished[:max(0, len(finished) - JOB_HISTORY)]:
+        jobs.pop(job["job_id"], None)
+
+
+def _busy(e: QueueFull) -> dict:
+    """队列已满，对应 HTTP 的 429 + Retry-After"""
+    return {"status": "error", "error": str(e), "code": 429, "retry_after": e.retry_after}
+
+
+async def _admit(audio_paths: list):
+    """按音频总时长申请准入票据，与 HTTP 接口共用 MAX_QUEUE_DEPTH / MAX_QUEUED_AUDIO_S 限制"""
+    durations = await asyncio.to_thread(lambda: [probe_duration(p) for p in audio_paths])
+    return await asyncio.to_thread(gpu_manager.admission.admit, sum(durations)), sum(durations)
+
 
 @mcp.tool()
-def transcribe(audio_path: str, max_new_tokens: int = 128) -> dict:
+async def transcribe(audio_path: str, max_new_tokens: int = 128, quality: str = None) -> dict:
     """
     转录音频文件为文本
-    
+
     Args:
         audio_path: 音频文件路径（支持 wav/mp3/flac/m4a/ogg）
         max_new_tokens: 最大生成 token 数，默认 128
-    
+        quality: 质量档位 auto / full / reduced / economy，默认取服务端 QUALITY_DEFAULT；auto 时队列积压会自动降档
+
     Returns:
-        转录结果，包含 text 字段
+        转录结果，包含 text 字段，以及 duration（音频秒数）、elapsed（耗时秒数）、rtf（实时率）、quality（实际使用的档位）；
+        队列已满时返回 error、code 429 和 retry_after（建议重试等待秒数）
     """
     if not os.path.exists(audio_path):
         return {"status": "error", "error": f"文件不存在: {audio_path}"}
-    
+
     try:
-        result = gpu_manager.transcribe(audio_path, max_new_tokens)
-        return {"status": "success", "text": result}
+        ticket, duration = await _admit([audio_path])
+    except QueueFull as e:
+        return _busy(e)
+    try:
+        started = time.perf_counter()
+        # 在共享推理线程池中执行，不阻塞 MCP 事件循环
+        task = inference_core.submit(audio_path, max_new_tokens, ticket=ticket, quality=quality)
+        result = await task.aresult()
+        elapsed = time.perf_counter() - started
+        return {"status": "success", "text": result, "duration": round(duration, 2), "elapsed": round(elapsed, 3),
+                "rtf": round(elapsed / duration, 4) if duration else None, "quality": task.quality}
     except Exception as e:
         return {"status": "error", "error": str(e)}
 
 
+def _existing(audio_paths: list) -> list:
+    return [p for p in audio_paths if os.path.exists(p)]
+
+
+async def _transcribe_files(audio_paths: list, task) -> dict:
+    """等待批量转录任务，缺失的文件单独报错（只有存在的文件提交组批）"""
+    missing = {p for p in audio_paths if not os.path.exists(p)}
+    started = time.perf_counter()
+    try:
+        done = await task.aresult() if task else []
+    except TranscriptionCancelled as e:
+        return {"status": "cancelled", "reason": e.reason}
+    except Exception as e:
+        return {"status": "error", "error": str(e)}
+    elapsed = time.perf_counter() - started
+
+    done = iter(done)
+    results = [{"path": p, "status": "error", "error": f"文件不存在: {p}"} if p in missing else next(done)
+               for p in audio_paths]
+    total_audio = sum(r.get("duration", 0) for r in results)
+    return {
+        "status": "success",
+        "results": results,
+        "total_duration": round(total_audio, 2),
+        "elapsed": round(elapsed, 3),
+        "rtf": round(elapsed / total_audio, 4) if total_audio else None,
+    }
+
+
 @mcp.tool()
-def get_gpu_status() -> dict:
+async def transcribe_batch(audio_paths: list[str], max_new_tokens: int = 128, quality: str = None) -> dict:
+    """
+    批量转录多个音频文件，所有文件的分段一起组批送入 GPU，比逐个调用 transcribe 更快
+
+    Args:
+        audio_paths: 音频文件路径列表
+        max_new_tokens: 每段最大生成 token 数，默认 128
+        quality: 质量档位 auto / full / reduced / economy，默认取服务端 QUALITY_DEFAULT；auto 时队列积压会自动降档
+
+    Returns:
+        results 为与输入一一对应的结果（text、duration、elapsed、rtf、quality，失败时为 error），
+        以及整批的总音频时长 total_duration、总耗时 elapsed 和实时率 rtf；队列已满时同 transcribe
+    """
+    existing = _existing(audio_paths)
+    task = None
+    if existing:
+        try:
+            ticket, _ = await _admit(existing)
+        except QueueFull as e:
+            return _busy(e)
+        task = inference_core.submit_batch(existing, max_new_tokens, quality=quality, ticket=ticket)
+    return await _transcribe_files(audio_paths, task)
+
+
+async def _run_job(job_id: str, task):
+    job = jobs[job_id]
+    job["status"] = "running"
+    job["started"] = time.time()
+    try:
+        job["result"] = await _transcribe_files(job["audio_paths"], task)
+        job["status"] = job["result"]["status"]
+    finally:
+        job["finished"] = time.time()
+
+
+@mcp.tool()
+async def submit_transcription(audio_paths: list[str], max_new_tokens: int = 128, quality: str = None) -> dict:
+    """
+    提交后台转录任务并立即返回 job_id，之后用 get_job_status / get_job_result 查询
+
+    Args:
+        audio_paths: 音频文件路径列表（单个文件也用列表）
+        max_new_tokens: 每段最大生成 token 数，默认 128
+        quality: 质量档位 auto / full / reduced / economy，默认取服务端 QUALITY_DEFAULT；auto 时队列积压会自动降档
+
+    Returns:
+        job_id 和任务状态；队列已满时同 transcribe
+    """
+    existing = _existing(audio_paths)
+    try:
+        ticket, _ = await _admit(existing)
+    except QueueFull as e:
+        return _busy(e)
+    task = inference_core.submit_batch(existing, max_new_tokens, quality=quality, ticket=ticket)
+    job_id = task.job_id
+    _prune_jobs()
+    jobs[job_id] = {
+        "job_id": job_id, "status": "queued", "audio_paths": list(audio_paths),
+        "max_new_tokens": max_new_tokens, "submitted": time.time(),
+    }
+    jobs[job_id]["task"] = asyncio.create_task(_run_job(job_id, task))
+    return {"job_id": job_id, "status": "queued", "files": len(audio_paths)}
+
+
+@mcp.tool()
+async def get_job_status(job_id: str) -> dict:
+    """
+    查询后台转录任务状态
+
+    Args:
+        job_id: submit_transcription 返回的任务 ID
+
+    Returns:
+        status（queued / running / success / error / cancelled）及提交、开始、结束时间
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return {"status": "error", "error": f"任务不存在: {job_id}"}
+    return {k: v for k, v in job.items() if k not in ("task", "result")}
+
+
+@mcp.tool()
+async def get_job_result(job_id: str) -> dict:
+    """
+    获取后台转录任务结果（任务未完成时返回当前状态）
+
+    Args:
+        job_id: submit_transcription 返回的任务 ID
+
+    Returns:
+        与 transcribe_batch 相同的结果
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return {"status": "error", "error": f"任务不存在: {job_id}"}
+    if "result" not in job:
+        return {"job_id": job_id, "status": job["status"]}
+    return {"job_id": job_id, **job["result"]}
+
+
+@mcp.tool()
+async def cancel_job(job_id: str) -> dict:
+    """
+    取消后台转录任务
+
+    Args:
+        job_id: submit_transcription 返回的任务 ID
+
+    Returns:
+        取消状态
+    """
+    if not inference_core.cancel(job_id):
+        return {"status": "error", "error": f"任务不存在或已结束: {job_id}"}
+    return {"status": "cancelling", "job_id": job_id}
+
+
+@mcp.tool()
+async def get_gpu_status() -> dict:
     """
     获取 GPU 和模型状态
-    
+
     Returns:
         GPU 状态信息，包含显存使用、模型加载状态等
     """
-    return gpu_manager.get_status()
+    return await asyncio.to_thread(gpu_manager.get_status)
 
 
 @mcp.tool()
-def load_model(checkpoint: str = "zai-org/GLM-ASR-Nano-2512") -> dict:
+async def load_model(checkpoint: str = "zai-org/GLM-ASR-Nano-2512") -> dict:
     """
     加载模型到 GPU
-    
+
     Args:
         checkpoint: 模型路径或 HuggingFace 模型 ID
-    
+
     Returns:
         加载状态
     """
     try:
-        gpu_manager.load(checkpoint)
-        return {"status": "loaded", **gpu_manager.get_status()}
+        await asyncio.to_thread(gpu_manager.load, checkpoint)
+        return {"status": "loaded", **await asyncio.to_thread(gpu_manager.get_status)}
     except Exception as e:
         return {"status": "error", "error": str(e)}
 
 
 @mcp.tool()
-def unload_model() -> dict:
+async def unload_model() -> dict:
     """
-    卸载模型，释放 GPU 显存
-    
+    卸载模型，释放 GPU 显存（等待正在进行的转录结束）
+
     Returns:
         卸载状态
     """
-    return gpu_manager.unload()
+    return await asyncio.to_thread(gpu_manager.unload)
 
 
 @mcp.tool()
-def reload_model() -> dict:
+async def reload_model() -> dict:
     """
     重新加载模型
-    
+
     Returns:
         重载状态
     """
-    gpu_manager.reload()
-    return {"status": "reloaded", **gpu_manager.get_status()}
+    await asyncio.to_thread(gpu_manager.reload)
+    return {"status": "reloaded", **await asyncio.to_thread(gpu_manager.get_status)}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,136 @@
+"""Torch 原生 log-mel 特征提取 - 与 WhisperFeatureExtractor 数值对齐，批量在模型设备上计算"""
+import logging
+import math
+
+import numpy as np
+import torch
+from transformers.audio_utils import mel_filter_bank
+
+logger = logging.getLogger(__name__)
+
+
+class LogMelFrontend:
+    """Whisper 风格 log-mel 前端
+
+    一次调用处理整批音频块：补零到 n_samples、STFT、mel 投影、log 压缩全部在
+    目标设备上完成，替代逐块的 NumPy 提取与 CPU STFT。
+    """
+
+    def __init__(self, feature_size: int = 128, sampling_rate: int = 16000,
+                 hop_length: int = 160, n_fft: int = 400, n_samples: int = 480000, **_):
+        self.feature_size = feature_size
+        self.sampling_rate = sampling_rate
+        self.hop_length = hop_length
+        self.n_fft = n_fft
+        self.n_samples = n_samples
+        self.nb_max_frames = n_samples // hop_length
+        self._mel_filters = mel_filter_bank(
+            num_frequency_bins=1 + n_fft // 2,
+            num_mel_filters=feature_size,
+            min_frequency=0.0,
+            max_frequency=8000.0,
+            sampling_rate=sampling_rate,
+            norm="slaney",
+            mel_scale="slaney",
+        )
+        # 按设备缓存窗函数和滤波器组，避免每次调用重复拷贝
+        self._device_cache = {}
+
+    @classmethod
+    def from_feature_extractor(cls, feature_extractor) -> "LogMelFrontend":
+        """从已加载的 WhisperFeatureExtractor 复制参数"""
+        return cls(
+            feature_size=feature_extractor.feature_size,
+            sampling_rate=feature_extractor.sampling_rate,
+            hop_length=feature_extractor.hop_length,
+            n_fft=feature_extractor.n_fft,
+            n_samples=feature_extractor.n_samples,
+        )
+
+    def _buffers(self, device):
+        key = str(device)
+        if key not in self._device_cache:
+            window = torch.hann_window(self.n_fft, device=device)
+            filters = torch.from_numpy(self._mel_filters).to(device, torch.float32).T.contiguous()
+            self._device_cache[key] = (window, filters)
+        return self._device_cache[key]
+
+    def num_frames(self, num_samples: int) -> int:
+        """有效帧数（与特征提取器的 attention_mask 一致）"""
+        return min(math.ceil(num_samples / self.hop_length), self.nb_max_frames)
+
+    def __call__(self, chunks: list, device=None) -> tuple:
+        """批量计算 log-mel 特征
+
+        Args:
+            chunks: 1-D 波形张量列表（16kHz，每块不超过 n_samples）
+            device: 计算设备，默认 CPU
+
+        Returns:
+            (features, mask): (B, feature_size, nb_max_frames) float32 特征和 (B, nb_max_frames) 帧掩码
+        """
+        device = torch.device(device or "cpu")
+        batch = torch.zeros(len(chunks), self.n_samples, dtype=torch.float32)
+        lengths = []
+        for i, chunk in enumerate(chunks):
+            chunk = chunk.reshape(-1)[: self.n_samples]
+            batch[i, : chunk.shape[0]] = chunk
+            lengths.append(chunk.shape[0])
+        # 整批一次性拷贝到设备
+        batch = batch.to(device, non_blocking=True)
+
+        window, filters = self._buffers(device)
+        stft = torch.stft(batch, self.n_fft, self.hop_length, window=window, return_complex=True)
+        magnitudes = stft[..., :-1].abs() ** 2
+        mel_spec = filters @ magnitudes
+        log_spec = torch.clamp(mel_spec, min=1e-10).log10()
+        max_val = log_spec.amax(dim=(1, 2), keepdim=True)
+        log_spec = torch.maximum(log_spec, max_val - 8.0)
+        features = (log_spec + 4.0) / 4.0
+
+        frames = torch.tensor([self.num_frames(n) for n in lengths], device=device)
+        mask = (torch.arange(self.nb_max_frames, device=device)[None, :] < frames[:, None]).long()
+        return features, mask
+
+
+def check_against_reference(feature_cfg: dict = None, num_chunks: int = 4, atol: float = 1e-3,
+                            device=None) -> float:
+    """与 WhisperFeatureExtractor 的 NumPy 实现对比，返回最大绝对误差，超出容差时抛出 AssertionError"""
+    from transformers import WhisperFeatureExtractor
+    from inference import WHISPER_FEAT_CFG
+
+    cfg = feature_cfg or WHISPER_FEAT_CFG
+    reference = WhisperFeatureExtractor(**cfg)
+    frontend = LogMelFrontend(**cfg)
+
+    generator = torch.Generator().manual_seed(0)
+    sr = cfg["sampling_rate"]
+    chunks = []
+    for i in range(num_chunks):
+        # 不同长度：覆盖补零与满长两种情况
+        n = cfg["n_samples"] if i == 0 else int(sr * (1.5 + 7.0 * i))
+        t = torch.arange(n) / sr
+        tone = 0.3 * torch.sin(2 * math.pi * (220.0 * (i + 1)) * t)
+        chunks.append(tone + 0.05 * torch.randn(n, generator=generator))
+
+    features, mask = frontend(chunks, device=device)
+    max_err = 0.0
+    for i, chunk in enumerate(chunks):
+        padded = np.zeros((1, cfg["n_samples"]), dtype=np.float32)
+        padded[0, : chunk.shape[0]] = chunk.numpy()
+        expected = reference._np_extract_fbank_features(padded, "cpu")[0]
+        err = float(np.abs(features[i].cpu().numpy() - expected).max())
+        max_err = max(max_err, err)
+        expected_mask = reference(
+            chunk.numpy(), sampling_rate=sr, return_tensors="np",
+            padding="max_length", return_attention_mask=True,
+        )["attention_mask"][0]
+        assert int(mask[i].sum()) == int(expected_mask.sum()), f"第 {i} 块帧掩码不一致"
+    assert max_err <= atol, f"log-mel 最大误差 {max_err:.2e} 超出容差 {atol:.0e}"
+    return max_err
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    logger.info(f"log-mel 对齐检查通过 ({device})，最大误差 {check_against_reference(device=device):.2e}")
@@ -0,0 +1,145 @@
+"""原始 PCM 双向流 - 客户端持续发送 16kHz PCM 帧，服务端持续返回分段结果
+
+面向已经在内存中持有 16kHz PCM 的内部服务（如电话系统）：不经过 multipart 解析、临时文件和
+格式解码，字节到达后直接做增量 VAD，已确定的分段立即送入模型。
+
+WebSocket 协议（`/api/stream?max_new_tokens=512&timeout=0`）：
+    服务端 → {"type": "ready", "job_id": ..., "window": 262144}
+    客户端 → 二进制帧：16kHz 单声道 16-bit 小端 PCM（帧长任意，可跨采样边界）
+    服务端 → {"type": "ack", "bytes": 已处理字节数, "backlog_s": 待转录秒数}（每处理约 1/4 窗口确认一次）
+    服务端 → {"type": "token", "index": 1, "text": "..."}
+    服务端 → {"type": "partial", "index": 1, "start": 0.0, "end": 12.3, "text": "..."}
+    客户端 → {"type": "end"}（音频结束）或 {"type": "cancel"}
+    服务端 → {"type": "final", "text": "...", "duration": 60.0, "segments": 5} 后关闭连接
+             （或 {"type": "cancelled", "reason": ...} / {"type": "error", "message": ...}）
+
+流控：客户端已发送但未被 ack 的字节不得超过 window。待转录的音频超过 STREAM_MAX_BACKLOG_S
+时服务端暂停 ack（也暂停读取），直到模型追上，发送方因此自然降速。
+"""
+import os
+import queue
+import threading
+import logging
+
+from gpu_manager import CANCEL_REQUEST, gpu_manager, TranscriptionCancelled
+from resumable_upload import PcmStreamDecoder
+from vad_segmenter import IncrementalSegmenter
+
+logger = logging.getLogger(__name__)
+
+SR = 16000
+# 客户端未被确认的最大字节数（默认约 8 秒音频）
+STREAM_WINDOW_BYTES = int(os.environ.get('STREAM_WINDOW_BYTES', 256 * 1024))
+# 已切分但尚未转录的音频超过该秒数时暂停确认
+STREAM_MAX_BACKLOG_S = float(os.environ.get('STREAM_MAX_BACKLOG_S', 60))
+
+
+class PcmStreamSession:
+    """一次流式会话
+
+    feed / finish 由接收方按顺序调用（会做 VAD，应放在线程池中执行），转录在独立线程中进行；
+    事件通过 emit 回调交给发送方，回调可能来自任意线程。
+    """
+
+    def __init__(self, emit, max_new_tokens: int = 512, deadline_s: float = None):
+        # 时长未知，按 0 秒准入，只占一个队列位置
+        self.ticket = gpu_manager.admission.admit(0.0)
+        self.emit = emit
+        self.max_new_tokens = max_new_tokens
+        self.job_id, self.token = gpu_manager.create_job(deadline_s)
+        self.decoder = PcmStreamDecoder('stream.pcm')
+        self.segmenter = IncrementalSegmenter(sr=SR, max_duration=gpu_manager.segment_max_s)
+        self.received_bytes = 0
+        self.acked_bytes = 0
+        self.segments = queue.Queue()
+        self.segment_count = 0
+        self.backlog_samples = 0
+        self.cond = threading.Condition()
+        self.finished = False
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    @property
+    def backlog_seconds(self) -> float:
+        return self.backlog_samples / SR
+
+    # ---------- 接收 ----------
+    def feed(self, data: bytes):
+        """处理一帧 PCM；待转录音频过多时阻塞，追上后再确认"""
+        if self.finished:
+            return
+        self._enqueue(self.segmenter.feed(self.decoder.feed(data)))
+        self.received_bytes += len(data)
+        with self.cond:
+            while (self.backlog_seconds > STREAM_MAX_BACKLOG_S
+                   and not self.finished and not self.token.cancelled):
+                self.cond.wait(1.0)
+        if self.received_bytes - self.acked_bytes >= STREAM_WINDOW_BYTES // 4:
+            self.acked_bytes = self.received_bytes
+            self.emit({"type": "ack", "bytes": self.received_bytes, "backlog_s": round(self.backlog_seconds, 1)})
+
+    def finish(self):
+        """音频结束：切出剩余分段，转录完成后发送 final"""
+        if not self.finished:
+            self._enqueue(self.segmenter.finish())
+        self.segments.put(None)
+
+    def cancel(self, reason: str = CANCEL_REQUEST):
+        self.token.cancel(reason)
+        self.segments.put(None)
+        with self.cond:
+            self.cond.notify_all()
+
+    def _enqueue(self, segments: list):
+        for start, end in segments:
+            # 分段音频在下一次 feed 前必须取出
+            chunk = self.segmenter.audio(start, end).clone()
+            with self.cond:
+                self.backlog_samples += end - start
+            self.segments.put((start, end, chunk))
+
+    # ---------- 转录 ----------
+    def _next_segment(self):
+        while True:
+            self.token.raise_if_cancelled()
+            try:
+                return self.segments.get(timeout=1.0)
+            except queue.Empty:
+                continue
+
+    def _run(self):
+        results = []
+        try:
+            while True:
+                item = self._next_segment()
+                if item is None:
+                    break
+                start, end, chunk = item
+                self.segment_count += 1
+                index = self.segment_count
+                text = gpu_manager.transcribe(
+                    chunk, self.max_new_tokens,
+                    token_callback=lambda _, t: self.emit({"type": "token", "index": index, "text": t}),
+                    cancel_token=self.token,
+                )
+                with self.cond:
+                    self.backlog_samples -= end - start
+                    self.cond.notify_all()
+                if text:
+                    results.append(text)
+                    self.emit({"type": "partial", "index": index, "start": round(start / SR, 2),
+                               "end": round(end / SR, 2), "text": text})
+            self.token.raise_if_cancelled()
+            self.emit({"type": "final", "text": ''.join(results),
+                       "duration": round(self.segmenter.total_samples / SR, 2), "segments": self.segment_count})
+        except TranscriptionCancelled as e:
+            self.emit({"type": "cancelled", "reason": e.reason})
+        except Exception as e:
+            logger.error(f"流式转录失败 ({self.job_id}): {e}")
+            self.emit({"type": "error", "message": str(e)})
+        finally:
+            with self.cond:
+                self.finished = True
+                self.cond.notify_all()
+            self.ticket.release()
+            gpu_manager.finish_job(self.job_id)
@@ -0,0 +1,112 @@
+"""负载自适应质量档位 - 队列积压时把请求降到更便宜的转录模式，负载回落后自动恢复
+
+档位（质量由高到低）：
+    full      请求原样执行
+    reduced   每段生成上限不超过 QUALITY_TOKENS 的第一项（默认 256），长音频启用语音紧凑打包（跳过停顿，窗口更少）
+    economy   生成上限取第二项（默认 128），打包 + 长上下文合并生成（生成调用最少）；
+              配置了 LITE_CHECKPOINT 时改用轻量模型（更小的检查点，或 int8 动态量化的主模型）
+
+负载 = max(队列深度 / MAX_QUEUE_DEPTH, 预计等待 / QUALITY_MAX_WAIT_S)，预计等待为排队音频时长 × 实时率（EWMA）。
+负载达到 QUALITY_THRESHOLDS（默认 0.5,0.8）时立即降档；低于当前档位的阈值后，每持续 QUALITY_RECOVER_S 秒恢复一档。
+
+请求的 quality 参数：auto 跟随策略，full 始终全质量，reduced / economy 直接指定档位；
+未指定时取 QUALITY_DEFAULT（默认 full，即不降级，需要降级的部署设为 auto）。
+"""
+import os
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+TIERS = ('full', 'reduced', 'economy')
+MODES = ('auto',) + TIERS
+
+
+class QualityPolicy:
+    """根据准入控制器的队列深度和实时率选择档位"""
+
+    def __init__(self, admission, default: str = 'full', max_wait_s: float = 60.0,
+                 thresholds: tuple = (0.5, 0.8), recover_s: float = 30.0, token_caps: tuple = (256, 128)):
+        if default not in MODES:
+            raise ValueError(f"QUALITY_DEFAULT 须为 {', '.join(MODES)} 之一: {default}")
+        self.admission = admission
+        self.default = default
+        self.max_wait_s = max_wait_s
+        self.thresholds = tuple(thresholds)
+        self.recover_s = recover_s
+        self.token_caps = tuple(token_caps)
+        self.level = 0
+        # 负载最近一次不低于当前档位阈值的时间，用于判断何时恢复
+        self._busy_at = time.monotonic()
+        self.requests = {tier: 0 for tier in TIERS}
+        self.changes = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, admission) -> "QualityPolicy":
+        return cls(
+            admission,
+            default=os.environ.get('QUALITY_DEFAULT', 'full'),
+            max_wait_s=float(os.environ.get('QUALITY_MAX_WAIT_S', 60)),
+            thresholds=tuple(float(x) for x in os.environ.get('QUALITY_THRESHOLDS', '0.5,0.8').split(',')),
+            recover_s=float(os.environ.get('QUALITY_RECOVER_S', 30)),
+            token_caps=tuple(int(x) for x in os.environ.get('QUALITY_TOKENS', '256,128').split(',')),
+        )
+
+    def load(self) -> float:
+        queue = self.admission.status()
+        depth = queue["depth"] / queue["max_depth"] if queue["max_depth"] else 0.0
+        wait = queue["estimated_wait_s"] / self.max_wait_s if self.max_wait_s else 0.0
+        return max(depth, wait)
+
+    def _update(self) -> int:
+        """按当前负载更新档位：升压立即降档，回落后按 recover_s 逐档恢复"""
+        load = self.load()
+        target = sum(load >= threshold for threshold in self.thresholds)
+        now = time.monotonic()
+        with self._lock:
+            previous = self.level
+            if target >= self.level:
+                self.level = target
+                self._busy_at = now
+            else:
+                steps = int((now - self._busy_at) // self.recover_s) if self.recover_s > 0 else self.level
+                if steps:
+                    self.level = max(target, self.level - steps)
+                    self._busy_at = now
+            if self.level != previous:
+                self.changes += 1
+                logger.info(f"质量档位 {TIERS[previous]} -> {TIERS[self.level]}（负载 {load:.2f}）")
+            return self.level
+
+    def select(self, requested: str = None) -> str:
+        """确定本次请求的档位；requested 为 None 时取 QUALITY_DEFAULT"""
+        requested = requested or self.default
+        if requested not in MODES:
+            raise ValueError(f"quality 须为 {', '.join(MODES)} 之一: {requested}")
+        tier = TIERS[self._update()] if requested == 'auto' else requested
+        with self._lock:
+            self.requests[tier] += 1
+        return tier
+
+    def apply(self, tier: str, max_new_tokens: int, packing: bool, long_context: bool) -> tuple:
+        """按档位调整请求参数，返回 (max_new_tokens, packing, long_context)"""
+        level = TIERS.index(tier)
+        if level == 0:
+            return max_new_tokens, packing, long_context
+        return min(max_new_tokens, self.token_caps[level - 1]), True, long_context or level >= 2
+
+    def status(self) -> dict:
+        """只读：报告当前档位，不触发降档或恢复（档位只随 auto 请求变化）"""
+        load = self.load()
+        with self._lock:
+            return {
+                "default": self.default,
+                "tier": TIERS[self.level],
+                "load": round(load, 3),
+                "thresholds": list(self.thresholds),
+                "token_caps": list(self.token_caps),
+                "changes": self.changes,
+                "requests": dict(self.requests),
+            }
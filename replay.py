@@ -0,0 +1,253 @@
+"""流量回放 - 按 traffic.py 录制的到达时间重放请求，统计延迟分布和队列增长
+
+用法:
+    python replay.py --log /data/traffic --target http://localhost:7860 [--speed 4]
+    python replay.py --log /data/traffic --target local [--checkpoint zai-org/GLM-ASR-Nano-2512] [--speed 4]
+
+--target 为服务地址时通过 HTTP 重放（同一端点、同样参数）；为 local 时直接调用进程内的 GPUManager，
+经过同样的准入控制。录制了音频的请求用原音频，否则生成相同时长的合成语音。
+--speed 为回放倍速：1 按原始间隔，4 表示到达间隔缩短为 1/4。
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+import numpy as np
+import soundfile as sf
+
+SR = 16000
+# 可按原端点重放的 multipart 接口，其他来源（续传、流式、socket.io）统一回放到 /api/transcribe
+MULTIPART_PATHS = ('/api/transcribe', '/api/transcribe/long', '/api/transcribe/stream')
+
+
+def post_multipart(url: str, fields: dict, filename: str, data: bytes) -> tuple:
+    """POST multipart/form-data，读完整个响应（含 SSE）后返回 (状态码, 响应体)"""
+    boundary = uuid.uuid4().hex
+    body = b''.join(
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"{k}\"\r\n\r\n{v}\r\n".encode()
+        for k, v in fields.items()
+    ) + (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: application/octet-stream\r\n\r\n"
+    ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    request = urllib.request.Request(url, data=body, method="POST",
+                                     headers={"Content-Type": f"multipart/form-data; boundary={boundary}"})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def synthetic_audio(seconds: float, seed: int = 0) -> np.ndarray:
+    """生成指定时长的类语音信号：0.2~2s 的调制噪声音节，间隔 0.1~0.8s 静音"""
+    rng = np.random.default_rng(seed)
+    total = int(seconds * SR)
+    wav = np.zeros(total, dtype=np.float32)
+    pos = int(rng.uniform(0.1, 0.3) * SR)
+    while pos < total:
+        length = min(int(rng.uniform(0.2, 2.0) * SR), total - pos)
+        t = np.arange(length) / SR
+        envelope = 0.5 * (1 - np.cos(2 * np.pi * rng.uniform(3, 6) * t)) * np.hanning(length)
+        wav[pos:pos + length] = 0.3 * envelope * rng.standard_normal(length)
+        pos += length + int(rng.uniform(0.1, 0.8) * SR)
+    return wav
+
+
+def load_traffic(root: str) -> list:
+    """读取录制的请求（按到达时间排序），跳过未知音频时长且没有音频的记录"""
+    entries = []
+    with open(os.path.join(root, 'traffic.jsonl'), encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if entry.get("audio"):
+                entry["audio"] = os.path.join(root, entry["audio"])
+                if not os.path.exists(entry["audio"]):
+                    entry["audio"] = None
+            if entry.get("audio") or entry.get("duration"):
+                entries.append(entry)
+    return sorted(entries, key=lambda e: e["ts"])
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Replayer:
+    """按录制间隔发出请求，并行执行，同时每 0.5 秒采样队列状态"""
+
+    def __init__(self, entries: list, target: str, speed: float = 1.0, limit: int = None):
+        self.entries = entries[:limit] if limit else entries
+        self.target = target.rstrip('/')
+        self.speed = speed
+        self.results = []
+        self.queue_samples = []
+        self._lock = threading.Lock()
+        self._synthetic = {}
+        self._tmpdir = tempfile.mkdtemp(prefix='glm-asr-replay-')
+
+    @property
+    def local(self) -> bool:
+        return self.target == 'local'
+
+    # ---------- 音频 ----------
+    def _audio_file(self, entry: dict) -> str:
+        if entry.get("audio"):
+            return entry["audio"]
+        key = round(entry["duration"], 1)
+        with self._lock:
+            if key not in self._synthetic:
+                path = os.path.join(self._tmpdir, f"synthetic-{key}.wav")
+                sf.write(path, synthetic_audio(key, seed=len(self._synthetic)), SR, subtype='PCM_16')
+                self._synthetic[key] = path
+            return self._synthetic[key]
+
+    # ---------- 发送 ----------
+    def _send_http(self, entry: dict) -> int:
+        path = entry["endpoint"].split(' ', 1)[-1]
+        if path not in MULTIPART_PATHS:
+            path = '/api/transcribe'
+        fields = {k: v for k, v in entry.get("params", {}).items()
+                  if k in ("max_new_tokens", "timeout", "packing", "long_context")}
+        audio = self._audio_file(entry)
+        with open(audio, 'rb') as f:
+            data = f.read()
+        status, _ = post_multipart(f"{self.target}{path}", fields, os.path.basename(audio), data)
+        return status
+
+    def _send_local(self, entry: dict) -> int:
+        from admission import QueueFull, probe_duration
+        from gpu_manager import gpu_manager
+
+        audio = self._audio_file(entry)
+        params = entry.get("params", {})
+        try:
+            ticket = gpu_manager.admission.admit(entry.get("duration") or probe_duration(audio))
+        except QueueFull:
+            return 429
+        with ticket:
+            gpu_manager.transcribe(audio, int(params.get("max_new_tokens", 512)),
+                                   packing=params.get("packing"), long_context=params.get("long_context"),
+                                   quality=params.get("quality"))
+        return 200
+
+    def _issue(self, entry: dict, scheduled: float):
+        sent = time.perf_counter()
+        try:
+            status = self._send_local(entry) if self.local else self._send_http(entry)
+        except Exception as e:
+            status = f"error: {e}"
+        done = time.perf_counter()
+        with self._lock:
+            self.results.append({"endpoint": entry["endpoint"], "duration": entry.get("duration"),
+                                 "status": status, "latency": done - sent, "lag": sent - scheduled})
+
+    # ---------- 队列 ----------
+    def _queue_status(self) -> dict:
+        if self.local:
+            from gpu_manager import gpu_manager
+            return gpu_manager.admission.status()
+        with urllib.request.urlopen(f"{self.target}/queue/status") as response:
+            return json.load(response)
+
+    def _monitor(self, started: float, stop: threading.Event):
+        while not stop.is_set():
+            try:
+                status = self._queue_status()
+                self.queue_samples.append((time.perf_counter() - started, status.get("depth", 0),
+                                           status.get("queued_audio_seconds", 0.0)))
+            except Exception:
+                pass
+            stop.wait(0.5)
+
+    def run(self):
+        if not self.entries:
+            return
+        t0 = self.entries[0]["ts"]
+        started = time.perf_counter()
+        stop = threading.Event()
+        monitor = threading.Thread(target=self._monitor, args=(started, stop), daemon=True)
+        monitor.start()
+        threads = []
+        for entry in self.entries:
+            scheduled = started + (entry["ts"] - t0) / self.speed
+            time.sleep(max(0.0, scheduled - time.perf_counter()))
+            thread = threading.Thread(target=self._issue, args=(entry, scheduled), daemon=True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        stop.set()
+        monitor.join()
+        self.wall = time.perf_counter() - started
+
+    # ---------- 报告 ----------
+    def report(self):
+        if not self.results:
+            print("没有可回放的请求")
+            return
+        span = self.entries[-1]["ts"] - self.entries[0]["ts"]
+        audio = sum(r["duration"] or 0 for r in self.results)
+        print(f"回放 {len(self.results)} 个请求，录制时长 {span:.0f}s，{self.speed:g}x 倍速，实际耗时 {self.wall:.0f}s，"
+              f"音频共 {audio:.0f}s")
+
+        groups = {"全部": self.results}
+        for r in self.results:
+            groups.setdefault(r["endpoint"], []).append(r)
+        for name, results in groups.items():
+            latencies = [r["latency"] * 1000 for r in results if r["status"] == 200]
+            statuses = {}
+            for r in results:
+                statuses[r["status"]] = statuses.get(r["status"], 0) + 1
+            line = f"  {name}: {len(results)} 个, 状态 {statuses}"
+            if latencies:
+                line += (f", 延迟 p50 {percentile(latencies, 0.5):.0f}ms p90 {percentile(latencies, 0.9):.0f}ms "
+                         f"p99 {percentile(latencies, 0.99):.0f}ms max {max(latencies):.0f}ms")
+            print(line)
+        lag = [r["lag"] * 1000 for r in self.results]
+        print(f"  发送滞后: p99 {percentile(lag, 0.99):.0f}ms（回放端本身跟不上时会偏大）")
+
+        if self.queue_samples:
+            times = np.array([s[0] for s in self.queue_samples])
+            depths = np.array([s[1] for s in self.queue_samples])
+            # 队列深度对时间的线性斜率：持续为正说明到达速率超过处理能力
+            slope = np.polyfit(times, depths, 1)[0] * 60 if len(times) > 1 else 0.0
+            print(f"队列: 最大深度 {depths.max()}, 平均 {depths.mean():.1f}, 增长 {slope:+.2f}/分钟, "
+                  f"最大排队音频 {max(s[2] for s in self.queue_samples):.0f}s")
+            step = max(1, len(self.queue_samples) // 10)
+            for t, depth, queued in self.queue_samples[::step]:
+                print(f"  t={t:6.0f}s 深度 {depth:3d} 排队音频 {queued:7.1f}s {'#' * depth}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GLM-ASR 流量回放")
+    parser.add_argument("--log", required=True, help="TRAFFIC_LOG_DIR 录制目录")
+    parser.add_argument("--target", default="http://localhost:7860", help="服务地址，或 local 直接调用 GPUManager")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放倍速")
+    parser.add_argument("--limit", type=int, default=None, help="只回放前 N 个请求")
+    parser.add_argument("--checkpoint", default=os.environ.get('MODEL_CHECKPOINT', 'zai-org/GLM-ASR-Nano-2512'),
+                        help="--target local 时加载的模型")
+    args = parser.parse_args()
+
+    if args.target == 'local':
+        from gpu_manager import gpu_manager
+        gpu_manager.load(args.checkpoint)
+        # 未录制音频的请求按时长复用同一段合成语音，关闭分段缓存以免全部命中
+        gpu_manager.segment_cache.max_entries = 0
+    replayer = Replayer(load_traffic(args.log), args.target, args.speed, args.limit)
+    replayer.run()
+    replayer.report()
+
+
+if __name__ == "__main__":
+    main()
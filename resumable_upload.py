@@ -0,0 +1,290 @@
+"""断点续传上传 - 按偏移追加分块，边上传边解码、分段、转录
+
+协议（与 tus 类似）：
+    POST   /api/uploads                创建上传，返回 upload_id
+    PATCH  /api/uploads/{upload_id}    请求头 Upload-Offset 指明本块起始偏移，请求体为原始字节
+    HEAD   /api/uploads/{upload_id}    查询已接收的偏移，断线后从该位置续传
+    GET    /api/uploads/{upload_id}/events   SSE，上传进度与转录进度合并推送
+    DELETE /api/uploads/{upload_id}    取消
+
+.pcm（16kHz 单声道 16-bit）和 16kHz 16-bit PCM WAV 可增量解码：字节到达后立即做 VAD，
+已确定的分段马上排队转录。其他格式在上传完成后整体解码，再走同样的分段流程。
+"""
+import os
+import struct
+import tempfile
+import threading
+import time
+import uuid
+import logging
+
+import numpy as np
+import torch
+
+from gpu_manager import CANCEL_REQUEST, gpu_manager, load_audio, TranscriptionCancelled
+from vad_segmenter import IncrementalSegmenter
+
+logger = logging.getLogger(__name__)
+
+SR = 16000
+# 超过该时长没有任何请求的上传会被清理
+UPLOAD_TTL_S = float(os.environ.get('UPLOAD_TTL_S', 3600))
+# 转录线程每次从落盘文件读取的字节数
+READ_BLOCK = 1 << 20
+
+
+class OffsetMismatch(Exception):
+    """分块偏移与服务端已接收的偏移不一致，offset 为服务端当前偏移"""
+
+    def __init__(self, offset: int):
+        super().__init__(f"偏移不一致，服务端已接收 {offset} 字节")
+        self.offset = offset
+
+
+class PcmStreamDecoder:
+    """把陆续到达的字节增量解码为 16kHz 单声道波形
+
+    支持 .pcm（无文件头）和 16kHz 16-bit PCM WAV；其他格式 streaming 为 False，
+    需等上传完成后整体解码。
+    """
+
+    def __init__(self, filename: str):
+        ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+        self.kind = ext if ext in ('pcm', 'wav') else None
+        self.channels = 1
+        self._header = b''
+        self._in_data = self.kind == 'pcm'
+        self._remainder = b''
+
+    @property
+    def streaming(self) -> bool:
+        return self.kind is not None
+
+    @staticmethod
+    def estimate_seconds(filename: str, length: int) -> float:
+        """按 16kHz 单声道 16-bit 估算时长，用于准入控制"""
+        if filename.lower().endswith(('.pcm', '.wav')):
+            return length / (2 * SR)
+        return 0.0
+
+    def feed(self, data: bytes) -> torch.Tensor:
+        """返回本次可解码出的采样（可能为空）"""
+        if not self._in_data:
+            self._header += data
+            data = self._parse_header()
+            if not self._in_data:
+                return torch.zeros(0)
+        data = self._remainder + data
+        frame = 2 * self.channels
+        usable = len(data) - len(data) % frame
+        self._remainder = data[usable:]
+        pcm = np.frombuffer(data[:usable], dtype='<i2').reshape(-1, self.channels)[:, 0]
+        return torch.from_numpy(pcm.astype(np.float32) / 32768.0)
+
+    def _parse_header(self) -> bytes:
+        """解析 WAV 头，找到 data 块后返回其后的字节；格式不支持时退化为整体解码"""
+        buf = self._header
+        if len(buf) < 12:
+            return b''
+        if buf[:4] != b'RIFF' or buf[8:12] != b'WAVE':
+            self.kind = None
+            return b''
+        pos = 12
+        while pos + 8 <= len(buf):
+            chunk_id, size = buf[pos:pos + 4], struct.unpack('<I', buf[pos + 4:pos + 8])[0]
+            if chunk_id == b'data':
+                self._in_data = True
+                return buf[pos + 8:]
+            if pos + 8 + size > len(buf):
+                return b''
+            if chunk_id == b'fmt ':
+                fmt, channels, rate = struct.unpack('<HHI', buf[pos + 8:pos + 16])
+                bits = struct.unpack('<H', buf[pos + 22:pos + 24])[0]
+                # 1 = PCM, 0xFFFE = WAVE_FORMAT_EXTENSIBLE
+                if fmt not in (1, 0xFFFE) or bits != 16 or rate != SR:
+                    self.kind = None
+                    return b''
+                self.channels = channels
+            pos += 8 + size + size % 2
+        return b''
+
+
+class UploadSession:
+    """一次断点续传上传及其转录任务"""
+
+    def __init__(self, filename: str, length: int, max_new_tokens: int = 512, deadline_s: float = None):
+        # 先准入，队列已满时直接抛出 QueueFull，不创建任何状态
+        self.ticket = gpu_manager.admission.admit(PcmStreamDecoder.estimate_seconds(filename, length))
+        self.upload_id = uuid.uuid4().hex
+        self.filename = filename
+        self.length = length
+        self.max_new_tokens = max_new_tokens
+        self.path = os.path.join(tempfile.gettempdir(), f"upload-{self.upload_id}-{os.path.basename(filename)}")
+        open(self.path, 'wb').close()
+        self.offset = 0
+        self.updated = time.monotonic()
+        self.cond = threading.Condition()
+        self.events = []
+        self.finished = False
+
+        self.job_id, self.token = gpu_manager.create_job(deadline_s)
+        self.decoder = PcmStreamDecoder(filename)
+        self.segmenter = IncrementalSegmenter(sr=SR, max_duration=gpu_manager.segment_max_s)
+        self.segments_done = 0
+        self.transcribed_seconds = 0.0
+        self.results = []
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    @property
+    def complete(self) -> bool:
+        return self.offset >= self.length
+
+    # ---------- 上传 ----------
+    def append(self, offset: int, data: bytes) -> int:
+        """在 offset 处追加一块数据，返回新的偏移"""
+        with self.cond:
+            if offset != self.offset:
+                raise OffsetMismatch(self.offset)
+            data = data[:self.length - self.offset]
+            with open(self.path, 'ab') as f:
+                f.write(data)
+            self.offset += len(data)
+            self.updated = time.monotonic()
+            self.cond.notify_all()
+        self._emit_progress()
+        return self.offset
+
+    def cancel(self, reason: str = CANCEL_REQUEST):
+        self.token.cancel(reason)
+        with self.cond:
+            self.cond.notify_all()
+
+    # ---------- 事件 ----------
+    def _emit(self, event: dict):
+        with self.cond:
+            self.events.append(event)
+            self.cond.notify_all()
+
+    def _emit_progress(self):
+        self._emit({
+            "type": "progress",
+            "uploaded": self.offset,
+            "upload_total": self.length,
+            "received_seconds": round(self.segmenter.total_samples / SR, 1),
+            "segments_done": self.segments_done,
+            "transcribed_seconds": round(self.transcribed_seconds, 1),
+        })
+
+    def wait_events(self, cursor: int, timeout: float = 1.0) -> list:
+        """返回 cursor 之后的事件，没有新事件时最多等待 timeout 秒"""
+        with self.cond:
+            if len(self.events) <= cursor:
+                self.cond.wait(timeout)
+            self.updated = time.monotonic()
+            return self.events[cursor:]
+
+    # ---------- 转录 ----------
+    def _read_available(self, read_pos: int) -> bytes:
+        """等待新字节到达，返回 read_pos 之后已落盘的数据；上传完成且读完时返回 None"""
+        with self.cond:
+            while read_pos >= self.offset and not self.complete and not self.token.cancelled:
+                self.cond.wait(1.0)
+            self.token.raise_if_cancelled()
+            end = self.offset
+        if read_pos >= end:
+            return None
+        with open(self.path, 'rb') as f:
+            f.seek(read_pos)
+            return f.read(min(end - read_pos, READ_BLOCK))
+
+    def _transcribe_segments(self, segments: list):
+        for start, end in segments:
+            self.token.raise_if_cancelled()
+            chunk = self.segmenter.audio(start, end)
+            index = self.segments_done + 1
+            text = gpu_manager.transcribe(
+                chunk, self.max_new_tokens,
+                token_callback=lambda _, t: self._emit({"type": "token", "index": index, "text": t}),
+                cancel_token=self.token,
+            )
+            self.segments_done += 1
+            self.transcribed_seconds += (end - start) / SR
+            if text:
+                self.results.append(text)
+                self._emit({"type": "partial", "index": index, "start": round(start / SR, 2),
+                            "end": round(end / SR, 2), "text": text})
+            self._emit_progress()
+
+    def _run(self):
+        try:
+            read_pos = 0
+            while True:
+                data = self._read_available(read_pos)
+                if data is None:
+                    break
+                read_pos += len(data)
+                if self.decoder.streaming:
+                    self._transcribe_segments(self.segmenter.feed(self.decoder.feed(data)))
+            if not self.decoder.streaming:
+                # 无法增量解码的格式：上传完成后整体解码
+                self._transcribe_segments(self.segmenter.feed(load_audio(self.path)[0]))
+            self._transcribe_segments(self.segmenter.finish())
+            self._emit({"type": "done", "text": ''.join(self.results)})
+        except TranscriptionCancelled as e:
+            self._emit({"type": "cancelled", "reason": e.reason})
+        except Exception as e:
+            logger.error(f"续传转录失败 ({self.upload_id}): {e}")
+            self._emit({"type": "error", "message": str(e)})
+        finally:
+            self.finished = True
+            self.ticket.release()
+            gpu_manager.finish_job(self.job_id)
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def status(self) -> dict:
+        return {
+            "upload_id": self.upload_id,
+            "job_id": self.job_id,
+            "offset": self.offset,
+            "length": self.length,
+            "segments_done": self.segments_done,
+            "finished": self.finished,
+        }
+
+
+class UploadStore:
+    """进程内的上传会话表（多 worker 部署时需让同一 upload_id 落到同一 worker）"""
+
+    def __init__(self):
+        self.sessions = {}
+        self._lock = threading.Lock()
+
+    def create(self, filename: str, length: int, max_new_tokens: int = 512,
+               deadline_s: float = None) -> UploadSession:
+        self.expire()
+        session = UploadSession(filename, length, max_new_tokens, deadline_s)
+        with self._lock:
+            self.sessions[session.upload_id] = session
+        return session
+
+    def get(self, upload_id: str) -> UploadSession:
+        return self.sessions.get(upload_id)
+
+    def remove(self, upload_id: str):
+        with self._lock:
+            session = self.sessions.pop(upload_id, None)
+        if session and not session.finished:
+            session.cancel()
+
+    def expire(self):
+        """清理长时间无活动的会话"""
+        now = time.monotonic()
+        for upload_id, session in list(self.sessions.items()):
+            if now - session.updated > UPLOAD_TTL_S:
+                logger.info(f"清理过期上传: {upload_id}")
+                self.remove(upload_id)
+
+
+upload_store = UploadStore()
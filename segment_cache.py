@@ -0,0 +1,194 @@
+"""分段级转录缓存 - 重复出现的音频（IVR 提示音、等待音乐、免责声明）只转录一次
+
+指纹按 VAD 语音段的粒度计算：每个窗口去掉首尾静音，在较长的静音处切成若干语音段，每段记录 40ms 一格的
+频带能量（相对窗口峰值的 dB，与音量无关）。两个指纹的语音段数相同、每段长度相差不超过 MAX_SHIFT 格、
+在 ±MAX_SHIFT 格的对齐内平均差不超过 MATCH_DB 时视为同一段音频——重新编码（有损压缩、16-bit 量化）或
+VAD 边界在静音中落点不同（首尾、段间静音长短不一）都能命中。键中同时包含窗口划分和生成上限。
+查找时按生成上限、段数和总时长分桶，只比较相邻桶内的条目。
+默认关闭，设置 SEGMENT_CACHE_SIZE（条目数，按 LRU 淘汰）后启用。
+"""
+import math
+import os
+import threading
+from collections import OrderedDict
+
+import torch
+
+SR = 16000
+N_FFT = 512
+HOP = 160
+# 每格的帧数（10ms 一帧）
+CELL_FRAMES = 4
+BANDS = 16
+# 低于窗口峰值该 dB 的频带能量截断，低于该 dB 的帧视为静音
+FLOOR_DB = 40.0
+SILENCE_DB = 30.0
+# 超过该格数的静音把语音切成两段
+GAP_CELLS = 5
+# 比较时允许的对齐偏移（格）和平均差（dB）
+MAX_SHIFT = 2
+MATCH_DB = 2.0
+# 分桶粒度（格）
+BUCKET_CELLS = 25
+
+
+def _band_edges() -> list:
+    """100Hz-8kHz 按 mel 刻度均分的频带边界（FFT bin）"""
+    mel = lambda hz: 2595 * math.log10(1 + hz / 700)
+    low, high = mel(100), mel(SR / 2)
+    edges = []
+    for k in range(BANDS + 1):
+        hz = 700 * (10 ** ((low + (high - low) * k / BANDS) / 2595) - 1)
+        edges.append(max(round(hz * N_FFT / SR), edges[-1] + 1 if edges else 0))
+    return edges
+
+
+_EDGES = _band_edges()
+_WINDOW = torch.hann_window(N_FFT)
+
+
+def _speech_runs(wav: torch.Tensor) -> list:
+    """一个窗口的语音段特征列表，每段为 (格数, BANDS) 的 int8 相对 dB
+
+    语音段按 10ms 帧检测，每段从自己的起点开始分格，首尾静音长短不影响格的对齐。
+    """
+    wav = wav.detach().float().cpu().reshape(-1)
+    if not wav.numel() or not wav.abs().max() > 0:
+        return []
+    if wav.numel() < N_FFT:
+        wav = torch.nn.functional.pad(wav, (0, N_FFT - wav.numel()))
+    power = torch.stft(wav, N_FFT, HOP, window=_WINDOW, return_complex=True).abs().pow(2)
+    bands = torch.stack([power[lo:hi].sum(0) for lo, hi in zip(_EDGES[:-1], _EDGES[1:])], dim=1)
+    energy = bands.sum(1)
+    active = (10 * torch.log10(energy / energy.max() + 1e-12) >= -SILENCE_DB).nonzero().flatten().tolist()
+
+    runs, start, prev = [], None, None
+    for f in active:
+        if start is not None and f - prev > GAP_CELLS * CELL_FRAMES:
+            runs.append((start, prev + 1))
+            start = None
+        start = f if start is None else start
+        prev = f
+    if start is not None:
+        runs.append((start, prev + 1))
+
+    features = []
+    for a, b in runs:
+        # 不足一格的尾部按一格计
+        n = -(-(b - a) // CELL_FRAMES) * CELL_FRAMES
+        cells = bands[a:a + n]
+        cells = torch.cat([cells, cells[-1:].expand(n - cells.shape[0], -1)]).reshape(-1, CELL_FRAMES, BANDS).mean(1)
+        features.append((10 * torch.log10(cells / bands.max() + 1e-12)).clamp(min=-FLOOR_DB).round().to(torch.int8))
+    return features
+
+
+def _close(a: torch.Tensor, b: torch.Tensor) -> bool:
+    """两段特征在 ±MAX_SHIFT 格的对齐内平均差不超过 MATCH_DB"""
+    if abs(a.shape[0] - b.shape[0]) > MAX_SHIFT:
+        return False
+    a, b = a.float(), b.float()
+    for shift in range(-MAX_SHIFT, MAX_SHIFT + 1):
+        x, y = a[max(shift, 0):], b[max(-shift, 0):]
+        n = min(x.shape[0], y.shape[0])
+        if n > 0 and (x[:n] - y[:n]).abs().mean().item() <= MATCH_DB:
+            return True
+    return False
+
+
+class SegmentKey:
+    """一个样本的指纹：逐窗口的语音段特征；按对象判等，相似的指纹用 matches 比较"""
+
+    __slots__ = ("max_new_tokens", "runs", "bucket")
+
+    def __init__(self, max_new_tokens: int, runs: list):
+        self.max_new_tokens = max_new_tokens
+        self.runs = runs
+        cells = sum(run.shape[0] for window in runs for run in window)
+        self.bucket = (max_new_tokens, tuple(len(window) for window in runs), cells // BUCKET_CELLS)
+
+    def buckets(self) -> list:
+        """可能含有匹配条目的桶：本桶和总时长相邻的桶"""
+        tokens, shape, size = self.bucket
+        return [(tokens, shape, size + d) for d in (0, -1, 1)]
+
+    def matches(self, other: "SegmentKey") -> bool:
+        if self.bucket[:2] != other.bucket[:2]:
+            return False
+        return all(_close(a, b) for wa, wb in zip(self.runs, other.runs) for a, b in zip(wa, wb))
+
+
+def fingerprint(windows: list, max_new_tokens: int) -> SegmentKey:
+    """一个样本（若干 1-D 波形窗口）的缓存键"""
+    return SegmentKey(max_new_tokens, [_speech_runs(wav) for wav in windows])
+
+
+class SegmentCache:
+    """指纹 -> 转录文本的 LRU 缓存，查找时返回任一匹配条目的文本"""
+
+    def __init__(self, max_entries: int = 0):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "saved_audio_seconds": 0.0}
+
+    @classmethod
+    def from_env(cls) -> "SegmentCache":
+        return cls(max_entries=int(os.environ.get('SEGMENT_CACHE_SIZE', 0)))
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _find(self, key: SegmentKey):
+        for bucket in key.buckets():
+            for stored in self._buckets.get(bucket, ()):
+                if key.matches(stored):
+                    return stored
+        return None
+
+    def get(self, key: SegmentKey, audio_seconds: float = 0.0):
+        """命中时返回文本并记为最近使用，未命中返回 None"""
+        with self._lock:
+            stored = self._find(key)
+            if stored is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(stored)
+            text = self._entries[stored]
+        self.hit(audio_seconds)
+        return text
+
+    def hit(self, audio_seconds: float = 0.0):
+        """记一次命中（含同一请求内重复的分段）"""
+        with self._lock:
+            self.stats["hits"] += 1
+            self.stats["saved_audio_seconds"] = round(self.stats["saved_audio_seconds"] + audio_seconds, 1)
+
+    def put(self, key: SegmentKey, text: str):
+        with self._lock:
+            self._entries[key] = text
+            self._buckets.setdefault(key.bucket, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                bucket = self._buckets[evicted.bucket]
+                bucket.discard(evicted)
+                if not bucket:
+                    del self._buckets[evicted.bucket]
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def status(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                **self.stats,
+                "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else None,
+            }
@@ -0,0 +1,189 @@
+"""共享权重 - 多个 CPU 推理 worker 进程映射同一份物理内存中的模型权重
+
+SHARED_WEIGHTS=1 时，第一个加载某检查点的进程把全部参数和缓冲区导出为一个 safetensors 文件，
+放在共享内存目录（SHARED_WEIGHTS_DIR，默认 /dev/shm/glm-asr-weights）；之后的进程（fork 或 spawn
+均可）只按配置构建模型骨架，再把文件 mmap 进来，张量直接指向映射页，没有反序列化和拷贝。
+这部分内存在各进程中计为共享页，每个 worker 的 private RSS 只剩激活值和 KV 缓存：
+    SHARED_WEIGHTS=1 gunicorn -k uvicorn.workers.UvicornWorker -w 4 -b 0.0.0.0:7860 main:app
+
+映射为写时复制（MAP_PRIVATE）：推理不写权重，万一某个进程写入，也只改它自己的副本。
+文件名包含检查点、本地检查点的修改时间和 transformers / torch 版本，检查点变化时生成新文件；
+旧文件不会自动删除。只用于 CPU，GPU 上权重在显存中，照常 from_pretrained。
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import struct
+import time
+from pathlib import Path
+
+import torch
+import transformers
+from safetensors.torch import save_file
+from transformers import AutoConfig, AutoModelForSeq2SeqLM, GenerationConfig
+
+try:
+    from transformers.initialization import no_init_weights
+except ImportError:
+    from transformers.modeling_utils import no_init_weights
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIR = '/dev/shm/glm-asr-weights' if os.path.isdir('/dev/shm') else '/tmp/glm-asr-weights'
+
+# safetensors 头中的 dtype 名
+DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "I16": torch.int16, "I8": torch.int8,
+    "U8": torch.uint8, "BOOL": torch.bool,
+}
+
+
+def process_memory() -> dict:
+    """本进程的内存构成（MB），private 即 worker 独占、无法与其他进程共享的部分"""
+    fields = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if value.strip().endswith('kB'):
+                    fields[name] = int(value.split()[0])
+    except OSError:
+        return {}
+    mb = lambda *names: round(sum(fields.get(n, 0) for n in names) / 1024, 1)
+    return {
+        "rss_mb": mb("Rss"),
+        "pss_mb": mb("Pss"),
+        "private_mb": mb("Private_Clean", "Private_Dirty"),
+        "shared_mb": mb("Shared_Clean", "Shared_Dirty"),
+    }
+
+
+def _named_tensors(model):
+    """全部参数和缓冲区（含非持久缓冲区），共享同一张量的名字都列出"""
+    for name, param in model.named_parameters(remove_duplicate=False):
+        yield name, param
+    for name, buffer in model.named_buffers(remove_duplicate=False):
+        if buffer is not None:
+            yield name, buffer
+
+
+def export(model, path: Path):
+    """导出为单个 safetensors 文件；绑定的权重只写一份，其余名字记为别名"""
+    tensors, aliases, owners, pointers = {}, {}, {}, set()
+    for name, tensor in _named_tensors(model):
+        if id(tensor) in owners:
+            aliases[name] = owners[id(tensor)]
+            continue
+        owners[id(tensor)] = name
+        tensor = tensor.detach().contiguous()
+        # 不同张量共用存储（视图）时 safetensors 拒绝写入，复制一份
+        if tensor.numel() and tensor.data_ptr() in pointers:
+            tensor = tensor.clone()
+        pointers.add(tensor.data_ptr())
+        tensors[name] = tensor
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    save_file(tensors, str(tmp), metadata={"aliases": json.dumps(aliases)})
+    os.replace(tmp, path)
+
+
+def map_file(path: Path) -> tuple:
+    """把 safetensors 文件映射为张量（不拷贝），返回 ({名字: 张量}, 别名表)"""
+    with open(path, 'rb') as f:
+        header_size = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    metadata = header.pop("__metadata__", None) or {}
+    storage = torch.UntypedStorage.from_file(str(path), shared=False, nbytes=os.path.getsize(path))
+    base = 8 + header_size
+    tensors = {}
+    for name, info in header.items():
+        start, end = info["data_offsets"]
+        data = torch.empty(0, dtype=torch.uint8).set_(storage, base + start, (end - start,))
+        dtype = DTYPES[info["dtype"]]
+        # safetensors 按对齐要求排列张量，正常不会触发；不对齐时只能复制这一个张量
+        if (base + start) % dtype.itemsize:
+            data = data.clone()
+        tensors[name] = data.view(dtype).view(info["shape"])
+    return tensors, json.loads(metadata.get("aliases", "{}"))
+
+
+def attach(model, tensors: dict, aliases: dict):
+    """把映射出的张量挂到模型骨架上，替换骨架自己分配的全部参数和缓冲区"""
+    names = [name for name, _ in _named_tensors(model)]
+    missing = [name for name in names if name not in tensors and name not in aliases]
+    if missing:
+        raise RuntimeError(f"共享权重文件缺少 {len(missing)} 个张量（如 {missing[0]}），请删除该文件后重新生成")
+    params = {}
+    for name in names:
+        source = aliases.get(name, name)
+        module_name, _, leaf = name.rpartition('.')
+        module = model.get_submodule(module_name)
+        if leaf in module._parameters:
+            # 绑定的权重共用同一个 Parameter 对象
+            if source not in params:
+                params[source] = torch.nn.Parameter(tensors[source], requires_grad=False)
+            module._parameters[leaf] = params[source]
+        else:
+            module._buffers[leaf] = tensors[source]
+
+
+class SharedWeights:
+    """按检查点管理共享权重文件，并记录每个检查点的加载方式和耗时"""
+
+    def __init__(self, enabled: bool = False, directory: str = DEFAULT_DIR):
+        self.enabled = enabled
+        self.directory = Path(directory)
+        self.loaded = {}
+
+    @classmethod
+    def from_env(cls) -> "SharedWeights":
+        return cls(
+            enabled=os.environ.get('SHARED_WEIGHTS', '0') == '1',
+            directory=os.environ.get('SHARED_WEIGHTS_DIR', DEFAULT_DIR),
+        )
+
+    def path_for(self, checkpoint_dir: str) -> Path:
+        local = Path(checkpoint_dir)
+        version = local.stat().st_mtime if local.exists() else ""
+        key = f"{local.resolve() if local.exists() else checkpoint_dir}|{version}|{transformers.__version__}|{torch.__version__}"
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        return self.directory / f"{local.name or 'model'}-{digest}.safetensors"
+
+    def load(self, checkpoint_dir: str):
+        """加载映射共享权重的模型；文件不存在时由本进程导出（其他进程在文件锁上等待）"""
+        start = time.time()
+        path = self.path_for(checkpoint_dir)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        exported = False
+        with open(path.with_name(path.name + '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not path.exists():
+                logger.info(f"导出共享权重: {checkpoint_dir} -> {path}")
+                model = AutoModelForSeq2SeqLM.from_pretrained(checkpoint_dir, dtype="auto")
+                export(model, path)
+                del model
+                exported = True
+
+        config = AutoConfig.from_pretrained(checkpoint_dir)
+        with no_init_weights():
+            model = AutoModelForSeq2SeqLM.from_config(config)
+        attach(model, *map_file(path))
+        try:
+            model.generation_config = GenerationConfig.from_pretrained(checkpoint_dir)
+        except OSError:
+            pass
+        model.eval()
+
+        self.loaded[checkpoint_dir] = {
+            "path": str(path),
+            "size_mb": round(path.stat().st_size / 1024 / 1024, 1),
+            "exported": exported,
+            "load_s": round(time.time() - start, 2),
+        }
+        logger.info(f"已映射共享权重 {path}（{self.loaded[checkpoint_dir]['load_s']}s）")
+        return model
+
+    def status(self) -> dict:
+        return {"enabled": self.enabled, "directory": str(self.directory), "checkpoints": dict(self.loaded)}
@@ -0,0 +1,103 @@
+"""投机解码（辅助生成）- 小草稿模型逐个提出候选 token，主模型一次前向验证整段候选
+
+贪心解码（do_sample=False）下主模型只接受与自己 argmax 一致的前缀，输出与不用草稿模型时逐 token 相同；
+节省的是主模型的前向次数。草稿模型须与主模型共用分词器（词表一致）并接受相同的音频输入，
+例如更小的 GLM-ASR 检查点。transformers 的辅助生成只支持 batch_size = 1。
+
+统计口径：
+    drafted          草稿模型前向次数（每次提出一个候选 token）
+    target_passes    主模型验证次数（每次产出被接受的候选 + 1 个主模型自己的 token）
+    accepted         被接受的候选 token = generated - target_passes
+    tokens_per_pass  每次主模型前向平均产出的 token 数，即理想情况下的加速上限
+"""
+import threading
+
+from transformers.generation.streamers import BaseStreamer
+
+
+def check_draft(model, draft_model):
+    """草稿模型必须与主模型词表一致，否则候选 token 无法直接比较"""
+    vocab = model.config.get_text_config().vocab_size
+    draft_vocab = draft_model.config.get_text_config().vocab_size
+    if vocab != draft_vocab:
+        raise ValueError(f"草稿模型词表大小 {draft_vocab} 与主模型 {vocab} 不一致，无法用于投机解码")
+
+
+def mask_draft_tokens(draft_model, token_ids: list):
+    """禁止草稿模型提出指定 token（音频占位符）
+
+    主模型的第一次验证前向同时带着提示词和音频特征，候选里混入占位符会使占位符数与音频特征对不上；
+    只改草稿模型的 logits，主模型的输出不受影响。
+    """
+    def hook(module, args, output):
+        output.logits[..., token_ids] = float('-inf')
+
+    return draft_model.register_forward_hook(hook)
+
+
+class SpeculationStats:
+    """累计草稿 / 验证计数；attach 后草稿模型每次前向计一个候选 token"""
+
+    def __init__(self):
+        self.drafted = 0
+        self.generated = 0
+        self.target_passes = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def attach(self, draft_model):
+        return draft_model.register_forward_hook(self._on_draft_forward)
+
+    def _on_draft_forward(self, module, args, output):
+        with self._lock:
+            self.drafted += 1
+
+    def streamer(self, inner: BaseStreamer = None) -> "CountingStreamer":
+        with self._lock:
+            self.requests += 1
+        return CountingStreamer(self, inner)
+
+    def _on_pass(self, tokens: int):
+        with self._lock:
+            self.target_passes += 1
+            self.generated += tokens
+
+    def status(self) -> dict:
+        with self._lock:
+            accepted = self.generated - self.target_passes
+            return {
+                "requests": self.requests,
+                "drafted": self.drafted,
+                "accepted": accepted,
+                "acceptance_rate": round(accepted / self.drafted, 4) if self.drafted else None,
+                "generated": self.generated,
+                "target_passes": self.target_passes,
+                "tokens_per_pass": round(self.generated / self.target_passes, 3) if self.target_passes else None,
+            }
+
+
+def prepare_draft(model, draft_model, audio_token_id: int, stats: SpeculationStats):
+    """服务端和 CLI 加载草稿模型后的共同处理：检查词表、屏蔽音频占位符、挂上统计"""
+    check_draft(model, draft_model)
+    mask_draft_tokens(draft_model, [audio_token_id])
+    stats.attach(draft_model)
+
+
+class CountingStreamer(BaseStreamer):
+    """统计主模型每次验证产出的 token 数，并转发给内层 streamer（如 TokenStreamer）"""
+
+    def __init__(self, stats: SpeculationStats, inner: BaseStreamer = None):
+        self.stats = stats
+        self.inner = inner
+        self._prompt_skipped = False
+
+    def put(self, value):
+        if self._prompt_skipped:
+            self.stats._on_pass(value.numel())
+        self._prompt_skipped = True
+        if self.inner is not None:
+            self.inner.put(value)
+
+    def end(self):
+        if self.inner is not None:
+            self.inner.end()
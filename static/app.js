@@ -6,7 +6,8 @@ const i18n = {
         max_tokens: "Max New Tokens", transcribe: "Transcribe", result: "Result",
         copy: "Copy", result_placeholder: "Transcription result will appear here...",
         loaded: "Loaded", unloaded: "Unloaded", processing: "Processing...",
-        copied: "Copied!", error: "Error", file_selected: "Selected: "
+        copied: "Copied!", error: "Error", file_selected: "Selected: ",
+        preparing: "Preparing audio...", uploading: "Uploading "
     },
     "zh-CN": {
         gpu_status: "GPU 状态", model: "模型", memory: "显存", device: "设备",
@@ -15,7 +16,8 @@ const i18n = {
         max_tokens: "最大生成 Token", transcribe: "开始转录", result: "转录结果",
         copy: "复制", result_placeholder: "转录结果将显示在这里...",
         loaded: "已加载", unloaded: "未加载", processing: "处理中...",
-        copied: "已复制!", error: "错误", file_selected: "已选择: "
+        copied: "已复制!", error: "错误", file_selected: "已选择: ",
+        preparing: "正在处理音频...", uploading: "上传中 "
     },
     "zh-TW": {
         gpu_status: "GPU 狀態", model: "模型", memory: "顯存", device: "設備",
@@ -24,7 +26,8 @@ const i18n = {
         max_tokens: "最大生成 Token", transcribe: "開始轉錄", result: "轉錄結果",
         copy: "複製", result_placeholder: "轉錄結果將顯示在這裡...",
         loaded: "已載入", unloaded: "未載入", processing: "處理中...",
-        copied: "已複製!", error: "錯誤", file_selected: "已選擇: "
+        copied: "已複製!", error: "錯誤", file_selected: "已選擇: ",
+        preparing: "正在處理音頻...", uploading: "上傳中 "
     },
     ja: {
         gpu_status: "GPU ステータス", model: "モデル", memory: "メモリ", device: "デバイス",
@@ -33,7 +36,8 @@ const i18n = {
         max_tokens: "最大トークン数", transcribe: "文字起こし", result: "結果",
         copy: "コピー", result_placeholder: "文字起こし結果がここに表示されます...",
         loaded: "読込済", unloaded: "未読込", processing: "処理中...",
-        copied: "コピーしました!", error: "エラー", file_selected: "選択済: "
+        copied: "コピーしました!", error: "エラー", file_selected: "選択済: ",
+        preparing: "音声を準備中...", uploading: "アップロード中 "
     }
 };
 
@@ -91,6 +95,126 @@ function handleFile(file) {
     badge.classList.add('show');
 }
 
+// 浏览器端解码、下混为单声道并重采样到 16kHz，编码为 16-bit PCM 后上传（服务端跳过解码和重采样）
+const TARGET_SAMPLE_RATE = 16000;
+
+async function toPcm16(file) {
+    const AudioCtx = window.AudioContext || window.webkitAudioContext;
+    if (!AudioCtx || !window.OfflineAudioContext) return null;
+    const ctx = new AudioCtx();
+    let decoded;
+    try {
+        decoded = await ctx.decodeAudioData(await file.arrayBuffer());
+    } finally {
+        ctx.close();
+    }
+    const length = Math.ceil(decoded.duration * TARGET_SAMPLE_RATE);
+    if (!length) return null;
+    // 单声道离线渲染：Web Audio 自动完成下混和重采样
+    const offline = new OfflineAudioContext(1, length, TARGET_SAMPLE_RATE);
+    const source = offline.createBufferSource();
+    source.buffer = decoded;
+    source.connect(offline.destination);
+    source.start();
+    const samples = (await offline.startRendering()).getChannelData(0);
+    const pcm = new Int16Array(samples.length);
+    for (let i = 0; i < samples.length; i++) {
+        const s = Math.max(-1, Math.min(1, samples[i]));
+        pcm[i] = s < 0 ? s * 0x8000 : s * 0x7FFF;
+    }
+    const name = file.name.replace(/\.[^.]+$/, '') + '.pcm';
+    return new File([pcm.buffer], name, { type: 'application/octet-stream' });
+}
+
+// 大文件走断点续传：分块上传，失败后按服务端偏移续传，上传未完成时服务端已开始转录
+const RESUMABLE_THRESHOLD = 8 * 1024 * 1024;
+const CHUNK_SIZE = 1024 * 1024;
+
+async function prepareUpload(file) {
+    // 大文件不在浏览器端解码：整段解码后的 PCM 可能耗尽标签页内存，直接续传原文件
+    if (file.size > RESUMABLE_THRESHOLD) return file;
+    try {
+        const pcm = await toPcm16(file);
+        // 已是紧凑编码（如低码率 mp3/ogg）时保留原文件
+        if (pcm && pcm.size < file.size) return pcm;
+    } catch (e) {
+        // 浏览器无法解码的格式交给服务端处理
+        console.warn('client-side decode failed, uploading original file', e);
+    }
+    return file;
+}
+
+// 服务端不支持断点续传（如 Flask 版 app.py）时返回 null，由调用方改走 /api/transcribe
+async function resumableTranscribe(file, maxTokens, onProgress) {
+    const form = new FormData();
+    form.append('filename', file.name);
+    form.append('length', file.size);
+    form.append('max_new_tokens', maxTokens);
+    const res = await fetch('/api/uploads', { method: 'POST', body: form });
+    if (res.status === 404 || res.status === 405) return null;
+    const session = await res.json();
+    if (!res.ok) throw new Error(session.detail || res.statusText);
+    const url = `/api/uploads/${session.upload_id}`;
+
+    const events = new AbortController();
+    const result = readUploadEvents(url, onProgress, events.signal);
+    // 转录先失败时不再继续上传
+    let failed = null;
+    result.catch(e => { failed = e; });
+    let offset = 0, retries = 0;
+    try {
+        while (offset < file.size && !failed) {
+            try {
+                const r = await fetch(url, {
+                    method: 'PATCH',
+                    headers: { 'Upload-Offset': String(offset), 'Content-Type': 'application/offset+octet-stream' },
+                    body: file.slice(offset, offset + CHUNK_SIZE)
+                });
+                if (!r.ok && r.status !== 409) throw new Error(r.statusText);
+                offset = parseInt(r.headers.get('Upload-Offset'), 10);
+                retries = 0;
+            } catch (e) {
+                if (++retries > 5) throw e;
+                await new Promise(resolve => setTimeout(resolve, 1000 * retries));
+                const head = await fetch(url, { method: 'HEAD' }).catch(() => null);
+                if (head && head.ok) offset = parseInt(head.headers.get('Upload-Offset'), 10);
+            }
+        }
+    } catch (e) {
+        // 上传放弃：关闭事件流并删除服务端会话，不留下挂起的读取
+        events.abort();
+        fetch(url, { method: 'DELETE' }).catch(() => {});
+        throw e;
+    }
+    return result;
+}
+
+async function readUploadEvents(url, onProgress, signal) {
+    const res = await fetch(`${url}/events`, { signal });
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    try {
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) throw new Error('connection closed');
+            buffer += decoder.decode(value, { stream: true });
+            const parts = buffer.split('\n\n');
+            buffer = parts.pop();
+            for (const part of parts) {
+                if (!part.startsWith('data: ')) continue;
+                const event = JSON.parse(part.slice(6));
+                if (event.type === 'progress') onProgress(event);
+                else if (event.type === 'done') return { text: event.text };
+                else if (event.type === 'error') throw new Error(event.message);
+                else if (event.type === 'cancelled') throw new Error(event.reason);
+            }
+        }
+    } finally {
+        reader.cancel().catch(() => {});
+    }
+}
+
 function initUpload() {
     const zone = document.getElementById('uploadZone');
     zone.addEventListener('dragover', e => { e.preventDefault(); zone.classList.add('dragover'); });
@@ -109,18 +233,32 @@ async function transcribe() {
     btn.disabled = true;
     progress.classList.add('show');
     progressBar.style.width = '30%';
-    statusMsg.textContent = t('processing');
+    statusMsg.textContent = t('preparing');
     result.textContent = '';
     result.classList.add('empty');
     
+    const upload = await prepareUpload(selectedFile);
+    statusMsg.textContent = t('uploading') + `${(upload.size/1024/1024).toFixed(2)} MB`;
     const formData = new FormData();
-    formData.append('file', selectedFile);
+    formData.append('file', upload);
     formData.append('max_new_tokens', document.getElementById('maxTokens').value);
     
     try {
-        const res = await fetch('/api/transcribe', { method: 'POST', body: formData });
-        progressBar.style.width = '90%';
-        const data = await res.json();
+        let data = null;
+        if (upload.size > RESUMABLE_THRESHOLD) {
+            // 进度条前半段为上传，后半段为已转录的音频占已接收音频的比例
+            data = await resumableTranscribe(upload, document.getElementById('maxTokens').value, p => {
+                const uploaded = p.uploaded / p.upload_total;
+                const transcribed = p.received_seconds ? p.transcribed_seconds / p.received_seconds : 0;
+                progressBar.style.width = `${Math.round(50 * uploaded + 50 * transcribed * uploaded)}%`;
+                statusMsg.textContent = `${t('uploading')}${Math.round(100 * uploaded)}% · ${t('processing')} ${p.transcribed_seconds}s`;
+            });
+        }
+        if (!data) {
+            const res = await fetch('/api/transcribe', { method: 'POST', body: formData });
+            progressBar.style.width = '90%';
+            data = await res.json();
+        }
         progressBar.style.width = '100%';
         
         if (data.error) throw new Error(data.error);
@@ -0,0 +1,105 @@
+import sys
+from pathlib import Path
+
+import pytest
+import torch
+
+# 模块平铺在仓库根目录
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+SPECIAL_TOKENS = ["<|endoftext|>", "<|pad|>", "<|user|>", "<|assistant|>", "<|begin_of_audio|>", "<|end_of_audio|>"]
+CHAT_TEMPLATE = (
+    "{% for m in messages %}<|user|>\n{% for c in m['content'] %}"
+    "{% if c['type'] == 'audio' %}<|begin_of_audio|><|pad|><|end_of_audio|>{% else %}{{ c['text'] }}{% endif %}"
+    "{% endfor %}{% endfor %}{% if add_generation_prompt %}<|assistant|>\n{% endif %}"
+)
+
+
+def make_processor():
+    """词表很小的 GLM-ASR 处理器：字母逐个成词，音频占位符为 <|pad|>"""
+    transformers = pytest.importorskip("transformers")
+    if not hasattr(transformers, "GlmAsrProcessor"):
+        pytest.skip("当前 transformers 不含 GLM-ASR")
+    from tokenizers import Tokenizer, models, pre_tokenizers
+    from inference import WHISPER_FEAT_CFG
+
+    words = [chr(c) for c in range(97, 123)] + ["Please", "transcribe", "this", "audio", "into", "text", "\n", " "]
+    vocab = {word: i for i, word in enumerate(SPECIAL_TOKENS + words)}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="<|endoftext|>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Split(pattern=" ", behavior="isolated")
+    fast = transformers.PreTrainedTokenizerFast(tokenizer_object=tokenizer, pad_token="<|endoftext|>",
+                                                eos_token="<|endoftext|>")
+    fast.add_special_tokens({"additional_special_tokens": SPECIAL_TOKENS})
+    feature_extractor = transformers.WhisperFeatureExtractor(**WHISPER_FEAT_CFG)
+    return transformers.GlmAsrProcessor(feature_extractor, fast, chat_template=CHAT_TEMPLATE)
+
+
+def make_model(processor, seed: int = 0, layers: int = 1):
+    """随机初始化的小模型；不设结束符，每段都生成到 max_new_tokens"""
+    from transformers import GlmAsrConfig, GlmAsrForConditionalGeneration
+
+    config = GlmAsrConfig(
+        audio_config=dict(hidden_size=32, intermediate_size=64, num_hidden_layers=1, num_attention_heads=2,
+                          num_mel_bins=128),
+        text_config=dict(model_type="llama", hidden_size=32, intermediate_size=64, num_hidden_layers=layers,
+                         num_attention_heads=2, num_key_value_heads=2, vocab_size=len(processor.tokenizer),
+                         max_position_embeddings=8192),
+        audio_token_id=processor.audio_token_id,
+    )
+    torch.manual_seed(seed)
+    model = GlmAsrForConditionalGeneration(config).eval()
+    # 只输出单字母词：解码后的文本非空，且随音频内容变化
+    letters = processor.tokenizer.convert_tokens_to_ids([chr(c) for c in range(97, 123)])
+    head = model.get_output_embeddings().weight
+    with torch.no_grad():
+        mask = torch.zeros(head.shape[0], 1)
+        mask[letters] = 1.0
+        head.mul_(mask * 10)
+    model.generation_config.eos_token_id = None
+    model.generation_config.pad_token_id = 0
+    return model
+
+
+@pytest.fixture
+def manager():
+    """挂上小模型的 gpu_manager，测试结束后恢复"""
+    from gpu_manager import GPUManager
+    from mel_frontend import LogMelFrontend
+    from segment_cache import SegmentCache
+
+    mgr = GPUManager()
+    saved = dict(mgr.__dict__)
+    mgr.processor = make_processor()
+    mgr.frontend = LogMelFrontend.from_feature_extractor(mgr.processor.feature_extractor)
+    mgr.model = make_model(mgr.processor)
+    mgr._prompt_template = None
+    mgr.draft_model = None
+    mgr.segment_cache = SegmentCache(0)
+    yield mgr
+    mgr.__dict__.clear()
+    mgr.__dict__.update(saved)
+
+
+def energy_vad(wav: torch.Tensor, sr: int = 16000) -> list:
+    """代替 silero-vad 的能量检测：10ms 帧，振幅超过阈值即为语音"""
+    if wav.dim() == 2:
+        wav = wav[0]
+    frame = sr // 100
+    active = wav[:wav.shape[0] // frame * frame].reshape(-1, frame).abs().amax(dim=1) > 0.05
+    segments, start = [], None
+    for i, on in enumerate(active.tolist() + [False]):
+        if on and start is None:
+            start = i
+        elif not on and start is not None:
+            segments.append((start * frame, i * frame))
+            start = None
+    return segments
+
+
+@pytest.fixture
+def fake_vad(monkeypatch):
+    """用能量检测替换 silero-vad，测试不依赖模型下载"""
+    import vad_segmenter
+
+    monkeypatch.setattr(vad_segmenter, "detect_speech_segments", energy_vad)
+    return energy_vad
@@ -0,0 +1,98 @@
+"""准入控制：队列深度和排队音频时长上限、基于实时率的 Retry-After、票据释放"""
+import os
+from pathlib import Path
+
+import pytest
+
+from admission import AdmissionController, QueueFull
+from gpu_manager import CANCEL_REQUEST, CancellationToken, TranscriptionCancelled
+
+
+def test_depth_limit_and_release():
+    controller = AdmissionController(max_depth=2, max_audio_seconds=0)
+    first, second = controller.admit(10), controller.admit(10)
+    with pytest.raises(QueueFull):
+        controller.check()
+    with pytest.raises(QueueFull):
+        controller.admit(1)
+    assert controller.status()["saturated"]
+
+    first.release()
+    first.release()
+    controller.check()
+    assert controller.status()["depth"] == 1
+    second.release()
+    assert controller.status()["depth"] == 0
+    assert controller.status()["rejected"] == 2
+
+
+def test_queued_audio_limit():
+    controller = AdmissionController(max_depth=0, max_audio_seconds=100)
+    # 队列为空时单个超长请求也放行
+    with controller.admit(500):
+        pass
+    ticket = controller.admit(60)
+    with pytest.raises(QueueFull) as excinfo:
+        controller.admit(50)
+    assert "时长" in str(excinfo.value)
+    controller.admit(40).release()
+    ticket.release()
+    assert controller.status()["queued_audio_seconds"] == 0
+
+
+def test_retry_after_follows_rtf_ewma():
+    controller = AdmissionController(max_depth=1, max_audio_seconds=0, initial_rtf=0.125, ewma_alpha=0.5)
+    controller.observe(100, 37.5)
+    assert controller.rtf == 0.25
+    controller.observe(0, 10)
+    assert controller.rtf == 0.25
+
+    ticket = controller.admit(100)
+    with pytest.raises(QueueFull) as excinfo:
+        controller.admit(1)
+    # 空出一个位置 ≈ 平均每个请求的音频时长 × 实时率
+    assert excinfo.value.retry_after == 25
+    assert controller.status()["estimated_wait_s"] == 25.0
+    ticket.release()
+
+
+def test_ticket_released_on_error_and_cancel():
+    from inference_core import InferenceTask
+
+    controller = AdmissionController(max_depth=2)
+
+    def fail(task):
+        raise RuntimeError("boom")
+
+    failed = InferenceTask(fail, "failed", CancellationToken(), controller.admit(5))
+    failed.run()
+    with pytest.raises(RuntimeError):
+        failed.result(timeout=1)
+
+    cancelled = InferenceTask(lambda task: None, "cancelled", CancellationToken(), controller.admit(5))
+    cancelled.cancel(CANCEL_REQUEST)
+    with pytest.raises(TranscriptionCancelled):
+        cancelled.result(timeout=1)
+
+    assert controller.status()["depth"] == 0
+    assert controller.status()["queued_audio_seconds"] == 0
+
+
+def test_http_429_with_retry_after(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    # main 按相对路径挂载 static 目录
+    monkeypatch.chdir(Path(__file__).resolve().parent.parent)
+    import main
+
+    controller = AdmissionController(max_depth=1, initial_rtf=0.5)
+    monkeypatch.setattr(main.gpu_manager, "admission", controller)
+    ticket = controller.admit(20)
+    try:
+        response = TestClient(main.app).post("/api/transcribe", files={"file": ("a.wav", b"RIFF", "audio/wav")})
+    finally:
+        ticket.release()
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "10"
+    assert controller.status()["rejected"] == 1
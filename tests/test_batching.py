@@ -0,0 +1,71 @@
+"""长音频分段组批：显存不足时拆批重试，结果与 token 流都不变"""
+import torch
+
+from batching import PROMPT_TOKENS, SR, AdaptiveBatcher
+from gpu_manager import GPUManager
+
+
+def _samples(count: int = 4, seconds: float = 3.0):
+    generator = torch.Generator().manual_seed(0)
+    return [[0.3 * torch.randn(int(seconds * 16000), generator=generator)] for _ in range(count)]
+
+
+def _run(manager, batcher, samples, max_new_tokens: int = 6, generate_batch=None):
+    manager.batcher = batcher
+    batcher.configure(manager.model.config, manager.model.dtype)
+    if generate_batch is not None:
+        manager._generate_batch = generate_batch
+    texts, tokens = {}, {}
+    request_state = {"started": 0.0, "first_token_sent": False}
+    manager._generate_samples(samples, [max_new_tokens] * len(samples), list(range(len(samples))), request_state,
+                              lambda index, text: tokens.setdefault(index, []).append(text),
+                              on_result=lambda i, text: texts.__setitem__(i, text))
+    return [texts[i] for i in range(len(samples))], {i: ''.join(parts) for i, parts in tokens.items()}
+
+
+def test_simulated_memory_limit_splits_batch_without_changing_output(manager):
+    samples = _samples()
+    expected, _ = _run(manager, AdaptiveBatcher(max_batch=1), samples)
+
+    reference = AdaptiveBatcher(max_batch=4)
+    reference.configure(manager.model.config, manager.model.dtype)
+    length = reference.sequence_tokens([samples[0][0].shape[0]], 6)
+    # 上限只够两个样本：四个样本的批模拟 OOM，拆成两批
+    limit_mb = reference.estimate([length] * 2) / 2**20
+    batcher = AdaptiveBatcher(max_batch=4, simulated_limit_mb=limit_mb)
+    texts, tokens = _run(manager, batcher, samples)
+
+    assert batcher.stats["oom_retries"] >= 1
+    assert batcher.stats["largest_batch"] == 2
+    assert texts == expected
+    assert [tokens[i + 1].strip() for i in range(len(samples))] == expected
+
+
+def test_oom_after_partial_stream_does_not_repeat_tokens(manager):
+    samples = _samples()
+    expected, _ = _run(manager, AdaptiveBatcher(max_batch=1), samples)
+
+    generate_batch = manager._generate_batch
+    failed = []
+
+    def oom_midway(batch, lengths, max_new_tokens, streamer=None, *args):
+        # 第一次整批生成：先流式输出一部分 token 再显存不足
+        if len(batch) > 1 and not failed:
+            failed.append(len(batch))
+            generate_batch(batch, lengths, 2, streamer, *args)
+            raise torch.cuda.OutOfMemoryError("CUDA out of memory")
+        return generate_batch(batch, lengths, max_new_tokens, streamer, *args)
+
+    texts, tokens = _run(manager, AdaptiveBatcher(max_batch=4), samples, generate_batch=oom_midway)
+
+    assert failed == [4]
+    assert texts == expected
+    assert [tokens[i + 1].strip() for i in range(len(samples))] == expected
+
+
+
+def test_window_tokens_match_batcher_estimate():
+    # 长上下文分组和显存估算使用同一个合并倍数
+    frames = [100, 1001, 2500, 3000]
+    estimated = [AdaptiveBatcher.sequence_tokens([n * SR // 100], 0) - PROMPT_TOKENS for n in frames]
+    assert GPUManager._window_tokens(torch.tensor(frames)).tolist() == estimated
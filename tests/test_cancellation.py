@@ -0,0 +1,64 @@
+"""协作式取消：生成中取消、截止时间、排队中取消，以及按原因统计"""
+import time
+
+import pytest
+import torch
+
+from gpu_manager import CANCEL_REQUEST, CLIENT_DISCONNECT, DEADLINE, CancellationToken, TranscriptionCancelled
+
+
+def _speech(seconds: float = 3.0):
+    generator = torch.Generator().manual_seed(0)
+    return 0.3 * torch.randn(int(seconds * 16000), generator=generator)
+
+
+def _cancelled_count(manager, reason: str) -> int:
+    return manager.metrics["cancelled_by_reason"].get(reason, 0)
+
+
+def test_cancel_from_token_callback_stops_generation(manager):
+    token = CancellationToken()
+    deltas = []
+
+    def on_token(index, text):
+        deltas.append(text)
+        if len(deltas) == 2:
+            token.cancel(CANCEL_REQUEST)
+
+    before = _cancelled_count(manager, CANCEL_REQUEST)
+    with pytest.raises(TranscriptionCancelled) as excinfo:
+        manager.transcribe(_speech(), 64, token_callback=on_token, cancel_token=token)
+
+    assert excinfo.value.reason == CANCEL_REQUEST
+    # 在下一个 token 处停止，远未生成到上限
+    assert 2 <= len(deltas) <= 3
+    assert _cancelled_count(manager, CANCEL_REQUEST) == before + 1
+
+
+def test_deadline_expires_during_generation(manager):
+    token = CancellationToken(deadline_s=60)
+
+    def on_token(index, text):
+        token.deadline = time.monotonic()
+
+    before = _cancelled_count(manager, DEADLINE)
+    with pytest.raises(TranscriptionCancelled) as excinfo:
+        manager.transcribe(_speech(), 64, token_callback=on_token, cancel_token=token)
+
+    assert excinfo.value.reason == DEADLINE
+    assert token.reason == DEADLINE
+    assert _cancelled_count(manager, DEADLINE) == before + 1
+
+
+def test_cancel_before_start_skips_model(manager):
+    from inference_core import InferenceTask
+
+    calls = []
+    task = InferenceTask(lambda task: calls.append(task), "job", CancellationToken())
+    task.cancel(CLIENT_DISCONNECT)
+    task.run()
+
+    assert calls == []
+    with pytest.raises(TranscriptionCancelled):
+        task.result(timeout=1)
+    assert [event["type"] for event in task.events()] == ["start", "cancelled"]
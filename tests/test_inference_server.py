@@ -0,0 +1,41 @@
+"""推理进程代理：经共享内存 + UNIX socket 转录的结果与本进程一致"""
+import threading
+
+import pytest
+import torch
+
+from inference_server import InferenceServer, RemoteGPUManager
+
+
+@pytest.fixture
+def remote(manager, tmp_path):
+    server = InferenceServer(str(tmp_path / "inference.sock"), manager, "tiny")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield RemoteGPUManager(server.server_address)
+    server.shutdown()
+    server.server_close()
+
+
+def test_batch_forwarded_as_one_request(manager, remote, tmp_path):
+    torch.manual_seed(0)
+    wavs = [torch.randn(16000 * seconds) * 0.1 for seconds in (1, 2, 3)]
+    paths = []
+    for k, wav in enumerate(wavs):
+        path = tmp_path / f"{k}.pcm"
+        (wav.clamp(-1, 1) * 32767).to(torch.int16).numpy().tofile(path)
+        paths.append(str(path))
+    paths.insert(1, str(tmp_path / "missing.wav"))
+
+    calls = []
+    transcribe_batch = manager.transcribe_batch
+    manager.transcribe_batch = lambda audio, *args: calls.append(len(audio)) or transcribe_batch(audio, *args)
+
+    results = remote.transcribe_batch(paths, max_new_tokens=4)
+    expected = transcribe_batch([p for p in paths if "missing" not in p], 4)
+
+    assert calls == [3]
+    assert [r["path"] for r in results] == paths
+    assert results[1]["status"] == "error"
+    assert [r["text"] for r in results if r["status"] == "success"] == [r["text"] for r in expected]
+    assert remote.transcribe(paths[0], max_new_tokens=4) == expected[0]["text"]
+    assert remote.model is True
@@ -0,0 +1,78 @@
+"""长任务断点：中断后重建 JobStore 只转录未完成的分组，已结束任务按保留时间清理"""
+import json
+import os
+import time
+
+import pytest
+import torch
+
+import gpu_manager as gpu_manager_module
+import job_store as job_store_module
+from job_store import JobStore
+
+SR = 16000
+
+
+class Crash(Exception):
+    pass
+
+
+@pytest.fixture
+def long_manager(manager, fake_vad):
+    manager.segment_max_s, manager.segment_min_s = 2.0, 0.5
+    return manager
+
+
+def speech_audio() -> torch.Tensor:
+    torch.manual_seed(0)
+    wav = torch.zeros(1, 10 * SR)
+    for second in (1, 3, 5, 7):
+        wav[0, second * SR:(second + 1) * SR] = torch.randn(SR).clamp(-1, 1) * 0.5
+    return wav
+
+
+def test_resume_transcribes_only_remaining_groups(long_manager, tmp_path, monkeypatch):
+    monkeypatch.setattr(gpu_manager_module, "job_store", JobStore(str(tmp_path)))
+
+    def crash_on_first_result(current, total, duration, text):
+        if text is not None:
+            raise Crash()
+
+    with pytest.raises(Crash):
+        long_manager.transcribe(speech_audio(), 4, crash_on_first_result, job_id="job1")
+
+    # 进程重启：新的 JobStore 从磁盘读取断点
+    store = JobStore(str(tmp_path))
+    monkeypatch.setattr(gpu_manager_module, "job_store", store)
+    [checkpoint] = store.pending()
+    total = len(checkpoint.plan["groups"])
+    done = dict(checkpoint.results)
+    assert total == 4 and len(done) == 1
+
+    generated = []
+    generate_samples = long_manager._generate_samples
+    long_manager._generate_samples = lambda samples, max_tokens, pending, *args: (
+        generated.extend(pending), generate_samples(samples, max_tokens, pending, *args))[1]
+    text = long_manager.transcribe(checkpoint.audio_path, 4, job_id="job1")
+
+    assert sorted(generated) == [i for i in range(total) if i not in done]
+    progress = store.get("job1").progress()
+    assert progress["status"] == "done" and progress["completed"] == total
+    assert text == progress["text"] == ''.join(store.get("job1").texts())
+    # 重启前的结果原样沿用
+    assert all(store.get("job1").results[i] == t for i, t in done.items())
+    assert not os.path.exists(checkpoint.audio_path)
+    assert store.pending() == []
+
+
+def test_expire_removes_only_old_finished_jobs(tmp_path, monkeypatch):
+    store = JobStore(str(tmp_path))
+    for job_id, status, age in [("old", "done", 10), ("recent", "cancelled", 1), ("running", "running", 10)]:
+        os.makedirs(tmp_path / job_id)
+        with open(tmp_path / job_id / "meta.json", "w") as f:
+            json.dump({"job_id": job_id, "status": status, "finished": time.time() - age}, f)
+    monkeypatch.setattr(job_store_module, "JOB_TTL_S", 5)
+
+    store.expire()
+    assert sorted(os.listdir(tmp_path)) == ["recent", "running"]
+    assert store.get("old") is None and store.get("running").status == "running"
@@ -0,0 +1,6 @@
+"""torch STFT log-mel 前端与 HF WhisperFeatureExtractor 对齐"""
+from mel_frontend import check_against_reference
+
+
+def test_matches_whisper_feature_extractor():
+    assert check_against_reference(device="cpu") <= 1e-3
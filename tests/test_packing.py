@@ -0,0 +1,58 @@
+"""语音紧凑打包：去掉长静音、超长语音切分、打包位置映射回原始时间"""
+import torch
+
+from vad_segmenter import build_packed_audio, pack_speech_segments, packed_segment, packed_to_original
+
+SR = 16000
+
+
+def test_gaps_removed_and_windows_filled():
+    speech = [(0, 2 * SR), (10 * SR, 13 * SR), (30 * SR, 31 * SR)]
+    windows = pack_speech_segments(speech, SR, max_duration=10.0, gap_duration=0.5)
+
+    assert len(windows) == 1
+    gap = SR // 2
+    assert windows[0]["spans"] == [(0, 2 * SR, 0), (10 * SR, 13 * SR, 2 * SR + gap),
+                                   (30 * SR, 31 * SR, 5 * SR + 2 * gap)]
+    assert windows[0]["length"] == 6 * SR + 2 * gap
+
+
+def test_long_speech_split_across_windows():
+    speech = [(SR, 24 * SR), (30 * SR, 33 * SR)]
+    windows = pack_speech_segments(speech, SR, max_duration=10.0, gap_duration=0.2)
+
+    assert [w["spans"] for w in windows] == [
+        [(SR, 11 * SR, 0)],
+        [(11 * SR, 21 * SR, 0)],
+        [(21 * SR, 24 * SR, 0), (30 * SR, 33 * SR, 3 * SR + SR // 5)],
+    ]
+    assert all(w["length"] <= 10 * SR for w in windows)
+    # 语音一个采样都不丢
+    assert sum(end - start for w in windows for start, end, _ in w["spans"]) == 26 * SR
+
+
+def test_boundary_mapping():
+    window = {"spans": [(100, 200, 0), (500, 600, 150)], "length": 250}
+
+    assert packed_to_original(window, 0) == 100
+    assert packed_to_original(window, 99) == 199
+    # 落在插入的静音里时取下一段语音的起点
+    assert packed_to_original(window, 100) == 500
+    assert packed_to_original(window, 149) == 500
+    assert packed_to_original(window, 150) == 500
+    assert packed_to_original(window, 249) == 599
+    assert packed_to_original(window, 250) == 600
+
+
+def test_packed_audio_matches_original(fake_vad):
+    wav = torch.zeros(20 * SR)
+    wav[SR:3 * SR] = 0.5
+    wav[12 * SR:14 * SR] = -0.5
+    windows = packed_segment(wav, SR, max_duration=25.0, gap_duration=0.2)
+
+    assert len(windows) == 1
+    packed = build_packed_audio(wav, windows[0])
+    assert packed.shape[0] == 4 * SR + SR // 5
+    for start, end, offset in windows[0]["spans"]:
+        assert torch.equal(packed[offset:offset + end - start], wav[start:end])
+        assert packed_to_original(windows[0], offset) == start
@@ -0,0 +1,84 @@
+"""质量档位：负载升高立即降档，回落后按 recover_s 逐档恢复，status 只读"""
+import types
+
+import pytest
+
+import quality
+from quality import QualityPolicy
+
+
+class FakeAdmission:
+    def __init__(self):
+        self.depth = 0
+
+    def status(self) -> dict:
+        return {"depth": self.depth, "max_depth": 10, "estimated_wait_s": 0.0}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(quality, "time", types.SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def test_load_steps_down_immediately(clock):
+    admission = FakeAdmission()
+    policy = QualityPolicy(admission, default='auto', thresholds=(0.5, 0.8), recover_s=30)
+
+    assert policy.select() == 'full'
+    admission.depth = 5
+    assert policy.select() == 'reduced'
+    admission.depth = 9
+    assert policy.select() == 'economy'
+    # 显式指定的档位不受负载影响
+    assert policy.select('full') == 'full'
+    assert policy.requests == {'full': 2, 'reduced': 1, 'economy': 1}
+    assert policy.changes == 2
+
+
+def test_recovery_waits_and_steps_one_tier(clock):
+    admission = FakeAdmission()
+    policy = QualityPolicy(admission, default='auto', thresholds=(0.5, 0.8), recover_s=30)
+    admission.depth = 9
+    assert policy.select() == 'economy'
+
+    # 负载回落但未持续 recover_s：保持当前档位
+    admission.depth = 0
+    clock[0] += 29
+    assert policy.select() == 'economy'
+    # 负载在阈值附近波动时重新计时
+    admission.depth = 8
+    assert policy.select() == 'economy'
+    admission.depth = 0
+    clock[0] += 29
+    assert policy.select() == 'economy'
+    clock[0] += 1
+    assert policy.select() == 'reduced'
+    clock[0] += 30
+    assert policy.select() == 'full'
+
+
+def test_long_idle_recovers_several_tiers(clock):
+    admission = FakeAdmission()
+    policy = QualityPolicy(admission, default='auto', thresholds=(0.5, 0.8), recover_s=30)
+    admission.depth = 9
+    policy.select()
+    admission.depth = 6
+    clock[0] += 90
+    # 负载仍在 reduced 阈值之上时最多恢复到 reduced
+    assert policy.select() == 'reduced'
+
+
+def test_status_does_not_change_tier(clock):
+    admission = FakeAdmission()
+    policy = QualityPolicy(admission, default='auto', thresholds=(0.5, 0.8), recover_s=30)
+    admission.depth = 9
+    policy.select()
+    admission.depth = 0
+    clock[0] += 120
+
+    status = policy.status()
+    assert status["tier"] == 'economy' and status["load"] == 0.0
+    assert policy.level == 2 and policy.changes == 1
+    assert policy.select() == 'full'
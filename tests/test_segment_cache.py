@@ -0,0 +1,87 @@
+"""分段缓存指纹：重新编码、首尾静音不同仍命中，不同内容不冲突"""
+import math
+
+import torch
+
+from segment_cache import SegmentCache, fingerprint
+
+SR = 16000
+
+
+def _utterance(seed: int, amplitude: float = 0.3, syllables: int = 8, pause: float = 0.4):
+    """合成的“语音”：音高、共振峰随机的音节，第 4 个音节后停顿 pause 秒"""
+    generator = torch.Generator().manual_seed(seed)
+    rand = lambda: torch.rand(1, generator=generator).item()
+    parts = []
+    for k in range(syllables):
+        n = int(SR * (0.15 + 0.15 * rand()))
+        t = torch.arange(n) / SR
+        f0, formant = 100 + 150 * rand(), 300 + 2500 * rand()
+        x = sum(math.exp(-((h * f0 - formant) / 600) ** 2) * torch.sin(2 * math.pi * h * f0 * t)
+                for h in range(1, int(4000 / f0)))
+        x = x * torch.hann_window(n)
+        parts += [x / x.abs().max(), torch.zeros(int(SR * (pause if k == 3 else 0.04 + 0.04 * rand())))]
+    return amplitude * torch.cat(parts[:-1])
+
+
+def _reencode(wav, lead: int, trail: int, seed: int = 0):
+    """换一种首尾静音，加 -50dB 噪声后按 16-bit 量化"""
+    generator = torch.Generator().manual_seed(seed)
+    wav = torch.cat([torch.zeros(lead), wav, torch.zeros(trail)])
+    wav = wav + torch.randn(wav.shape[0], generator=generator) * wav.abs().max() * 10 ** (-50 / 20)
+    return (wav * 32767).round().clamp(-32768, 32767) / 32768
+
+
+def test_reencoded_audio_with_different_silence_hits():
+    cache = SegmentCache(8)
+    speech = _utterance(0)
+    cache.put(fingerprint([speech], 128), "hello")
+
+    for lead, trail in [(0, 0), (37, 1201), (4000, 80), (96, 0)]:
+        assert cache.get(fingerprint([_reencode(speech, lead, trail, seed=lead)], 128)) == "hello"
+    # 语音段之间的停顿长短不同
+    assert cache.get(fingerprint([_utterance(0, pause=0.7)], 128)) == "hello"
+    assert cache.status()["hits"] == 5
+
+
+def test_different_utterances_miss():
+    cache = SegmentCache(8)
+    cache.put(fingerprint([_utterance(0)], 128), "hello")
+    for seed in range(1, 6):
+        assert cache.get(fingerprint([_utterance(seed)], 128)) is None
+
+
+def test_quiet_recordings_do_not_collide():
+    # 指纹取相对峰值的 dB：音量很低的不同内容互不命中，同一内容与音量无关
+    first, second = _utterance(0, 1e-4), _utterance(1, 1e-4)
+    assert not fingerprint([first], 128).matches(fingerprint([second], 128))
+    assert fingerprint([first], 128).matches(fingerprint([_utterance(0)], 128))
+
+
+def test_key_covers_windows_and_token_limit():
+    speech = _utterance(0)
+    assert not fingerprint([speech], 128).matches(fingerprint([speech], 256))
+    assert not fingerprint([speech], 128).matches(fingerprint([speech[:SR], speech[SR:]], 128))
+
+
+def test_repeated_segments_skip_generation(manager):
+    manager.segment_cache = SegmentCache(16)
+    generated = []
+    generate_batch = manager._generate_batch
+    manager._generate_batch = lambda samples, *args: generated.append(len(samples)) or generate_batch(samples, *args)
+
+    def run(samples):
+        texts = {}
+        manager._generate_samples(samples, [4] * len(samples), list(range(len(samples))),
+                                  {"started": 0.0, "first_token_sent": False},
+                                  on_result=lambda i, text: texts.__setitem__(i, text))
+        return texts
+
+    prompt, caller = _utterance(0), _utterance(1)
+    texts = run([[prompt], [caller], [_reencode(prompt, 160, 800)]])
+    assert sum(generated) == 2
+    assert texts[2] == texts[0]
+
+    # 之后的请求里重复出现的提示音直接命中缓存
+    assert run([[_reencode(prompt, 3000, 0, seed=1)]]) == {0: texts[0]}
+    assert sum(generated) == 2
@@ -0,0 +1,72 @@
+"""共享权重：导出后挂到另一个模型骨架上，输出不变，全部张量指向文件映射"""
+import os
+
+import pytest
+import torch
+
+from conftest import make_model, make_processor
+
+
+def _file_mappings(path) -> list:
+    """本进程中映射该文件的地址区间"""
+    ranges = []
+    with open('/proc/self/maps') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) >= 6 and os.path.realpath(fields[5]) == os.path.realpath(path):
+                start, end = (int(x, 16) for x in fields[0].split('-'))
+                ranges.append((start, end))
+    return ranges
+
+
+def _logits(model, processor):
+    torch.manual_seed(0)
+    features = torch.randn(1, 128, 400)
+    ids = torch.tensor([[2, 4] + [processor.audio_token_id] * 50 + [5, 3]])
+    with torch.no_grad():
+        return model(input_ids=ids, input_features=features,
+                     input_features_mask=torch.ones(1, 400, dtype=torch.long)).logits
+
+
+def test_attach_maps_weights_from_file(tmp_path):
+    if not os.path.exists('/proc/self/maps'):
+        pytest.skip("需要 /proc/self/maps")
+    from shared_weights import attach, export, map_file
+
+    processor = make_processor()
+    source, target = make_model(processor, seed=0), make_model(processor, seed=1)
+    path = tmp_path / "tiny.safetensors"
+    export(source, path)
+    assert not torch.equal(_logits(source, processor), _logits(target, processor))
+
+    attach(target, *map_file(path))
+    assert torch.equal(_logits(source, processor), _logits(target, processor))
+
+    mappings = _file_mappings(path)
+    assert mappings
+    tensors = list(target.parameters()) + [b for b in target.buffers() if b.numel()]
+    for tensor in tensors:
+        assert any(start <= tensor.data_ptr() < end for start, end in mappings)
+
+
+def test_second_load_reuses_exported_file(tmp_path):
+    from shared_weights import SharedWeights
+
+    processor = make_processor()
+    model = make_model(processor)
+    checkpoint = tmp_path / "tiny"
+    model.save_pretrained(checkpoint)
+
+    shared = SharedWeights(enabled=True, directory=str(tmp_path / "shm"))
+    first = shared.load(str(checkpoint))
+    assert shared.loaded[str(checkpoint)]["exported"]
+    second = shared.load(str(checkpoint))
+    assert not shared.loaded[str(checkpoint)]["exported"]
+
+    expected = _logits(model, processor)
+    assert torch.equal(_logits(first, processor), expected)
+    assert torch.equal(_logits(second, processor), expected)
+    # 两次加载都映射同一个文件
+    mappings = _file_mappings(shared.loaded[str(checkpoint)]["path"])
+    for loaded in (first, second):
+        assert all(any(start <= p.data_ptr() < end for start, end in mappings) for p in loaded.parameters())
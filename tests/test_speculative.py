@@ -0,0 +1,53 @@
+"""投机解码：随机初始化的小草稿模型不改变贪心解码的输出"""
+import torch
+
+from conftest import make_model
+from speculative import SpeculationStats, prepare_draft
+
+
+def _transcribe(manager, samples, max_new_tokens: int = 12):
+    texts, tokens = {}, {}
+    request_state = {"started": 0.0, "first_token_sent": False}
+    manager._generate_samples(samples, [max_new_tokens] * len(samples), list(range(len(samples))), request_state,
+                              lambda index, text: tokens.setdefault(index, []).append(text),
+                              on_result=lambda i, text: texts.__setitem__(i, text))
+    return [texts[i] for i in range(len(samples))], [''.join(tokens[i + 1]) for i in range(len(samples))]
+
+
+def test_random_draft_matches_greedy(manager):
+    generator = torch.Generator().manual_seed(0)
+    samples = [[0.3 * torch.randn(int(seconds * 16000), generator=generator)] for seconds in (2.0, 4.5, 7.0)]
+    expected, expected_tokens = _transcribe(manager, samples)
+
+    stats = SpeculationStats()
+    draft = make_model(manager.processor, seed=1)
+    prepare_draft(manager.model, draft, manager.processor.audio_token_id, stats)
+    manager.draft_model, manager.speculation = draft, stats
+    texts, tokens = _transcribe(manager, samples)
+
+    assert all(expected)
+    assert texts == expected
+    assert tokens == expected_tokens
+    report = stats.status()
+    assert report["requests"] == len(samples)
+    assert report["drafted"] > 0
+    assert report["generated"] == sum(12 for _ in samples)
+
+
+def test_draft_never_proposes_audio_placeholder(manager):
+    # 草稿模型偏向输出音频占位符：不屏蔽时主模型验证前向的占位符数与音频特征对不上
+    generator = torch.Generator().manual_seed(0)
+    samples = [[0.3 * torch.randn(3 * 16000, generator=generator)]]
+    expected, _ = _transcribe(manager, samples)
+
+    audio_token_id = manager.processor.audio_token_id
+    draft = make_model(manager.processor, seed=2)
+
+    def prefer_placeholder(module, args, output):
+        output.logits[..., audio_token_id] = 1e4
+
+    draft.register_forward_hook(prefer_placeholder)
+    prepare_draft(manager.model, draft, audio_token_id, SpeculationStats())
+    manager.draft_model = draft
+
+    assert _transcribe(manager, samples)[0] == expected
@@ -0,0 +1,106 @@
+"""流量录制 - 记录线上请求的到达时间、端点、参数和音频时长，供 replay.py 回放做容量规划
+
+默认关闭，设置 TRAFFIC_LOG_DIR 后启用：
+    TRAFFIC_LOG_DIR=/data/traffic         录制目录，每个请求一行写入 traffic.jsonl
+    TRAFFIC_SAMPLE_RATE=0.1               采样率（0~1），默认全部记录
+    TRAFFIC_RECORD_AUDIO=1                同时保存音频到 audio/ 子目录，默认只记时长
+
+main.py 和 app.py 的中间件在请求开始时 start、结束时 finish；处理函数通过 annotate
+补充音频和参数（未被采样的请求上 annotate 不做任何事）。
+"""
+import contextvars
+import json
+import os
+import random
+import shutil
+import threading
+import time
+import uuid
+import logging
+
+from gpu_manager import gpu_manager
+
+logger = logging.getLogger(__name__)
+
+# 录制的端点（上传分块、状态查询等不计入流量）
+RECORDED_PATHS = {'/api/transcribe', '/api/transcribe/long', '/api/transcribe/stream', '/api/uploads', '/api/stream'}
+
+_current = contextvars.ContextVar('traffic_entry', default=None)
+
+
+class TrafficRecorder:
+    """按采样率把请求元数据追加到 traffic.jsonl"""
+
+    def __init__(self, root: str = '', sample_rate: float = 1.0, record_audio: bool = False):
+        self.root = root
+        self.sample_rate = sample_rate
+        self.record_audio = record_audio
+        self.recorded = 0
+        self._lock = threading.Lock()
+        if root:
+            os.makedirs(os.path.join(root, 'audio') if record_audio else root, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> "TrafficRecorder":
+        return cls(
+            root=os.environ.get('TRAFFIC_LOG_DIR', ''),
+            sample_rate=float(os.environ.get('TRAFFIC_SAMPLE_RATE', 1.0)),
+            record_audio=os.environ.get('TRAFFIC_RECORD_AUDIO', '0').lower() in ('1', 'true', 'yes'),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.root) and self.sample_rate > 0
+
+    @property
+    def log_path(self) -> str:
+        return os.path.join(self.root, 'traffic.jsonl')
+
+    def start(self, endpoint: str) -> dict:
+        """请求到达：按采样率决定是否录制，返回本次记录（未采样时为 None）"""
+        if not self.enabled or random.random() >= self.sample_rate:
+            # 清除从之前被采样的请求继承的上下文，annotate 不会写入别人的记录
+            _current.set(None)
+            return None
+        entry = {"ts": round(time.time(), 3), "endpoint": endpoint, "params": {}, "duration": None,
+                 "audio": None, "queue_depth": gpu_manager.admission.status()["depth"],
+                 "_started": time.perf_counter()}
+        _current.set(entry)
+        return entry
+
+    def annotate(self, audio_path: str = None, duration: float = None, params: dict = None):
+        """补充当前请求的音频时长、参数；开启音频录制时复制一份音频"""
+        entry = _current.get()
+        if entry is None:
+            return
+        if duration is not None:
+            entry["duration"] = round(duration, 3)
+        if params:
+            entry["params"].update({k: v for k, v in params.items() if v is not None})
+        if audio_path and self.record_audio and os.path.exists(audio_path):
+            name = f"{uuid.uuid4().hex}{os.path.splitext(audio_path)[1]}"
+            try:
+                shutil.copyfile(audio_path, os.path.join(self.root, 'audio', name))
+                entry["audio"] = f"audio/{name}"
+            except OSError as e:
+                logger.warning(f"保存录制音频失败: {e}")
+
+    def finish(self, entry: dict, status: int = None):
+        """请求结束（流式响应发送完毕）：写入一行记录"""
+        if entry is None:
+            return
+        _current.set(None)
+        entry["status"] = status
+        entry["latency_ms"] = round((time.perf_counter() - entry.pop("_started")) * 1000, 1)
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                f.write(line)
+            self.recorded += 1
+
+    def status(self) -> dict:
+        return {"enabled": self.enabled, "sample_rate": self.sample_rate,
+                "record_audio": self.record_audio, "recorded": self.recorded}
+
+
+traffic_recorder = TrafficRecorder.from_env()
@@ -0,0 +1,174 @@
+"""硬件自动调优 - 在当前机器上扫描分段时长、批大小和 intra-op 线程数，写出 GPUManager 启动时加载的配置
+
+用法:
+    python tuning.py --audio calib1.wav calib2.wav [--objective rtf|latency] [--output tuning_profile.json]
+
+依次扫描线程数、分段时长、批大小（每一轮固定前几轮选出的最优值），以校准音频集的实时率（RTF）
+或 p95 延迟为目标。配置中记录硬件指纹，GPUManager 只在指纹一致时采用，显式设置的环境变量优先。
+"""
+import argparse
+import json
+import os
+import platform
+import time
+import logging
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROFILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tuning_profile.json')
+# 可调参数 -> 覆盖它的环境变量
+TUNABLE = {
+    "num_threads": "TORCH_NUM_THREADS",
+    "segment_max_s": "SEGMENT_MAX_S",
+    "segment_min_s": "SEGMENT_MIN_S",
+    "max_batch": "MAX_BATCH_SIZE",
+}
+
+
+def profile_path() -> str:
+    return os.environ.get('TUNING_PROFILE', DEFAULT_PROFILE)
+
+
+def hardware_fingerprint() -> dict:
+    """决定调优结果是否适用的硬件信息"""
+    fingerprint = {
+        "device": "cuda" if torch.cuda.is_available() else "cpu",
+        "cpu": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+    if torch.cuda.is_available():
+        fingerprint["gpu"] = torch.cuda.get_device_name(0)
+        fingerprint["gpu_count"] = torch.cuda.device_count()
+    return fingerprint
+
+
+def load_profile(path: str = None) -> dict:
+    """读取调优配置；不存在、损坏或硬件不一致时返回 None"""
+    path = path or profile_path()
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding='utf-8') as f:
+            profile = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"调优配置读取失败 ({path}): {e}")
+        return None
+    if profile.get("hardware") != hardware_fingerprint():
+        logger.warning(f"调优配置 {path} 来自不同硬件 {profile.get('hardware')}，已忽略")
+        return None
+    profile["path"] = path
+    return profile
+
+
+def save_profile(path: str, params: dict, objective: str, measurements: list):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            "hardware": hardware_fingerprint(),
+            "created": time.time(),
+            "objective": objective,
+            "params": params,
+            "measurements": measurements,
+        }, f, ensure_ascii=False, indent=2)
+
+
+def resolve_param(profile: dict, name: str, default, cast=float) -> dict:
+    """取一个可调参数：环境变量 > 调优配置 > 默认值，返回 {"value", "source"}"""
+    env = TUNABLE[name]
+    if os.environ.get(env):
+        return {"value": cast(os.environ[env]), "source": "env"}
+    if profile and name in profile["params"]:
+        return {"value": cast(profile["params"][name]), "source": "profile"}
+    return {"value": default, "source": "default"}
+
+
+# ==================== 扫描 ====================
+def apply_params(manager, params: dict):
+    torch.set_num_threads(params["num_threads"])
+    manager.segment_max_s = params["segment_max_s"]
+    manager.batcher.max_batch = manager.batcher.ceiling = params["max_batch"]
+
+
+def measure(manager, wavs: list, params: dict, max_new_tokens: int) -> dict:
+    """用给定参数转录全部校准音频，返回实时率和单文件延迟"""
+    apply_params(manager, params)
+    latencies = []
+    for wav in wavs:
+        started = time.perf_counter()
+        manager.transcribe(wav, max_new_tokens)
+        latencies.append(time.perf_counter() - started)
+    audio = sum(wav.shape[1] for wav in wavs) / 16000
+    ordered = sorted(latencies)
+    result = {
+        "params": dict(params),
+        "rtf": round(sum(latencies) / audio, 4),
+        "latency_p50_s": round(ordered[len(ordered) // 2], 3),
+        "latency_p95_s": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 3),
+    }
+    logger.info(f"{params}: RTF {result['rtf']}, p50 {result['latency_p50_s']}s, p95 {result['latency_p95_s']}s")
+    return result
+
+
+def autotune(manager, wavs: list, sweeps: dict, max_new_tokens: int, objective: str) -> tuple:
+    """逐个参数扫描（坐标下降），返回 (最优参数, 全部测量结果)"""
+    key = "rtf" if objective == "rtf" else "latency_p95_s"
+    best = {
+        "num_threads": torch.get_num_threads(),
+        "segment_max_s": manager.segment_max_s,
+        "segment_min_s": manager.segment_min_s,
+        "max_batch": manager.batcher.max_batch,
+    }
+    # 同一批校准音频要反复转录，关闭分段缓存以免命中结果冒充推理速度
+    manager.segment_cache.max_entries = 0
+    manager.segment_cache.clear()
+    # 预热：首次运行的显存分配、内核选择不计入测量
+    apply_params(manager, best)
+    manager.transcribe(wavs[0], max_new_tokens)
+
+    measurements = []
+    for name in ("num_threads", "segment_max_s", "max_batch"):
+        results = [measure(manager, wavs, {**best, name: value}, max_new_tokens) for value in sweeps[name]]
+        measurements += results
+        best = min(results, key=lambda r: r[key])["params"]
+        logger.info(f"{name} = {best[name]}")
+    apply_params(manager, best)
+    return best, measurements
+
+
+def default_threads() -> list:
+    count = os.cpu_count() or 1
+    values = [n for n in (1, 2, 4, 8, 16, 32, 64) if n < count]
+    return values + [count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GLM-ASR 硬件自动调优")
+    parser.add_argument("--audio", nargs="+", required=True, help="校准音频（应覆盖线上常见时长）")
+    parser.add_argument("--checkpoint", default=os.environ.get('MODEL_CHECKPOINT', 'zai-org/GLM-ASR-Nano-2512'))
+    parser.add_argument("--output", default=profile_path())
+    parser.add_argument("--objective", choices=["rtf", "latency"], default="rtf",
+                        help="rtf: 吞吐优先；latency: 单文件 p95 延迟优先")
+    parser.add_argument("--threads", type=int, nargs="+", default=default_threads())
+    parser.add_argument("--segment_lengths", type=float, nargs="+", default=[10, 15, 20, 25, 30])
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--max_new_tokens", type=int, default=512)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    from gpu_manager import gpu_manager, load_audio
+
+    gpu_manager.load(args.checkpoint)
+    wavs = [load_audio(path) for path in args.audio]
+    sweeps = {"num_threads": args.threads, "segment_max_s": args.segment_lengths, "max_batch": args.batch_sizes}
+    best, measurements = autotune(gpu_manager, wavs, sweeps, args.max_new_tokens, args.objective)
+    save_profile(args.output, best, args.objective, measurements)
+
+    chosen = next(m for m in measurements if m["params"] == best)
+    print(f"\n最优参数: {best}")
+    print(f"RTF {chosen['rtf']}, p50 {chosen['latency_p50_s']}s, p95 {chosen['latency_p95_s']}s")
+    print(f"已写入 {args.output}，GPUManager 启动时自动加载")
+
+
+if __name__ == "__main__":
+    main()
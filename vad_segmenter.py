@@ -1,45 +1,121 @@
 """VAD 智能音频分段模块 - 基于 silero-vad"""
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
 import torch
 import torchaudio
 import logging
 
 logger = logging.getLogger(__name__)
 
-# 全局 VAD 模型（懒加载）
-_vad_model = None
-_vad_utils = None
 
+def load_vad_model():
+    """加载一个新的 silero-vad 实例，返回 (model, utils)"""
+    return torch.hub.load('snakers4/silero-vad', 'silero_vad', trust_repo=True)
+
+
+class VADPool:
+    """silero-vad 实例池：每次检测独占一个实例
+
+    silero 模型带内部状态，同一实例不能被多个线程同时使用；池中实例数默认等于推理线程数
+    （INFERENCE_WORKERS），排队中的请求可以在模型生成的同时各自在 CPU 上分段。
+    preload() 在启动时加载全部实例，未预加载时按需加载到上限。
+    """
+
+    def __init__(self, size: int = 4):
+        self.size = max(1, size)
+        self._idle = queue.Queue()
+        self._loaded = 0
+        self._lock = threading.Lock()
+        # torch.hub 加载（首次会下载）串行进行
+        self._load_lock = threading.Lock()
+        self.stats = {"calls": 0, "waits": 0, "wait_ms_total": 0.0}
+
+    @classmethod
+    def from_env(cls) -> "VADPool":
+        return cls(size=int(os.environ.get('VAD_POOL_SIZE', os.environ.get('INFERENCE_WORKERS', 4))))
+
+    def preload(self):
+        """加载到 size 个实例；失败时只记录警告，首次分段时再加载"""
+        try:
+            while self._reserve():
+                self._idle.put(self._load())
+        except Exception as e:
+            logger.warning(f"VAD 模型预加载失败，将在首次分段时重试: {e}")
+
+    def _reserve(self) -> bool:
+        with self._lock:
+            if self._loaded >= self.size:
+                return False
+            self._loaded += 1
+            return True
+
+    def _load(self):
+        try:
+            with self._load_lock:
+                return load_vad_model()
+        except Exception:
+            with self._lock:
+                self._loaded -= 1
+            raise
+
+    @contextmanager
+    def acquire(self):
+        """取出一个空闲实例 (model, utils)，用完归还；实例都在使用中时等待"""
+        started = time.perf_counter()
+        try:
+            instance = self._idle.get_nowait()
+        except queue.Empty:
+            instance = self._load() if self._reserve() else self._idle.get()
+        waited = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.stats["calls"] += 1
+            if waited >= 1:
+                self.stats["waits"] += 1
+                self.stats["wait_ms_total"] += waited
+        try:
+            yield instance
+        finally:
+            self._idle.put(instance)
+
+    def status(self) -> dict:
+        with self._lock:
+            idle = self._idle.qsize()
+            return {
+                "size": self.size,
+                "loaded": self._loaded,
+                "busy": self._loaded - idle,
+                "calls": self.stats["calls"],
+                "waits": self.stats["waits"],
+                "wait_ms_avg": round(self.stats["wait_ms_total"] / self.stats["waits"], 1) if self.stats["waits"] else None,
+            }
 
-def get_vad_model():
-    """获取 VAD 模型（单例）"""
-    global _vad_model, _vad_utils
-    if _vad_model is None:
-        _vad_model, _vad_utils = torch.hub.load(
-            'snakers4/silero-vad', 'silero_vad', trust_repo=True
-        )
-    return _vad_model, _vad_utils
+
+vad_pool = VADPool.from_env()
 
 
 def detect_speech_segments(wav: torch.Tensor, sr: int = 16000) -> list:
-    """检测语音段落
+    """检测语音段落（线程安全，从 vad_pool 取实例）
     
     Returns:
         list of (start_sample, end_sample) 语音区间
     """
-    model, utils = get_vad_model()
-    get_speech_timestamps = utils[0]
-    
     # silero-vad 需要 16kHz 单声道
     if wav.dim() == 2:
         wav = wav[0]
     
-    speech_timestamps = get_speech_timestamps(
-        wav, model,
-        sampling_rate=sr,
-        threshold=0.5,
-        min_speech_duration_ms=250,
-        min_silence_duration_ms=300,
-    )
+    with vad_pool.acquire() as (model, utils):
+        get_speech_timestamps = utils[0]
+        speech_timestamps = get_speech_timestamps(
+            wav, model,
+            sampling_rate=sr,
+            threshold=0.5,
+            min_speech_duration_ms=250,
+            min_silence_duration_ms=300,
+        )
     
     return [(s['start'], s['end']) for s in speech_timestamps]
 
@@ -121,3 +197,157 @@ def smart_segment(wav: torch.Tensor, sr: int = 16000,
     
     logger.info(f"音频分段: 总时长 {total_samples/sr:.1f}s, 分成 {len(final_segments)} 段")
     return final_segments
+
+
+def pack_speech_segments(speech_segments: list, sr: int = 16000,
+                         max_duration: float = 25.0,
+                         gap_duration: float = 0.2) -> list:
+    """语音紧凑打包：只拼接语音区间，区间之间插入短静音，填满每个窗口
+
+    Args:
+        speech_segments: detect_speech_segments 返回的 (start_sample, end_sample) 列表
+        sr: 采样率
+        max_duration: 打包后窗口最大时长（秒）
+        gap_duration: 相邻语音区间之间插入的静音时长（秒）
+
+    Returns:
+        list of {"spans": [(orig_start, orig_end, packed_offset), ...], "length": packed_samples}
+        spans 记录每段语音在原始音频和打包窗口中的位置，用于还原时间戳
+    """
+    max_samples = int(max_duration * sr)
+    gap = int(gap_duration * sr)
+
+    windows = []
+    spans, length = [], 0
+    for start, end in speech_segments:
+        # 连续说话超过窗口上限时先强制切分
+        for piece_start in range(start, end, max_samples):
+            piece_end = min(piece_start + max_samples, end)
+            offset = length + gap if spans else 0
+            if spans and offset + (piece_end - piece_start) > max_samples:
+                windows.append({"spans": spans, "length": length})
+                spans, length, offset = [], 0, 0
+            spans.append((piece_start, piece_end, offset))
+            length = offset + (piece_end - piece_start)
+    if spans:
+        windows.append({"spans": spans, "length": length})
+    return windows
+
+
+def build_packed_audio(wav: torch.Tensor, window: dict) -> torch.Tensor:
+    """按打包窗口拼接语音区间，区间之间保持静音"""
+    if wav.dim() == 2:
+        wav = wav[0]
+    packed = torch.zeros(window["length"], dtype=wav.dtype)
+    for start, end, offset in window["spans"]:
+        packed[offset:offset + end - start] = wav[start:end]
+    return packed
+
+
+def packed_to_original(window: dict, packed_sample: int) -> int:
+    """把打包窗口内的采样位置映射回原始音频（落在插入的静音里时取下一段语音的起点）"""
+    for start, end, offset in window["spans"]:
+        if packed_sample < offset:
+            return start
+        if packed_sample < offset + end - start:
+            return start + packed_sample - offset
+    last_start, last_end, _ = window["spans"][-1]
+    return last_end
+
+
+def packed_segment(wav: torch.Tensor, sr: int = 16000,
+                   max_duration: float = 25.0,
+                   gap_duration: float = 0.2) -> list:
+    """VAD 检测后做语音紧凑打包，返回 pack_speech_segments 格式的窗口列表"""
+    if wav.dim() == 2:
+        wav = wav[0]
+
+    speech_segments = detect_speech_segments(wav, sr)
+    windows = pack_speech_segments(speech_segments, sr, max_duration, gap_duration)
+
+    speech = sum(end - start for start, end in speech_segments) / sr
+    logger.info(f"语音打包: 总时长 {wav.shape[0]/sr:.1f}s, 语音 {speech:.1f}s, 打包为 {len(windows)} 个窗口")
+    return windows
+
+
+class IncrementalSegmenter:
+    """增量分段：音频边到达边做 VAD，已确定的分段立即返回，不必等完整音频
+
+    与 smart_segment 一样在静音处切分、每段 ≤ max_duration；
+    只对尚未确定的尾部重新检测，距末尾不足 guard_duration 的语音视为未结束。
+    已归入分段的音频会被丢弃，缓冲区只保留未确定的尾部。
+    """
+
+    def __init__(self, sr: int = 16000, max_duration: float = 25.0,
+                 guard_duration: float = 1.0, scan_interval: float = 2.0):
+        self.sr = sr
+        self.max_samples = int(max_duration * sr)
+        self.guard = int(guard_duration * sr)
+        self.scan_interval = int(scan_interval * sr)
+        self.buffer = torch.zeros(0)
+        self.base = 0          # buffer[0] 对应的绝对采样位置
+        self.scanned = 0       # 上次检测时的音频长度
+        self.committed = 0     # 此前的语音区间已归入分段
+        self.group = None      # 正在累积的分段 (start, end)
+
+    @property
+    def total_samples(self) -> int:
+        return self.base + self.buffer.shape[0]
+
+    def audio(self, start: int, end: int) -> torch.Tensor:
+        """取出分段音频（须在下一次 feed 之前调用）"""
+        return self.buffer[start - self.base:end - self.base]
+
+    def feed(self, samples: torch.Tensor) -> list:
+        """追加 16kHz 单声道采样，返回新确定的 (start_sample, end_sample) 分段"""
+        keep = min(self.committed, self.group[0] if self.group else self.committed)
+        if keep > self.base:
+            self.buffer = self.buffer[keep - self.base:]
+            self.base = keep
+        self.buffer = torch.cat([self.buffer, samples.reshape(-1).float()])
+        if self.total_samples - self.scanned < self.scan_interval:
+            return []
+        return self._scan(final=False)
+
+    def finish(self) -> list:
+        """音频结束，返回剩余的全部分段"""
+        segments = self._scan(final=True)
+        self._close(segments)
+        return segments
+
+    def _close(self, segments: list):
+        if self.group:
+            segments.append(self.group)
+            self.group = None
+
+    def _add_speech(self, start: int, end: int, segments: list):
+        # 连续说话超过上限时强制切分
+        for piece_start in range(start, end, self.max_samples):
+            piece_end = min(piece_start + self.max_samples, end)
+            if self.group and piece_end - self.group[0] > self.max_samples:
+                self._close(segments)
+            self.group = (self.group[0], piece_end) if self.group else (piece_start, piece_end)
+
+    def _scan(self, final: bool) -> list:
+        self.scanned = self.total_samples
+        segments = []
+        tail = self.buffer[self.committed - self.base:]
+        if tail.shape[0] == 0:
+            return segments
+        speech = [(s + self.committed, e + self.committed) for s, e in detect_speech_segments(tail, self.sr)]
+        for start, end in speech:
+            if not final and end > self.total_samples - self.guard:
+                # 语音可能仍在继续：累积分段放不下时先结束它，过长时切出已满的窗口
+                if self.group and end - self.group[0] > self.max_samples:
+                    self._close(segments)
+                if end - start > self.max_samples:
+                    self._add_speech(start, start + self.max_samples, segments)
+                    self._close(segments)
+                    self.committed = start + self.max_samples
+                return segments
+            self._add_speech(start, end, segments)
+            self.committed = end
+        if not final:
+            # 尾部静音：保留 guard 长度以免截断刚开始的语音
+            self.committed = max(self.committed, self.total_samples - self.guard)
+        return segments